@@ -4,9 +4,11 @@
 This DAG runs tasks on Gadi at the NCI. This DAG routinely sync Collection 3
 data from NCI to AWS S3 bucket. It:
 
- * List scenes to be uploaded to S3 bucket from indexed DB.
+ * List scenes to be uploaded to S3 bucket from indexed DB, for each product.
  * Uploads `C3 to S3 rolling` script to NCI work folder.
- * Executes uploaded rolling script to upload `Collection 3` data to AWS `S3` bucket.
+ * Executes uploaded rolling script once for all the products, sharing its workers
+   between them, to upload `Collection 3` data to AWS `S3` bucket.
+   A retry resumes from the journal the previous attempt left in the work folder.
  * Cleans working folder at `NCI` after upload completion.
 
 This DAG takes following input parameters from `nci_c3_upload_s3_config` variable:
@@ -95,13 +97,17 @@ RUN_UPLOAD_SCRIPT = dedent("""
     export AWS_SECRET_ACCESS_KEY={{aws_creds.secret_key}}
 
     python3 '{{ work_dir }}/c3_to_s3_rolling.py' \
-            --filepath '{{ work_dir }}/{{ params.product }}.csv' \
+            {% for product in params.products -%}
+            --filepath '{{ work_dir }}/{{ product }}.csv' \
+            {% endfor -%}
             --ncidir '{{ params.nci_dir }}' \
             --s3path '{{ var.json.nci_c3_upload_s3_config.s3path }}' \
             --s3bucket '{{ var.json.nci_c3_upload_s3_config.s3bucket }}' \
             --s3baseurl '{{ var.json.nci_c3_upload_s3_config.s3baseurl }}' \
             --explorerbaseurl '{{ var.json.nci_c3_upload_s3_config.explorerbaseurl }}' \
             --snstopic '{{ var.json.nci_c3_upload_s3_config.snstopic }}' \
+            --workers {{ params.workers }} \
+            --journal '{{ work_dir }}/journal.jsonl' \
             {{ var.json.nci_c3_upload_s3_config.doupdate }}
 """)
 
@@ -129,11 +135,43 @@ dag = DAG(
 )
 
 with dag:
+    WORK_DIR = f'/g/data/v10/work/c3_upload_s3/{"{{ ts_nodash }}"}'
+    COMMON = dedent("""
+            {% set work_dir = '/g/data/v10/work/c3_upload_s3/' + ts_nodash -%}
+            """)
+    # Uploading c3_to_s3_rolling.py script to NCI
+    sftp_c3_to_s3_script = SFTPOperator(
+        task_id="sftp_c3_to_s3_script",
+        local_filepath=str(Path(configuration.get("core", "dags_folder")).parent / "scripts/c3_to_s3_rolling.py"),
+        remote_filepath=f"{WORK_DIR}/c3_to_s3_rolling.py",
+        operation=SFTPOperation.PUT,
+        create_intermediate_dirs=True,
+    )
+    # Execute script to upload Landsat collection 3 data to s3 bucket, all the
+    # products in one process so they share its connections and workers
+    aws_hook = AwsHook(aws_conn_id=dag.default_args["aws_conn_id"])
+    execute_c3_to_s3_script = SSHOperator(
+        task_id="execute_c3_to_s3_script",
+        command=COMMON + RUN_UPLOAD_SCRIPT,
+        remote_host="gadi-dm.nci.org.au",
+        params={
+            "aws_hook": aws_hook,
+            "products": collection3_products,
+            "nci_dir": "/g/data/xu18/ga/",
+            "workers": 16,
+        },
+    )
+    # Deletes working folder and uploaded script file
+    clean_nci_work_dir = SSHOperator(
+        task_id="clean_nci_work_dir",
+        # Remove work dir after aws s3 sync
+        command=COMMON + dedent("""
+                set -eux
+                rm -vrf "{{ work_dir }}"
+            """
+                                ),
+    )
     for product in collection3_products:
-        WORK_DIR = f'/g/data/v10/work/c3_upload_s3/{product}/{"{{ ts_nodash }}"}'
-        COMMON = dedent("""
-                {% set work_dir = '/g/data/v10/work/c3_upload_s3/' + params.product  +'/' + ts_nodash -%}
-                """)
         # List all the scenes to be uploaded to S3 bucket
         list_scenes = SSHOperator(
             task_id=f"list_{product}_scenes",
@@ -142,37 +180,6 @@ with dag:
             params={"product": product},
             do_xcom_push=False,
         )
-        # Uploading c3_to_s3_rolling.py script to NCI
-        sftp_c3_to_s3_script = SFTPOperator(
-            task_id=f"sftp_c3_to_s3_script_{product}",
-            local_filepath=str(Path(configuration.get("core", "dags_folder")).parent / "scripts/c3_to_s3_rolling.py"),
-            remote_filepath=f"{WORK_DIR}/c3_to_s3_rolling.py",
-            operation=SFTPOperation.PUT,
-            create_intermediate_dirs=True,
-        )
-        # Execute script to upload Landsat collection 3 data to s3 bucket
-        aws_hook = AwsHook(aws_conn_id=dag.default_args["aws_conn_id"])
-        execute_c3_to_s3_script = SSHOperator(
-            task_id=f"execute_c3_to_s3_script_{product}",
-            command=COMMON + RUN_UPLOAD_SCRIPT,
-            remote_host="gadi-dm.nci.org.au",
-            params={
-                "aws_hook": aws_hook,
-                "product": product,
-                "nci_dir": "/g/data/xu18/ga/",
-            },
-        )
-        # Deletes working folder and uploaded script file
-        clean_nci_work_dir = SSHOperator(
-            task_id=f"clean_nci_work_dir_{product}",
-            # Remove work dir after aws s3 sync
-            command=COMMON + dedent("""
-                    set -eux
-                    rm -vrf "{{ work_dir }}"
-                """
-                                    ),
-            params={"product": product},
-        )
         list_scenes >> sftp_c3_to_s3_script
-        sftp_c3_to_s3_script >> execute_c3_to_s3_script
-        execute_c3_to_s3_script >> clean_nci_work_dir
+    sftp_c3_to_s3_script >> execute_c3_to_s3_script
+    execute_c3_to_s3_script >> clean_nci_work_dir
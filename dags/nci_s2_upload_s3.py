@@ -6,7 +6,8 @@ data from NCI to AWS S3 bucket. It:
 
  * Uploads `Sentinel-2 to S3 rolling` script to NCI work folder.
  * Finds all the new data added since the last run, saves them into a txt file
- * Executes the upload script to upload the data and mangle and upload the metadata file to S3
+ * Executes the upload script to upload the data and mangle and upload the metadata file to S3.
+   A retry skips the datasets the ledger in the work folder records as uploaded.
 
 """
 from datetime import datetime, timedelta
@@ -0,0 +1,638 @@
+#!/usr/bin/env python3
+"""
+Benchmark the NCI to S3 uploaders against a local S3/SNS stand-in
+
+Generates synthetic granule trees, with metadata, checksum and fake band files,
+plus the csv or url list the uploaders read, then runs `c3_to_s3_rolling.py` or
+`upload_s2.py` against a local moto server and reports granules/s, bytes/s and
+API calls per granule. Runs offline, so throughput regressions show up in review:
+
+    python scripts/benchmark_uploaders.py c3 --granules 200 --workers 8
+    python scripts/benchmark_uploaders.py s2 --granules 200 --workers 10
+
+Needs moto[server] on top of the uploaders' own dependencies.
+"""
+import hashlib
+import importlib.util
+import json
+import logging
+import multiprocessing
+import os
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from datetime import date, timedelta
+from pathlib import Path
+
+import boto3
+import click
+import yaml
+from moto.moto_server.werkzeug_app import (
+    DomainDispatcherApplication,
+    create_backend_app,
+)
+from werkzeug.serving import make_server
+
+LOG = logging.getLogger("benchmark_uploaders")
+
+SCRIPTS_DIR = Path(__file__).parent
+AWS_REGION = "ap-southeast-2"
+BUCKET = "dea-public-data"
+
+C3_PRODUCT = "ga_ls8c_ard_3"
+C3_BANDS = ["blue", "green", "red", "nir", "swir_1", "swir_2"]
+S2_BANDS = [
+    "blue",
+    "coastal_aerosol",
+    "contiguity",
+    "green",
+    "nir_1",
+    "nir_2",
+    "red",
+    "red_edge_1",
+    "red_edge_2",
+    "red_edge_3",
+    "swir_2",
+    "swir_3",
+]
+
+
+class ApiCallCounter:
+    """
+    WSGI middleware counting the requests made to the stand-in, per AWS service,
+    and the bytes uploaded to S3
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.calls = Counter()
+        self.uploaded_bytes = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, environ, start_response):
+        # Credential=<key>/<date>/<region>/<service>/aws4_request
+        authorization = environ.get("HTTP_AUTHORIZATION", "")
+        scope = authorization.split("Credential=")[-1].split(",")[0].split("/")
+        service = scope[3] if len(scope) > 3 else "unsigned"
+        uploaded_bytes = 0
+        if service == "s3" and environ["REQUEST_METHOD"] == "PUT":
+            # PutObject and UploadPart, without the framing of aws-chunked bodies
+            uploaded_bytes = int(
+                environ.get("HTTP_X_AMZ_DECODED_CONTENT_LENGTH")
+                or environ.get("CONTENT_LENGTH")
+                or 0
+            )
+        with self._lock:
+            self.calls[service] += 1
+            self.uploaded_bytes += uploaded_bytes
+        return self.app(environ, start_response)
+
+    def reset(self):
+        with self._lock:
+            self.calls = Counter()
+            self.uploaded_bytes = 0
+
+
+@contextmanager
+def local_aws(port):
+    """
+    Run a moto server on localhost and point boto3 and the aws cli at it
+
+    :param port: Port to listen on
+    :return: Context manager yielding the ApiCallCounter of the server
+    """
+    counter = ApiCallCounter(DomainDispatcherApplication(create_backend_app))
+    server = make_server("127.0.0.1", port, counter, threaded=True)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    environment = {
+        "AWS_ACCESS_KEY_ID": "benchmark",
+        "AWS_SECRET_ACCESS_KEY": "benchmark",
+        "AWS_DEFAULT_REGION": AWS_REGION,
+        "AWS_ENDPOINT_URL": f"http://127.0.0.1:{port}",
+        # Used by odc.aws when upload_s2.py builds its client
+        "AWS_S3_ENDPOINT": f"http://127.0.0.1:{port}",
+    }
+    previous = {name: os.environ.get(name) for name in environment}
+    os.environ.update(environment)
+    try:
+        yield counter
+    finally:
+        server.shutdown()
+        for name, value in previous.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+
+
+def load_script(name):
+    """
+    Import one of the uploader scripts from this directory
+
+    :param name: File name of the script without .py
+    :return: Module
+    """
+    spec = importlib.util.spec_from_file_location(name, SCRIPTS_DIR / f"{name}.py")
+    module = importlib.util.module_from_spec(spec)
+    # So its functions can be sent to process pools
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+def write_fake_file(file_path, size):
+    """
+    Write a file of random bytes
+
+    :param file_path: Path of the file
+    :param size: Size in bytes
+    :return: sha1 checksum of the file
+    """
+    data = os.urandom(size)
+    file_path.write_bytes(data)
+    return hashlib.sha1(data).hexdigest()
+
+
+def make_c3_granules(nci_dir, granules, file_size):
+    """
+    Generate Collection 3 ARD granules, with eo3 metadata, a .sha1 checksum file
+    and fake NBAR, NBART and OA bands
+
+    :param nci_dir: Directory standing in for /g/data/xu18/ga
+    :param granules: Number of granules
+    :param file_size: Size of each band file in bytes
+    :return: List of metadata file paths
+    """
+    metadata_files = []
+    for index in range(granules):
+        path, row = 88 + index % 20, 70 + index // 20 % 20
+        day = date(2020, 1, 1) + timedelta(days=index // 400)
+        region_code = f"{path:03}{row:03}"
+        label = f"{C3_PRODUCT}-1-0-0_{region_code}_{day}_final"
+        granule_dir = (
+            Path(nci_dir) / C3_PRODUCT / f"{path:03}" / f"{row:03}"
+        ).joinpath(*f"{day:%Y/%m/%d}".split("/"))
+        granule_dir.mkdir(parents=True, exist_ok=True)
+        prefix = f"ga_ls8c_{{}}_3-1-0_{region_code}_{day}_final"
+
+        checksums = {}
+        measurements = {}
+        files = {
+            f"{product}_{band}": f"{prefix.format(product)}_band{number:02}.tif"
+            for number, band in enumerate(C3_BANDS, start=2)
+            for product in ("nbar", "nbart")
+        }
+        files["oa_fmask"] = f"{prefix.format('oa')}_fmask.tif"
+        files["oa_nbar_contiguity"] = f"{prefix.format('oa')}_nbar-contiguity.tif"
+        for measurement, file_name in files.items():
+            checksums[file_name] = write_fake_file(granule_dir / file_name, file_size)
+            measurements[measurement] = {"path": file_name}
+        thumbnails = {}
+        for product in ("nbar", "nbart"):
+            file_name = f"{prefix.format(product)}_thumbnail.jpg"
+            checksums[file_name] = write_fake_file(granule_dir / file_name, 1024)
+            thumbnails[f"thumbnail:{product}"] = {"path": file_name}
+
+        metadata_doc = {
+            "$schema": "https://schemas.opendatacube.org/dataset",
+            "id": str(uuid.uuid5(uuid.NAMESPACE_URL, label)),
+            "label": label,
+            "product": {
+                "name": C3_PRODUCT,
+                "href": f"https://collections.dea.ga.gov.au/product/{C3_PRODUCT}",
+            },
+            "crs": "epsg:32655",
+            "geometry": {
+                "type": "Polygon",
+                "coordinates": [
+                    [
+                        [500000.0, -4000000.0],
+                        [700000.0, -4000000.0],
+                        [700000.0, -4200000.0],
+                        [500000.0, -4200000.0],
+                        [500000.0, -4000000.0],
+                    ]
+                ],
+            },
+            "grids": {
+                "default": {
+                    "shape": [6667, 6667],
+                    "transform": [30.0, 0.0, 500000.0, 0.0, -30.0, -4000000.0, 0, 0, 1],
+                }
+            },
+            "properties": {
+                "datetime": f"{day}T00:00:00Z",
+                "dea:dataset_maturity": "final",
+                "eo:cloud_cover": 12.5,
+                "eo:instrument": "OLI_TIRS",
+                "eo:platform": "landsat-8",
+                "odc:file_format": "GeoTIFF",
+                "odc:processing_datetime": f"{day}T12:00:00Z",
+                "odc:producer": "ga.gov.au",
+                "odc:product_family": "ard",
+                "odc:region_code": region_code,
+            },
+            "measurements": measurements,
+            "accessories": dict(
+                thumbnails, **{"checksum:sha1": {"path": f"{label}.sha1"}}
+            ),
+            "lineage": {},
+        }
+        metadata_file = granule_dir / f"{label}.odc-metadata.yaml"
+        metadata_file.write_text(yaml.safe_dump(metadata_doc, sort_keys=False))
+        checksums[metadata_file.name] = hashlib.sha1(
+            metadata_file.read_bytes()
+        ).hexdigest()
+        with (granule_dir / f"{label}.sha1").open("w") as f:
+            for file_name, checksum in sorted(checksums.items()):
+                f.write(f"{checksum}\t{file_name}\n")
+        metadata_files.append(metadata_file)
+    return metadata_files
+
+
+def make_s2_granules(nci_dir, granules, file_size):
+    """
+    Generate Sentinel-2 ARD granules, with ARD-METADATA.yaml and fake NBAR, NBART
+    and QA bands
+
+    :param nci_dir: Directory standing in for the packaged S2 ARD directory
+    :param granules: Number of granules
+    :param file_size: Size of each band file in bytes
+    :return: List of destination S3 urls
+    """
+    s3_urls = []
+    for index in range(granules):
+        day = date(2020, 1, 1) + timedelta(days=index // 100)
+        tile_id = f"S2A_OPER_MSI_ARD_TL_EPAE_{day:%Y%m%d}T000000_A{index:06}_T55HFA_N02.09"
+        granule_dir = Path(nci_dir) / f"{day}" / tile_id
+        for product in ("NBAR", "NBART"):
+            (granule_dir / product).mkdir(parents=True, exist_ok=True)
+            for band in S2_BANDS:
+                write_fake_file(
+                    granule_dir / product / f"{product}_{band.upper()}.TIF", file_size
+                )
+        (granule_dir / "QA").mkdir(exist_ok=True)
+        write_fake_file(granule_dir / "QA" / "FMASK.TIF", file_size)
+
+        (granule_dir / "ARD-METADATA.yaml").write_text(
+            yaml.safe_dump(s2_metadata_doc(tile_id, day))
+        )
+        s3_urls.append(
+            f"s3://{BUCKET}/L2/sentinel-2-nbar/S2MSIARD_NBAR/{day}/{tile_id}/"
+            "ARD-METADATA.yaml"
+        )
+    return s3_urls
+
+
+def s2_metadata_doc(tile_id, day):
+    """
+    Sentinel-2 ARD metadata document, with a level 1 lineage about the size of
+    the real ones
+
+    :param tile_id: ARD tile id of the granule
+    :param day: Date of the granule
+    :return: Dict
+    """
+    level1_tile_id = tile_id.replace("ARD", "L1C")
+    return {
+        "id": str(uuid.uuid5(uuid.NAMESPACE_URL, tile_id)),
+        "product_type": "ard",
+        "tile_id": level1_tile_id,
+        "creation_dt": f"{day}T12:00:00",
+        "extent": {
+            "center_dt": f"{day}T00:00:00",
+            "coord": {
+                corner: {"lat": -35.0 - i * 0.5, "lon": 148.0 + i * 0.5}
+                for i, corner in enumerate(["ll", "lr", "ul", "ur"])
+            },
+        },
+        "image": {
+            "bands": {
+                f"{product.lower()}_{band}": {
+                    "path": f"{product}/{product}_{band.upper()}.TIF",
+                    "layer": 1,
+                }
+                for product in ("NBAR", "NBART")
+                for band in S2_BANDS
+            }
+        },
+        "lineage": {
+            "source_datasets": {
+                "level1": {
+                    "id": str(uuid.uuid5(uuid.NAMESPACE_URL, level1_tile_id)),
+                    "tile_id": level1_tile_id,
+                    "image": {
+                        "bands": {
+                            f"B{number:02}": {
+                                "path": f"IMG_DATA/{level1_tile_id}_B{number:02}.jp2",
+                                "layer": 1,
+                                "info": {
+                                    "width": 10980,
+                                    "height": 10980,
+                                    "geotransform": [
+                                        600000.0, 10.0, 0.0, 6100000.0, 0.0, -10.0
+                                    ],
+                                },
+                            }
+                            for number in range(1, 13)
+                        },
+                        "sun_azimuth": 61.2,
+                        "sun_elevation": 51.6,
+                    },
+                    "processing_level": "Level-1C",
+                    "grid_spatial": {
+                        "projection": {
+                            "spatial_reference": "PROJCS[\"WGS 84 / UTM zone 55S\"]",
+                            "geo_ref_points": {
+                                corner: {"x": 600000.0 + i * 109800.0, "y": 6100000.0}
+                                for i, corner in enumerate(["ll", "lr", "ul", "ur"])
+                            },
+                        }
+                    },
+                }
+            }
+        },
+        "software_versions": {
+            name: {"version": "1.0.0", "repo_url": f"https://github.com/ga/{name}"}
+            for name in ["eodatasets", "gaip", "fmask", "wagl", "tesp"]
+        },
+    }
+
+
+def report(name, granules, seconds, uploaded_bytes, api_calls, failed):
+    """
+    Log and return the throughput of a benchmark run
+
+    :param name: Name of the uploader
+    :param granules: Number of granules uploaded
+    :param seconds: Wall time of the upload
+    :param uploaded_bytes: Bytes of the objects and parts uploaded to S3
+    :param api_calls: Counter of API calls per AWS service
+    :param failed: Error message if the uploader failed, else None
+    :return: Dict of results
+    """
+    results = {
+        "uploader": name,
+        "granules": granules,
+        "seconds": round(seconds, 3),
+        "granules_per_second": round(granules / seconds, 2),
+        "mib_per_second": round(uploaded_bytes / 2 ** 20 / seconds, 2),
+        "api_calls": dict(api_calls),
+        "api_calls_per_granule": round(sum(api_calls.values()) / granules, 2),
+        "failed": failed,
+    }
+    LOG.info(
+        f"{name}: {granules} granules in {seconds:.1f}s, "
+        f"{results['granules_per_second']} granules/s, "
+        f"{results['mib_per_second']} MiB/s, "
+        f"{results['api_calls_per_granule']} API calls per granule "
+        f"{dict(api_calls)}" + (f", FAILED: {failed}" if failed else "")
+    )
+    return results
+
+
+def write_results(results, json_output):
+    if json_output:
+        with open(json_output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+@click.group()
+@click.option("--port", type=int, default=5055, help="Port of the moto server.")
+@click.option(
+    "--work-dir",
+    type=click.Path(file_okay=False),
+    default=None,
+    help="Keep the synthetic granules here instead of a temporary directory.",
+)
+@click.pass_context
+def cli(ctx, port, work_dir):
+    """
+    Benchmark the NCI to S3 uploaders against a local S3/SNS stand-in
+    """
+    logging.basicConfig(
+        level=logging.INFO, format="%(name)s - %(levelname)s - %(message)s"
+    )
+    # One line per request from the stand-in drowns the results
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)
+    logging.getLogger("botocore").setLevel(logging.WARNING)
+    ctx.obj = {"port": port, "work_dir": work_dir}
+
+
+@contextmanager
+def work_directory(work_dir):
+    if work_dir:
+        Path(work_dir).mkdir(parents=True, exist_ok=True)
+        yield Path(work_dir)
+    else:
+        with tempfile.TemporaryDirectory(prefix="benchmark_uploaders_") as temp_dir:
+            yield Path(temp_dir)
+
+
+@cli.command()
+@click.option("--granules", type=int, default=100)
+@click.option("--file-size", type=int, default=256 * 1024, help="Bytes per band.")
+@click.option("--workers", type=int, default=8)
+@click.option(
+    "--stac-validation/--no-stac-validation",
+    default=False,
+    help="Validating STAC fetches the schemas, so is off to stay offline.",
+)
+@click.option("--extra-args", type=str, default="", help="More uploader options.")
+@click.option("--json-output", type=click.Path(dir_okay=False), default=None)
+@click.pass_obj
+def c3(obj, granules, file_size, workers, stac_validation, extra_args, json_output):
+    """
+    Benchmark c3_to_s3_rolling.py
+    """
+    with work_directory(obj["work_dir"]) as work_dir:
+        nci_dir = work_dir / "nci"
+        LOG.info(f"Generating {granules} Collection 3 granules in {nci_dir}")
+        metadata_files = make_c3_granules(nci_dir, granules, file_size)
+        csv_file = work_dir / f"{C3_PRODUCT}.csv"
+        csv_file.write_text(
+            "".join(f"{metadata_file},,{date.today()}\n" for metadata_file in metadata_files)
+        )
+
+        with local_aws(obj["port"]) as counter:
+            boto3.client("s3").create_bucket(
+                Bucket=BUCKET,
+                CreateBucketConfiguration={"LocationConstraint": AWS_REGION},
+            )
+            topic = boto3.client("sns").create_topic(Name="benchmark")["TopicArn"]
+
+            c3_to_s3_rolling = load_script("c3_to_s3_rolling")
+            if not stac_validation:
+                dc_to_stac = c3_to_s3_rolling.dc_to_stac
+                c3_to_s3_rolling.dc_to_stac = lambda *args: dc_to_stac(
+                    *args[:-1], False
+                )
+            logging.getLogger("c3_to_s3_rolling").setLevel(logging.WARNING)
+
+            counter.reset()
+            failed = None
+            start = time.monotonic()
+            try:
+                c3_to_s3_rolling.main.main(
+                    args=[
+                        "--filepath",
+                        str(csv_file),
+                        "--ncidir",
+                        str(nci_dir),
+                        "--s3path",
+                        "baseline",
+                        "--s3bucket",
+                        BUCKET,
+                        "--snstopic",
+                        topic,
+                        "--workers",
+                        str(workers),
+                    ]
+                    + extra_args.split(),
+                    standalone_mode=False,
+                )
+            except c3_to_s3_rolling.S3SyncException as exp:
+                failed = str(exp).splitlines()[0]
+            seconds = time.monotonic() - start
+
+        write_results(
+            report(
+                "c3_to_s3_rolling",
+                granules,
+                seconds,
+                counter.uploaded_bytes,
+                counter.calls,
+                failed,
+            ),
+            json_output,
+        )
+
+
+@cli.command()
+@click.option("--granules", type=int, default=100)
+@click.option("--file-size", type=int, default=256 * 1024, help="Bytes per band.")
+@click.option("--workers", type=int, default=10)
+@click.option("--extra-args", type=str, default="", help="More uploader options.")
+@click.option("--json-output", type=click.Path(dir_okay=False), default=None)
+@click.pass_obj
+def s2(obj, granules, file_size, workers, extra_args, json_output):
+    """
+    Benchmark upload_s2.py
+    """
+    with work_directory(obj["work_dir"]) as work_dir:
+        nci_dir = work_dir / "nci"
+        LOG.info(f"Generating {granules} Sentinel-2 granules in {nci_dir}")
+        s3_urls = make_s2_granules(nci_dir, granules, file_size)
+        urls_file = work_dir / "s3_paths_list.txt"
+        urls_file.write_text("".join(f"{s3_url}\n" for s3_url in s3_urls))
+
+        with local_aws(obj["port"]) as counter:
+            boto3.client("s3").create_bucket(
+                Bucket=BUCKET,
+                CreateBucketConfiguration={"LocationConstraint": AWS_REGION},
+            )
+
+            upload_s2 = load_script("upload_s2")
+            upload_s2.NCI_DIR = str(nci_dir)
+
+            counter.reset()
+            failed = None
+            start = time.monotonic()
+            # upload_s2.py writes its log file to the working directory
+            cwd = os.getcwd()
+            os.chdir(work_dir)
+            try:
+                upload_s2.main.main(
+                    args=[str(urls_file), "--workers", str(workers)]
+                    + extra_args.split(),
+                    standalone_mode=False,
+                )
+            except Exception as exp:  # pylint: disable=broad-except
+                failed = str(exp).splitlines()[0] if str(exp) else repr(exp)
+            finally:
+                os.chdir(cwd)
+            seconds = time.monotonic() - start
+
+        write_results(
+            report(
+                "upload_s2",
+                granules,
+                seconds,
+                counter.uploaded_bytes,
+                counter.calls,
+                failed,
+            ),
+            json_output,
+        )
+
+
+@cli.command()
+@click.option("--documents", type=int, default=2000)
+@click.option("--processes", type=int, default=4)
+@click.option("--json-output", type=click.Path(dir_okay=False), default=None)
+@click.pass_obj
+def munge(obj, documents, processes, json_output):
+    """
+    Micro-benchmark the metadata munging of upload_s2.py, with the pure Python
+    yaml it used before and with libyaml in and out of a process pool
+    """
+    upload_s2 = load_script("upload_s2")
+    with work_directory(obj["work_dir"]) as work_dir:
+        LOG.info(f"Generating {documents} Sentinel-2 metadata documents")
+        yaml_files = []
+        for index in range(documents):
+            day = date(2020, 1, 1) + timedelta(days=index // 100)
+            tile_id = f"S2A_OPER_MSI_ARD_TL_EPAE_{day:%Y%m%d}T000000_A{index:06}_T55HFA"
+            yaml_file = work_dir / f"{index}.yaml"
+            yaml_file.write_text(yaml.safe_dump(s2_metadata_doc(tile_id, day)))
+            yaml_files.append(str(yaml_file))
+
+        def pure_python(yaml_file):
+            with open(yaml_file) as fin:
+                nci_dataset = yaml.safe_load(fin)
+            return yaml.safe_dump(
+                upload_s2.munge_metadata(nci_dataset), default_flow_style=False
+            )
+
+        if pure_python(yaml_files[0]) != upload_s2.munge_metadata_file(yaml_files[0]):
+            raise click.ClickException("libyaml output differs from pure Python")
+
+        results = {}
+        for name, run in [
+            ("pure_python", lambda: [pure_python(f) for f in yaml_files]),
+            ("libyaml", lambda: [upload_s2.munge_metadata_file(f) for f in yaml_files]),
+        ]:
+            start = time.monotonic()
+            run()
+            results[name] = documents / (time.monotonic() - start)
+
+        with ProcessPoolExecutor(
+            max_workers=processes, mp_context=multiprocessing.get_context("spawn")
+        ) as pool:
+            # Start the processes before timing them
+            list(pool.map(upload_s2.munge_metadata_file, yaml_files[:processes]))
+            start = time.monotonic()
+            list(pool.map(upload_s2.munge_metadata_file, yaml_files, chunksize=16))
+            results[f"libyaml_{processes}_processes"] = documents / (
+                time.monotonic() - start
+            )
+
+        for name, rate in results.items():
+            LOG.info(
+                f"{name}: {rate:.0f} documents/s, "
+                f"{rate / results['pure_python']:.1f}x pure Python"
+            )
+        write_results(
+            {name: round(rate, 1) for name, rate in results.items()}, json_output
+        )
+
+
+if __name__ == "__main__":
+    cli()
@@ -2,20 +2,36 @@
 """
 Script to sync Collection 3 data from NCI to AWS S3 bucket
 """
+import bisect
 import csv
-import io
+import fnmatch
+import gzip
+import hashlib
+import itertools
 import json
 import logging
-import subprocess
+import mimetypes
+import os
+import queue
+import re
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
 from pathlib import Path
-from typing import Dict
-from toolz import dicttoolz
+from typing import Dict, List, NamedTuple, Optional
+from urllib.parse import unquote_plus, urlparse
+from toolz import dicttoolz, itertoolz
 
-from botocore.exceptions import ClientError
+from boto3.s3.transfer import TransferConfig, create_transfer_manager
+from botocore.config import Config
+from botocore.exceptions import BotoCoreError, ClientError
 import boto3
 import click
 
-from eodatasets3 import verify, serialise
+from eodatasets3 import serialise
 from eodatasets3.scripts.tostac import dc_to_stac, json_fallback
 
 formatter = logging.Formatter("%(name)s - %(levelname)s - %(message)s")
@@ -25,16 +41,547 @@ LOG = logging.getLogger("c3_to_s3_rolling")
 LOG.setLevel(logging.DEBUG)
 LOG.addHandler(handler)
 
+# Connections kept open per AWS client, shared by all the granule workers
+DEFAULT_MAX_POOL_CONNECTIONS = 10
+
+# Files uploaded by update_metadata, or not published at all, skipped by the data sync
+SYNC_EXCLUDE_PATTERNS = [
+    "ga_*_nbar_*.*",
+    "ga_*_nbar-*.*",
+    "*.sha1",
+    "ga_*.odc-metadata.yaml",
+    "ga_*.stac-item.json",
+]
+
+# Files not published, so left out of the uploaded checksum file
+CHECKSUM_EXCLUDE_PATTERNS = [
+    "ga_*_nbar_*.*",
+    "ga_*_nbar-*.*",
+]
+
+# Files, or parts of files, uploaded at the same time by the shared transfer
+# manager for each worker. All workers share the one transfer manager, so its
+# threads are this times the number of workers.
+TRANSFER_CONCURRENCY_PER_WORKER = 4
+
+# Most keys a single DeleteObjects request accepts
+DELETE_BATCH_SIZE = 1000
+
+# Limits of a single SNS PublishBatch request
+SNS_BATCH_SIZE = 10
+SNS_BATCH_MAX_BYTES = 256 * 1024
+
+# Attempts at publishing an SNS message before it is reported as failed
+SNS_PUBLISH_ATTEMPTS = 5
+
+# Stages recorded in the journal for each action on a granule
+ADDED_STAGES = ("data", "metadata", "stac", "sns", "checksum")
+ARCHIVED_STAGES = ("archived", "sns")
+
+# Number of granule path components, product/path/row, listed by the list index
+INDEX_PREFIX_DEPTH = 3
+
+# Requests per second per prefix the rate controller starts at, and its bounds,
+# S3 sustains 3,500 writes and 5,500 reads per second on a partitioned prefix
+RATE_INITIAL = 100.0
+RATE_MIN = 1.0
+RATE_MAX = 5500.0
+
+# Rate added per successful request, and the factor applied when throttled, no
+# more often than once per RATE_DECREASE_INTERVAL seconds
+RATE_INCREASE = 1.0
+RATE_DECREASE = 0.5
+RATE_DECREASE_INTERVAL = 1.0
+
+# Key components, e.g. baseline/ga_ls8c_ard_3/090/084, sharing one rate
+RATE_PREFIX_DEPTH = 4
+
+# Error codes of S3 and SNS asking the caller to slow down
+THROTTLE_ERROR_CODES = {
+    "SlowDown",
+    "Throttling",
+    "ThrottlingException",
+    "Throttled",
+    "RequestLimitExceeded",
+    "TooManyRequestsException",
+}
+
+# Attempts at an AWS request, throttled requests are retried at the lower rate
+AWS_MAX_ATTEMPTS = 10
+
+# boto3 clients are thread safe, so one client per service is shared by the
+# whole process instead of paying for credentials, endpoint resolution and a
+# TLS handshake on every call
+_AWS_SESSION = None
+_AWS_CLIENTS = {}
+_AWS_CLIENTS_LOCK = threading.Lock()
+_TRANSFER_MANAGER = None
+_TRANSFER_CONFIG = TransferConfig(max_concurrency=TRANSFER_CONCURRENCY_PER_WORKER)
+_AWS_CLIENT_CONFIG = Config(
+    max_pool_connections=DEFAULT_MAX_POOL_CONNECTIONS,
+    tcp_keepalive=True,
+    retries={"max_attempts": AWS_MAX_ATTEMPTS, "mode": "standard"},
+)
+
+
+def configure_aws_clients(workers):
+    """
+    Size the connection pool of the shared AWS clients and the threads of the
+    shared transfer manager for the number of workers, must be called before the
+    clients are first used
+
+    :param workers: Number of granules processed concurrently
+    """
+    global _AWS_CLIENT_CONFIG, _TRANSFER_CONFIG
+    transfer_concurrency = workers * TRANSFER_CONCURRENCY_PER_WORKER
+    with _AWS_CLIENTS_LOCK:
+        if _AWS_CLIENTS:
+            LOG.warning("AWS clients already created, not changing the connection pool")
+            return
+        # Every worker and transfer thread may hold a connection at the same time
+        _AWS_CLIENT_CONFIG = _AWS_CLIENT_CONFIG.merge(
+            Config(
+                max_pool_connections=max(
+                    DEFAULT_MAX_POOL_CONNECTIONS, workers + transfer_concurrency
+                )
+            )
+        )
+        _TRANSFER_CONFIG = TransferConfig(max_concurrency=transfer_concurrency)
+
+
+def get_aws_client(service_name):
+    """
+    Return the process wide client for an AWS service, creating it on first use
+
+    :param service_name: Name of the AWS service, e.g. s3 or sns
+    :return: boto3 client
+    """
+    global _AWS_SESSION
+    with _AWS_CLIENTS_LOCK:
+        if service_name not in _AWS_CLIENTS:
+            if _AWS_SESSION is None:
+                _AWS_SESSION = boto3.session.Session()
+            _AWS_CLIENTS[service_name] = _AWS_SESSION.client(
+                service_name, config=_AWS_CLIENT_CONFIG
+            )
+            RATE_CONTROLLER.register(_AWS_CLIENTS[service_name])
+        return _AWS_CLIENTS[service_name]
+
+
+def get_transfer_manager():
+    """
+    Return the process wide S3 transfer manager, creating it on first use
+
+    :return: s3transfer TransferManager, doing multipart uploads when needed
+    """
+    global _TRANSFER_MANAGER
+    s3_client = get_aws_client("s3")
+    with _AWS_CLIENTS_LOCK:
+        if _TRANSFER_MANAGER is None:
+            _TRANSFER_MANAGER = create_transfer_manager(s3_client, _TRANSFER_CONFIG)
+        return _TRANSFER_MANAGER
+
+
+def close_transfer_manager():
+    """
+    Wait for outstanding transfers and shut down the shared transfer manager
+    """
+    global _TRANSFER_MANAGER
+    with _AWS_CLIENTS_LOCK:
+        if _TRANSFER_MANAGER is not None:
+            _TRANSFER_MANAGER.shutdown()
+            _TRANSFER_MANAGER = None
+
+
+class RateController:
+    """
+    Paces the requests of the shared AWS clients with a token bucket per S3 key
+    prefix or SNS topic, using additive increase and multiplicative decrease
+
+    Each successful request raises the rate of its prefix by RATE_INCREASE per
+    second, while a SlowDown or other throttling response cuts it by RATE_DECREASE
+    and, when the response has a Retry-After header, holds the prefix back for
+    that long. The clients' own retries then resend throttled requests at the
+    lower rate, so the transfers, HEADs, listings and SNS publishes settle at the
+    highest rate S3 and SNS sustain instead of failing granules.
+    """
+
+    def __init__(
+        self, initial_rate=RATE_INITIAL, min_rate=RATE_MIN, max_rate=RATE_MAX
+    ):
+        """
+        :param initial_rate: Requests per second a prefix starts at
+        :param min_rate: Lowest requests per second a prefix is slowed to
+        :param max_rate: Highest requests per second a prefix is raised to
+        """
+        self.initial_rate = initial_rate
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def register(self, client):
+        """
+        Route every request of a boto3 client, including those of its paginators
+        and of the transfer manager, through the controller
+
+        :param client: boto3 client
+        """
+        events = client.meta.events
+        events.register("before-parameter-build", self._set_prefix)
+        # Sent once per attempt, so retries are paced too, and ahead of signing
+        events.register_first("request-created", self._before_request)
+        events.register("response-received", self._after_response)
+
+    def acquire(self, prefix):
+        """
+        Wait until a request on the prefix is allowed
+
+        :param prefix: S3 key prefix or SNS topic
+        """
+        waited = 0.0
+        while True:
+            with self._lock:
+                bucket = self._bucket(prefix)
+                now = time.monotonic()
+                bucket["tokens"] = min(
+                    max(1.0, bucket["rate"]),
+                    bucket["tokens"] + (now - bucket["updated"]) * bucket["rate"],
+                )
+                bucket["updated"] = now
+                wait = bucket["held_until"] - now
+                if wait <= 0:
+                    if bucket["tokens"] >= 1:
+                        bucket["tokens"] -= 1
+                        break
+                    wait = (1 - bucket["tokens"]) / bucket["rate"]
+            waited += wait
+            time.sleep(wait)
+        if waited:
+            METRICS.record("rate_wait", waited)
+
+    def succeeded(self, prefix):
+        """
+        Raise the rate of a prefix after a request was accepted
+
+        :param prefix: S3 key prefix or SNS topic
+        """
+        with self._lock:
+            bucket = self._bucket(prefix)
+            bucket["rate"] = min(self.max_rate, bucket["rate"] + RATE_INCREASE)
+
+    def throttled(self, prefix, retry_after=0.0):
+        """
+        Lower the rate of a prefix after a request was throttled
+
+        :param prefix: S3 key prefix or SNS topic
+        :param retry_after: Seconds to hold back all requests on the prefix
+        """
+        with self._lock:
+            bucket = self._bucket(prefix)
+            now = time.monotonic()
+            bucket["held_until"] = max(bucket["held_until"], now + retry_after)
+            bucket["tokens"] = min(bucket["tokens"], 0.0)
+            # Requests in flight are throttled together, slow down once for them
+            if now - bucket["decreased"] < RATE_DECREASE_INTERVAL:
+                return
+            bucket["decreased"] = now
+            bucket["rate"] = max(self.min_rate, bucket["rate"] * RATE_DECREASE)
+            rate = bucket["rate"]
+        METRICS.record("throttled", retry_after)
+        LOG.warning(f"Throttled on {prefix}, slowing to {rate:.1f} requests/s")
+
+    def _bucket(self, prefix):
+        if prefix not in self._buckets:
+            self._buckets[prefix] = {
+                "rate": self.initial_rate,
+                "tokens": 1.0,
+                "updated": time.monotonic(),
+                "held_until": 0.0,
+                "decreased": 0.0,
+            }
+        return self._buckets[prefix]
+
+    def _set_prefix(self, params, model, context, **kwargs):
+        context["rate_prefix"] = rate_prefix(model.service_model.service_name, params)
+
+    def _before_request(self, request, **kwargs):
+        prefix = request.context.get("rate_prefix")
+        if prefix is not None:
+            self.acquire(prefix)
+
+    def _after_response(self, response_dict, parsed_response, context, **kwargs):
+        prefix = context.get("rate_prefix")
+        if prefix is None or response_dict is None:
+            # Connection errors say nothing about the request rate
+            return
+        error_code = (parsed_response or {}).get("Error", {}).get("Code")
+        if error_code in THROTTLE_ERROR_CODES or response_dict["status_code"] in (
+            429,
+            503,
+        ):
+            self.throttled(prefix, retry_after(response_dict["headers"]))
+        elif response_dict["status_code"] < 500:
+            self.succeeded(prefix)
+
+
+def rate_prefix(service_name, params):
+    """
+    Name of the rate limit an AWS request counts against
+
+    :param service_name: Name of the AWS service, e.g. s3 or sns
+    :param params: Parameters of the request
+    :return: SNS topic, or the bucket and the first RATE_PREFIX_DEPTH directories
+    of the S3 key or listed prefix
+    """
+    if "TopicArn" in params:
+        return params["TopicArn"]
+    key = params.get("Key", params.get("Prefix", ""))
+    directories = key.split("/")[:-1][:RATE_PREFIX_DEPTH]
+    return "/".join([service_name, params.get("Bucket", "")] + directories)
 
-def find_granules(file_path):
+
+def retry_after(headers):
+    """
+    Seconds to wait given by the Retry-After header of a response, if any
+
+    :param headers: Headers of the response
+    :return: Seconds, 0 when the header is missing or unreadable
+    """
+    value = headers.get("retry-after") or headers.get("Retry-After")
+    if not value:
+        return 0.0
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(
+            0.0,
+            (parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds(),
+        )
+    except (TypeError, ValueError):
+        return 0.0
+
+
+RATE_CONTROLLER = RateController()
+
+
+class StageMetrics:
+    """
+    Records the latency and bytes moved by each stage of a run, to tell whether it
+    is bound by NCI reads, S3 transfers, metadata generation or SNS
+
+    Latencies go into a fixed histogram per stage, so memory doesn't grow with the
+    length of the run. Safe to share between the granule workers.
+    """
+
+    # Upper bounds in seconds of the latency histogram, ten buckets a decade from
+    # 10us to about 3 hours, so the percentiles are within 26% of the true value
+    LATENCY_BUCKETS = tuple(10 ** (exponent / 10) for exponent in range(-50, 41))
+
+    def __init__(self):
+        self._durations = {}
+        self._bytes = {}
+        self._lock = threading.Lock()
+        self._started = time.monotonic()
+
+    def reset(self):
+        """
+        Forget everything recorded so far
+        """
+        with self._lock:
+            self._durations = {}
+            self._bytes = {}
+            self._started = time.monotonic()
+
+    @contextmanager
+    def measure(self, stage):
+        """
+        Time a block of code as one run of a stage
+
+        :param stage: Name of the stage
+        :return: Context manager yielding a dict, its nbytes entry is recorded
+        as the bytes moved
+        """
+        moved = {"nbytes": 0}
+        start = time.monotonic()
+        try:
+            yield moved
+        finally:
+            self.record(stage, time.monotonic() - start, moved["nbytes"])
+
+    def record(self, stage, seconds, nbytes=0):
+        """
+        Record one run of a stage
+
+        :param stage: Name of the stage
+        :param seconds: Time taken
+        :param nbytes: Bytes moved
+        """
+        with self._lock:
+            durations = self._durations.get(stage)
+            if durations is None:
+                durations = self._durations[stage] = {
+                    "count": 0,
+                    "total": 0.0,
+                    "max": 0.0,
+                    # One more bucket for anything slower than the last bound
+                    "buckets": [0] * (len(self.LATENCY_BUCKETS) + 1),
+                }
+            durations["count"] += 1
+            durations["total"] += seconds
+            durations["max"] = max(durations["max"], seconds)
+            durations["buckets"][bisect.bisect_left(self.LATENCY_BUCKETS, seconds)] += 1
+            self._bytes[stage] = self._bytes.get(stage, 0) + nbytes
+
+    def summary(self):
+        """
+        Summarise the recorded stages
+
+        :return: Dict of stage and its count, total, p50, p95 and max seconds
+        and bytes moved, plus the elapsed seconds of the run
+        """
+        with self._lock:
+            stages = {}
+            for stage, durations in sorted(self._durations.items()):
+                stages[stage] = {
+                    "count": durations["count"],
+                    "total_seconds": durations["total"],
+                    "p50_seconds": self._percentile(durations, 50),
+                    "p95_seconds": self._percentile(durations, 95),
+                    "max_seconds": durations["max"],
+                    "bytes": self._bytes[stage],
+                }
+            return {
+                "elapsed_seconds": time.monotonic() - self._started,
+                "stages": stages,
+            }
+
+    def log_table(self):
+        """
+        Log the summary as one compact table
+        """
+        summary = self.summary()
+        lines = [
+            f"{'stage':<18}{'count':>8}{'total s':>10}{'p50 ms':>10}"
+            f"{'p95 ms':>10}{'max ms':>10}{'MiB':>10}{'MiB/s':>8}"
+        ]
+        for stage, metrics in summary["stages"].items():
+            mebibytes = metrics["bytes"] / 2 ** 20
+            lines.append(
+                f"{stage:<18}{metrics['count']:>8}{metrics['total_seconds']:>10.1f}"
+                f"{metrics['p50_seconds'] * 1000:>10.0f}"
+                f"{metrics['p95_seconds'] * 1000:>10.0f}"
+                f"{metrics['max_seconds'] * 1000:>10.0f}{mebibytes:>10.1f}"
+                f"{mebibytes / max(metrics['total_seconds'], 1e-9):>8.1f}"
+            )
+        LOG.info(
+            f"Stage metrics after {summary['elapsed_seconds']:.1f}s\n"
+            + "\n".join(lines)
+        )
+
+    def write_json(self, json_path):
+        """
+        Write the summary as JSON
+
+        :param json_path: Path of the JSON file
+        """
+        with open(json_path, "w") as f:
+            json.dump(self.summary(), f, indent=2)
+
+    def write_prometheus(self, textfile_path, labels=None):
+        """
+        Write the summary in the Prometheus text format, for the node exporter
+        textfile collector
+
+        :param textfile_path: Path of the .prom file, replaced atomically
+        :param labels: Dict of extra labels for every sample
+        """
+        summary = self.summary()
+        lines = []
+        for name, key, help_ in [
+            ("count", "count", "Runs of the stage"),
+            ("seconds_total", "total_seconds", "Total time spent in the stage"),
+            ("seconds_p50", "p50_seconds", "Median latency of the stage"),
+            ("seconds_p95", "p95_seconds", "95th percentile latency of the stage"),
+            ("seconds_max", "max_seconds", "Maximum latency of the stage"),
+            ("bytes_total", "bytes", "Bytes moved by the stage"),
+        ]:
+            metric = f"c3_to_s3_stage_{name}"
+            lines.append(f"# HELP {metric} {help_}")
+            lines.append(f"# TYPE {metric} gauge")
+            for stage, metrics in summary["stages"].items():
+                sample_labels = ",".join(
+                    f'{label}="{value}"'
+                    for label, value in dict(labels or {}, stage=stage).items()
+                )
+                lines.append(f"{metric}{{{sample_labels}}} {metrics[key]}")
+        temp_path = f"{textfile_path}.{os.getpid()}.tmp"
+        with open(temp_path, "w") as f:
+            f.write("\n".join(lines) + "\n")
+        os.replace(temp_path, textfile_path)
+
+    def _percentile(self, durations, percent):
+        """
+        Nearest-rank percentile from a stage's histogram, as the upper bound of the
+        bucket it falls in, capped at the slowest run
+        """
+        rank = max(1, -(-durations["count"] * percent // 100))
+        seen = 0
+        for bound, count in zip(self.LATENCY_BUCKETS, durations["buckets"]):
+            seen += count
+            if seen >= rank:
+                return min(bound, durations["max"])
+        return durations["max"]
+
+
+# Stage metrics of the current run
+METRICS = StageMetrics()
+
+
+def find_granules(file_path, shard_index=0, shard_count=1):
     """
-    Load a list of metadata files in NCI
+    Stream the list of metadata files in NCI, one row at a time
 
     :param file_path: File with metadata list
-    :return: List of granules
+    :param shard_index: Shard of the granules to return, from 0 to shard_count - 1
+    :param shard_count: Number of shards the granules are split into
+    :return: Iterator of granule rows
     """
     with open(file_path, "r") as f:
-        return [row for row in csv.reader(f)]
+        for row in csv.reader(f):
+            if shard_count == 1 or granule_shard(row, shard_count) == shard_index:
+                yield row
+
+
+def find_product_granules(file_paths, shard_index=0, shard_count=1):
+    """
+    Stream the granules of several products, taking one from each csv file in
+    turn so no product waits for another to finish
+
+    :param file_paths: List of files with metadata lists, one per product
+    :param shard_index: Shard of the granules to return, from 0 to shard_count - 1
+    :param shard_count: Number of shards the granules are split into
+    :return: Iterator of granule rows
+    """
+    return itertoolz.interleave(
+        [find_granules(file_path, shard_index, shard_count) for file_path in file_paths]
+    )
+
+
+def granule_shard(granule_row, shard_count):
+    """
+    Deterministically assign a granule to a shard by hashing its metadata path,
+    so processes sharing one csv file never work on the same granule
+
+    :param granule_row: Row from the csv file
+    :param shard_count: Number of shards the granules are split into
+    :return: Shard index of the granule
+    """
+    metadata_file = granule_row[0] if granule_row else ""
+    digest = hashlib.sha1(metadata_file.encode("utf-8")).digest()
+    return int.from_bytes(digest[:8], "big") % shard_count
 
 
 def check_granule_exists(_s3_bucket, s3_metadata_path):
@@ -45,11 +592,11 @@ def check_granule_exists(_s3_bucket, s3_metadata_path):
     :param s3_metadata_path: Path of metadata file
     :return: True if success else False
     """
-    s3_resource = boto3.resource("s3")
+    s3_client = get_aws_client("s3")
 
     try:
         # This does a head request, so is fast
-        s3_resource.Object(_s3_bucket, s3_metadata_path).load()
+        s3_client.head_object(Bucket=_s3_bucket, Key=s3_metadata_path)
     except ClientError as exception:
         if exception.response["Error"]["Code"] == "404":
             return False
@@ -57,23 +604,229 @@ def check_granule_exists(_s3_bucket, s3_metadata_path):
         return True
 
 
-def upload_s3_resource(s3_bucket, s3_file, obj):
+def granule_exists(s3_bucket, s3_metadata_path, existing_metadata=None):
+    """
+    Check if granule already exists in S3 bucket, using the existence index when
+    one was built, otherwise a head request
+
+    :param s3_bucket: Name of s3 bucket to store granules
+    :param s3_metadata_path: Path of metadata file
+    :param existing_metadata: Set of metadata keys in S3, or None to ask S3
+    :return: True if exists else False
+    """
+    if existing_metadata is None:
+        with METRICS.measure("exists_check"):
+            return check_granule_exists(s3_bucket, s3_metadata_path)
+    return s3_metadata_path in existing_metadata
+
+
+def index_prefixes(granules, nci_dir, s3_root_path):
+    """
+    Find the S3 prefixes holding the granules listed in the csv file
+
+    Prefixes are cut at the path/row level, so a backfill over a whole path/row
+    range is covered by a few listings instead of a head request per granule.
+
+    :param granules: Rows from the csv file
+    :param nci_dir: Source directory for the files in NCI
+    :param s3_root_path: Root folder of the S3 bucket
+    :return: Sorted list of S3 prefixes
+    """
+    prefixes = set()
+    for granule_row in granules:
+        if not granule_row:
+            continue
+        try:
+            granule = Path(granule_row[0]).relative_to(nci_dir).parent
+        except ValueError:
+            # Reported when the granule itself is processed
+            continue
+        path_row = "/".join(granule.parts[:INDEX_PREFIX_DEPTH])
+        prefixes.add(f"{s3_root_path}/{path_row}/")
+    return sorted(prefixes)
+
+
+def list_existing_metadata(s3_bucket, prefixes):
+    """
+    List the metadata files under the given prefixes with ListObjectsV2
+
+    :param s3_bucket: Name of the S3 bucket
+    :param prefixes: S3 prefixes to list
+    :return: Set of metadata keys
+    """
+    paginator = get_aws_client("s3").get_paginator("list_objects_v2")
+    existing_metadata = set()
+    pages = 0
+    try:
+        for prefix in prefixes:
+            for page in paginator.paginate(Bucket=s3_bucket, Prefix=prefix):
+                pages += 1
+                existing_metadata.update(
+                    obj["Key"]
+                    for obj in page.get("Contents", [])
+                    if obj["Key"].endswith(".odc-metadata.yaml")
+                )
+    except ClientError as exception:
+        raise S3SyncException(str(exception))
+    LOG.info(
+        f"Listed {len(prefixes)} prefixes in {pages} pages, "
+        f"found {len(existing_metadata)} metadata files"
+    )
+    return existing_metadata
+
+
+def read_inventory_metadata(manifest_url, s3_bucket, s3_root_path, workers=1):
+    """
+    Read the metadata keys from an S3 Inventory report
+
+    Only CSV inventories are supported. The inventory can be up to a day behind
+    the bucket, so it should only be used for backfills of older granules.
+
+    :param manifest_url: Local path or s3:// URL of the inventory manifest.json
+    :param s3_bucket: Name of the S3 bucket the granules are synced to
+    :param s3_root_path: Root folder of the S3 bucket
+    :param workers: Number of inventory files to read concurrently
+    :return: Set of metadata keys
+    """
+    url = urlparse(manifest_url)
+    if url.scheme == "s3":
+        manifest = json.load(load_s3_resource(url.netloc, url.path.lstrip("/")))
+    else:
+        with open(manifest_url, "r") as f:
+            manifest = json.load(f)
+
+    if manifest["fileFormat"] != "CSV":
+        raise S3SyncException(
+            f"Unsupported S3 Inventory format {manifest['fileFormat']}, expected CSV"
+        )
+    if manifest["sourceBucket"] != s3_bucket:
+        raise S3SyncException(
+            f"S3 Inventory is for bucket {manifest['sourceBucket']}, not {s3_bucket}"
+        )
+    columns = [column.strip() for column in manifest["fileSchema"].split(",")]
+    bucket_column, key_column = columns.index("Bucket"), columns.index("Key")
+    inventory_bucket = manifest["destinationBucket"].split(":::")[-1]
+
+    def read_inventory_file(inventory_file):
+        body = load_s3_resource(inventory_bucket, inventory_file["key"])
+        with gzip.open(body, "rt") as f:
+            return {
+                key
+                for key in (
+                    unquote_plus(row[key_column])
+                    for row in csv.reader(f)
+                    if row[bucket_column] == s3_bucket
+                )
+                if key.startswith(f"{s3_root_path}/")
+                and key.endswith(".odc-metadata.yaml")
+            }
+
+    existing_metadata = set()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for keys in executor.map(read_inventory_file, manifest["files"]):
+            existing_metadata.update(keys)
+    LOG.info(
+        f"Read {len(manifest['files'])} S3 Inventory files, "
+        f"found {len(existing_metadata)} metadata files"
+    )
+    return existing_metadata
+
+
+class HashingWriter:
+    """
+    Binary stream computing the sha1 of the bytes as they are written, so a
+    generated document is serialised and checksummed in one pass, then uploaded
+    from the same buffer
+    """
+
+    def __init__(self):
+        self.data = bytearray()
+        self._sha1 = hashlib.sha1()
+
+    def write(self, data):
+        self.data += data
+        self._sha1.update(data)
+        return len(data)
+
+    def writelines(self, lines):
+        for line in lines:
+            self.write(line)
+
+    def hexdigest(self):
+        """
+        :return: sha1 of everything written so far
+        """
+        return self._sha1.hexdigest()
+
+
+def compile_patterns(patterns):
+    """
+    Combine glob patterns into a single regular expression
+
+    :param patterns: List of glob patterns
+    :return: Compiled pattern, matching a path that matches any of the globs
+    """
+    return re.compile(
+        "|".join(f"(?:{fnmatch.translate(pattern)})" for pattern in patterns)
+    )
+
+
+SYNC_EXCLUDE_MATCHER = compile_patterns(SYNC_EXCLUDE_PATTERNS)
+CHECKSUM_EXCLUDE_MATCHER = compile_patterns(CHECKSUM_EXCLUDE_PATTERNS)
+
+
+def upload_s3_resource(s3_bucket, s3_file, obj, metadata=None):
     """
     Upload s3 resource object in provided s3 path
 
     :param s3_bucket: Name of s3 bucket to store granules
     :param s3_file: Path of metadata file
     :param obj: Resource object to upload
+    :param metadata: Dict of user metadata stored with the object, or None
     """
     try:
-        s3_resource = boto3.resource("s3").Bucket(s3_bucket)
-        s3_resource.Object(key=s3_file).put(Body=obj)
+        s3_client = get_aws_client("s3")
+        s3_client.put_object(
+            Bucket=s3_bucket, Key=s3_file, Body=obj, Metadata=metadata or {}
+        )
     except ValueError as exception:
         raise S3SyncException(str(exception))
     except ClientError as exception:
         raise S3SyncException(str(exception))
 
 
+def read_published_hashes(s3_bucket, s3_checksum_file):
+    """
+    Read the hashes the last upload of a granule stored on its checksum file
+
+    :param s3_bucket: Name of the S3 bucket
+    :param s3_checksum_file: Path of the checksum file in S3
+    :return: Dict of the user metadata of the checksum file, empty if it is missing
+    """
+    try:
+        response = get_aws_client("s3").head_object(
+            Bucket=s3_bucket, Key=s3_checksum_file
+        )
+    except ClientError as exception:
+        if exception.response["Error"]["Code"] in ("404", "NoSuchKey", "NotFound"):
+            return {}
+        raise S3SyncException(str(exception))
+    return response.get("Metadata", {})
+
+
+def file_sha1(file_path):
+    """
+    sha1 of a local file
+
+    :param file_path: Path of the file
+    :return: Hex digest, or None if the file doesn't exist
+    """
+    try:
+        return hashlib.sha1(Path(file_path).read_bytes()).hexdigest()
+    except FileNotFoundError:
+        return None
+
+
 def load_s3_resource(s3_bucket, s3_file):
     """
     Download S3 resource object in provided s3 path
@@ -83,9 +836,8 @@ def load_s3_resource(s3_bucket, s3_file):
     :return obj: Resource object to download
     """
     try:
-        s3_resource = boto3.resource("s3").Bucket(s3_bucket)
-        obj = s3_resource.Object(key=s3_file)
-        return obj.get()["Body"]
+        s3_client = get_aws_client("s3")
+        return s3_client.get_object(Bucket=s3_bucket, Key=s3_file)["Body"]
     except ValueError as exception:
         raise S3SyncException(str(exception))
     except ClientError as exception:
@@ -101,7 +853,7 @@ def publish_sns(sns_topic, message, message_attributes):
     :param message_attributes: SNS message attributes
     """
     try:
-        sns_client = boto3.client("sns")
+        sns_client = get_aws_client("sns")
         sns_client.publish(
             TopicArn=sns_topic, Message=message, MessageAttributes=message_attributes
         )
@@ -109,8 +861,324 @@ def publish_sns(sns_topic, message, message_attributes):
         raise S3SyncException(str(exception))
 
 
+class GranuleJournal:
+    """
+    Append-only JSON lines journal of the stages each granule has completed, so a
+    rerun of the same csv file only does what is left
+
+    Safe to share between the granule workers.
+    """
+
+    def __init__(self, journal_path):
+        """
+        :param journal_path: Path of the journal file, created if missing
+        """
+        self.journal_path = Path(journal_path)
+        self.skipped = 0
+        self._completed = set()
+        self._messages = {}
+        self._lock = threading.Lock()
+        if self.journal_path.exists():
+            with self.journal_path.open("r") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # Last line of a run that was killed while writing it
+                        continue
+                    self._completed.add(
+                        (entry["granule"], entry["action"], entry["stage"])
+                    )
+                    if "message" in entry:
+                        self._messages[entry["granule"], entry["action"]] = entry[
+                            "message"
+                        ]
+            # Only the messages of unpublished granules are needed again
+            for granule, action in list(self._messages):
+                if (granule, action, "sns") in self._completed:
+                    del self._messages[granule, action]
+            LOG.info(
+                f"Loaded {len(self._completed)} completed stages "
+                f"from journal {self.journal_path}"
+            )
+        self._file = self.journal_path.open("a")
+        if self._file.tell() and not self.journal_path.read_text().endswith("\n"):
+            self._file.write("\n")
+
+    def started(self, granule, action):
+        """
+        Check if a previous run completed any stage of a granule
+
+        :param granule: Metadata file of the granule
+        :param action: added or archived
+        :return: True if any stage was completed else False
+        """
+        with self._lock:
+            return any(
+                (granule, action, stage) in self._completed
+                for stage in (ADDED_STAGES if action == "added" else ARCHIVED_STAGES)
+            )
+
+    def all_done(self, granule, action, stages):
+        """
+        Check if a previous run completed all the given stages of a granule,
+        counting them as skipped if so
+
+        :param granule: Metadata file of the granule
+        :param action: added or archived
+        :param stages: Stages to check
+        :return: True if all stages were completed else False
+        """
+        with self._lock:
+            done = all((granule, action, stage) in self._completed for stage in stages)
+            if done:
+                self.skipped += len(stages)
+        return done
+
+    def is_done(self, granule, action, stage):
+        """
+        Check if a previous run completed a stage of a granule, counting it as
+        skipped if so
+
+        :param granule: Metadata file of the granule
+        :param action: added or archived
+        :param stage: Stage to check
+        :return: True if completed else False
+        """
+        return self.all_done(granule, action, [stage])
+
+    def message(self, granule, action):
+        """
+        SNS message recorded with a stage of a granule by a previous run
+
+        :param granule: Metadata file of the granule
+        :param action: added or archived
+        :return: SNS message, or None if none was recorded
+        """
+        with self._lock:
+            return self._messages.get((granule, action))
+
+    def record(self, granule, action, stage, message=None):
+        """
+        Record a completed stage of a granule
+
+        :param granule: Metadata file of the granule
+        :param action: added or archived
+        :param stage: Completed stage
+        :param message: SNS message still to be published, kept so a rerun can
+        publish it when its source is gone, e.g. the STAC item of an archived granule
+        """
+        entry = {
+            "granule": granule,
+            "action": action,
+            "stage": stage,
+            "time": datetime.now(timezone.utc).isoformat(),
+        }
+        if message is not None:
+            entry["message"] = message
+        line = json.dumps(entry)
+        with self._lock:
+            self._completed.add((granule, action, stage))
+            self._file.write(f"{line}\n")
+            self._file.flush()
+
+    def close(self):
+        """
+        Close the journal file
+        """
+        with self._lock:
+            self._file.close()
+
+
+class SnsBatchPublisher:
+    """
+    Publishes SNS messages from a background thread with PublishBatch, so the
+    granule workers don't wait on SNS
+
+    Messages are sent in batches of up to ten, failed entries are retried on their
+    own, and close() flushes whatever is still queued. Failures are collected in
+    error_list, and if the background thread stops, publish() and close() record
+    the messages it didn't publish instead of waiting on it.
+    """
+
+    def __init__(self, sns_topic, max_queued=1000):
+        """
+        :param sns_topic: ARN of the SNS topic
+        :param max_queued: Messages queued before publish() blocks
+        """
+        self.sns_topic = sns_topic
+        self.error_list = []
+        self._queue = queue.Queue(maxsize=max_queued)
+        self._thread = threading.Thread(
+            target=self._run, name="sns-publisher", daemon=True
+        )
+        self._thread.start()
+
+    def publish(self, message, message_attributes, on_published=None):
+        """
+        Queue a message to be published
+
+        :param message: SNS message
+        :param message_attributes: SNS message attributes
+        :param on_published: Called from the background thread once the message
+        is published
+        """
+        if not self._put((message, message_attributes, on_published)):
+            self._failed("the SNS publisher thread has stopped")
+
+    def close(self):
+        """
+        Publish the queued messages and stop the background thread
+
+        :return: List of errors
+        """
+        self._put(None)
+        self._thread.join()
+        # Left behind if the thread stopped early
+        while True:
+            try:
+                entry = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if entry is not None:
+                self._failed("the SNS publisher thread has stopped")
+        return self.error_list
+
+    def _put(self, entry):
+        """
+        Queue an entry, waiting for room only while the background thread runs
+
+        :return: True if queued else False
+        """
+        while self._thread.is_alive():
+            try:
+                self._queue.put(entry, timeout=1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _run(self):
+        try:
+            self._publish_queued()
+        except Exception as exception:  # pylint: disable=broad-except
+            LOG.exception("SNS publisher thread stopped")
+            self._failed(f"the SNS publisher thread stopped - {exception}")
+
+    def _publish_queued(self):
+        closed = False
+        while not closed:
+            entries = [self._queue.get()]
+            if entries[0] is None:
+                break
+            size = _sns_entry_size(*entries[0])
+            # Fill the batch with whatever else is already queued
+            while len(entries) < SNS_BATCH_SIZE:
+                try:
+                    entry = self._queue.get(timeout=0.1)
+                except queue.Empty:
+                    break
+                if entry is None:
+                    closed = True
+                    break
+                entry_size = _sns_entry_size(*entry)
+                if size + entry_size > SNS_BATCH_MAX_BYTES:
+                    self._publish_entries(entries)
+                    entries, size = [], 0
+                entries.append(entry)
+                size += entry_size
+            self._publish_entries(entries)
+
+    def _publish_entries(self, entries):
+        try:
+            self._publish_batch(entries)
+        except Exception as exception:  # pylint: disable=broad-except
+            LOG.exception(f"Failed publishing a batch to SNS Topic {self.sns_topic}")
+            for _ in entries:
+                self._failed(str(exception))
+
+    def _publish_batch(self, entries):
+        pending = dict(enumerate(entries))
+        for attempt in range(SNS_PUBLISH_ATTEMPTS):
+            if attempt:
+                time.sleep(0.1 * 2 ** attempt)
+            try:
+                with METRICS.measure("sns_publish") as moved:
+                    moved["nbytes"] = sum(
+                        _sns_entry_size(*entry) for entry in pending.values()
+                    )
+                    response = get_aws_client("sns").publish_batch(
+                        TopicArn=self.sns_topic,
+                        PublishBatchRequestEntries=[
+                            {
+                                "Id": str(index),
+                                "Message": message,
+                                "MessageAttributes": attributes,
+                            }
+                            for index, (message, attributes, _) in pending.items()
+                        ],
+                    )
+            except (ClientError, BotoCoreError) as exception:
+                errors = {index: str(exception) for index in pending}
+            else:
+                errors = {}
+                for entry in response.get("Failed", []):
+                    reason = f"{entry['Code']} {entry.get('Message', '')}"
+                    if entry["Code"] in THROTTLE_ERROR_CODES:
+                        RATE_CONTROLLER.throttled(self.sns_topic)
+                    if entry["SenderFault"]:
+                        # Fails the same way on retry, e.g. a malformed message
+                        self._failed(reason)
+                    else:
+                        errors[int(entry["Id"])] = reason
+                for entry in response.get("Successful", []):
+                    on_published = pending[int(entry["Id"])][2]
+                    if on_published:
+                        try:
+                            on_published()
+                        except Exception as exception:  # pylint: disable=broad-except
+                            self.error_list.append(
+                                f"Published SNS Message to SNS Topic {self.sns_topic} "
+                                f"but failed recording it - {exception}"
+                            )
+                if response.get("Successful"):
+                    LOG.info(
+                        f"Finished publishing {len(response['Successful'])} "
+                        f"SNS Messages to SNS Topic {self.sns_topic}"
+                    )
+            pending = {index: pending[index] for index in errors}
+            if not pending:
+                return
+        for reason in errors.values():
+            self._failed(reason)
+
+    def _failed(self, reason):
+        LOG.error(
+            f"Failed publishing SNS Message to SNS Topic {self.sns_topic} - {reason}"
+        )
+        self.error_list.append(
+            f"Failed publishing SNS Message to SNS Topic {self.sns_topic} - {reason}"
+        )
+
+
+def _sns_entry_size(message, message_attributes, _on_published=None):
+    """
+    Size of an SNS message and its attributes, as counted by the batch limit
+    """
+    return len(message.encode("utf-8")) + sum(
+        len(name) + len(attribute["DataType"]) + len(attribute["StringValue"])
+        for name, attribute in message_attributes.items()
+    )
+
+
 def upload_checksum(
-        nci_metadata_file_path, checksum_file_path, new_checksum_list, s3_bucket, s3_path
+        nci_metadata_file_path,
+        checksum_file_path,
+        new_checksum_list,
+        s3_bucket,
+        s3_path,
+        checksum_lines=None,
+        metadata=None,
 ):
     """
     Updates and uploads checksum file
@@ -120,36 +1188,42 @@ def upload_checksum(
     :param new_checksum_list: List of filename and updated checksum
     :param s3_bucket: Name of the S3 bucket
     :param s3_path: Path of the S3 bucket
+    :param checksum_lines: Lines of the checksum file if already read, or None
+    :param metadata: Dict of user metadata stored with the checksum file, or None
     """
 
     # Identify list of files to be included in checksum file
-    excluded_files = []
-    excluded_pattern = [
-        "ga_*_nbar_*.*",
-        "ga_*_nbar-*.*",
-        nci_metadata_file_path.name,
-        checksum_file_path.name,
-    ]
-    for ex_pat in excluded_pattern:
-        for path in checksum_file_path.parent.glob(ex_pat):
-            excluded_files.append(path.name)
+    excluded_files = {nci_metadata_file_path.name, checksum_file_path.name}
+    with os.scandir(checksum_file_path.parent) as entries:
+        excluded_files.update(
+            entry.name
+            for entry in entries
+            if CHECKSUM_EXCLUDE_MATCHER.match(entry.name)
+        )
 
     # Read checksum for files to be included
-    with checksum_file_path.open("r") as f:
-        for hash_, filename in [line.strip().split("\t") for line in f.readlines()]:
-            if filename not in excluded_files:
-                new_checksum_list[filename] = hash_
+    if checksum_lines is None:
+        with checksum_file_path.open("r") as f:
+            checksum_lines = f.readlines()
+    for hash_, filename in [line.strip().split("\t") for line in checksum_lines]:
+        if filename not in excluded_files:
+            new_checksum_list[filename] = hash_
 
     # Write checksum to buffer
-    with io.BytesIO() as temp_checksum:
-        temp_checksum.writelines(
-            f"{str(hash_)}\t{str(filename)}\n".encode("utf-8")
-            for filename, hash_ in sorted(new_checksum_list.items())
-        )
+    checksum_writer = HashingWriter()
+    checksum_writer.writelines(
+        f"{str(hash_)}\t{str(filename)}\n".encode("utf-8")
+        for filename, hash_ in sorted(new_checksum_list.items())
+    )
 
-        # Write checksum sha1 object into S3
-        s3_checksum_file = f"{s3_path}/{checksum_file_path.name}"
-        upload_s3_resource(s3_bucket, s3_checksum_file, temp_checksum.getvalue())
+    # Write checksum sha1 object into S3
+    s3_checksum_file = f"{s3_path}/{checksum_file_path.name}"
+    upload_s3_resource(
+        s3_bucket,
+        s3_checksum_file,
+        checksum_writer.data,
+        dict(metadata or {}, sha1=checksum_writer.hexdigest()),
+    )
 
 
 def get_common_message_attributes(stac_doc: Dict) -> Dict:
@@ -210,83 +1284,118 @@ def get_common_message_attributes(stac_doc: Dict) -> Dict:
     return msg_attributes
 
 
-def update_metadata(
-        nci_metadata_file, s3_bucket, s3_base_url, explorer_base_url, sns_topic, s3_path
-):
+class MetadataSource(NamedTuple):
     """
-    Uploads updated metadata with nbar element removed, updated checksum file, STAC doc created
-    and publish SNS message
+    Metadata document and checksum file of a granule, as read from NCI
+    """
+
+    nci_metadata_file_path: Path
+    metadata_doc: Dict
+    checksum_lines: Optional[List[str]]
+    checksum_sha1: Optional[str]
+
+
+class MetadataOutputs(NamedTuple):
+    """
+    Documents generated for a granule and their checksums, ready to upload
+    """
+
+    nci_metadata_file_path: Path
+    metadata_yaml: bytearray
+    stac_file_name: str
+    stac_dump: str
+    stac_json: bytearray
+    new_checksum_list: Dict[str, str]
+    checksum_lines: Optional[List[str]]
+    checksum_sha1: Optional[str]
+
+
+def read_metadata_source(nci_metadata_file):
+    """
+    Read the metadata document and checksum file of a granule from NCI
 
     :param nci_metadata_file: Path of metadata file in NCI
-    :param s3_bucket: Name of S3 bucket
+    :return: MetadataSource
+    """
+    nci_metadata_file_path = Path(nci_metadata_file)
+    checksum_filename = nci_metadata_file_path.stem.replace(".odc-metadata", "")
+    checksum_file_path = nci_metadata_file_path.with_name(f"{checksum_filename}.sha1")
+
+    with METRICS.measure("metadata_read") as moved:
+        metadata_doc = serialise.load_yaml(nci_metadata_file_path)
+        moved["nbytes"] = nci_metadata_file_path.stat().st_size
+        checksum_lines = checksum_sha1 = None
+        if checksum_file_path.exists():
+            checksum_bytes = checksum_file_path.read_bytes()
+            checksum_sha1 = hashlib.sha1(checksum_bytes).hexdigest()
+            checksum_lines = checksum_bytes.decode("utf-8").splitlines()
+            moved["nbytes"] += len(checksum_bytes)
+
+    return MetadataSource(
+        nci_metadata_file_path, metadata_doc, checksum_lines, checksum_sha1
+    )
+
+
+def build_metadata_outputs(source, s3_base_url, explorer_base_url, s3_path):
+    """
+    Remove the nbar elements from the metadata, create the STAC doc and
+    checksum both
+
+    :param source: MetadataSource of the granule
     :param s3_base_url: Base URL of the S3 bucket
     :param explorer_base_url: Base URL of the explorer
-    :param sns_topic: ARN of the SNS topic
     :param s3_path: Path in S3
-    :return: List of errors
+    :return: MetadataOutputs
     """
-    # Initialise error list
-    metadata_error_list = []
+    with METRICS.measure("metadata_build"):
+        return _build_metadata_outputs(source, s3_base_url, explorer_base_url, s3_path)
+
+
+def _build_metadata_outputs(source, s3_base_url, explorer_base_url, s3_path):
     # Initialise checksum list
     new_checksum_list = {}
 
-    nci_metadata_file_path = Path(nci_metadata_file)
-    temp_metadata = serialise.load_yaml(nci_metadata_file_path)
+    nci_metadata_file_path = source.nci_metadata_file_path
+    metadata_doc = source.metadata_doc
 
     # Deleting Nbar related metadata
     # Because Landsat 8 is different, we need to check if the fields exist
     # before removing them.
-    if "nbar_blue" in temp_metadata["measurements"]:
-        del temp_metadata["measurements"]["nbar_blue"]
-    if "nbar_green" in temp_metadata["measurements"]:
-        del temp_metadata["measurements"]["nbar_green"]
-    if "nbar_nir" in temp_metadata["measurements"]:
-        del temp_metadata["measurements"]["nbar_nir"]
-    if "nbar_red" in temp_metadata["measurements"]:
-        del temp_metadata["measurements"]["nbar_red"]
-    if "nbar_swir_1" in temp_metadata["measurements"]:
-        del temp_metadata["measurements"]["nbar_swir_1"]
-    if "nbar_swir_2" in temp_metadata["measurements"]:
-        del temp_metadata["measurements"]["nbar_swir_2"]
-    if "nbar_coastal_aerosol" in temp_metadata["measurements"]:
-        del temp_metadata["measurements"]["nbar_coastal_aerosol"]
-    if "nbar_panchromatic" in temp_metadata["measurements"]:
-        del temp_metadata["measurements"]["nbar_panchromatic"]
-    if "oa_nbar_contiguity" in temp_metadata["measurements"]:
-        del temp_metadata["measurements"]["oa_nbar_contiguity"]
-    if "thumbnail:nbar" in temp_metadata["accessories"]:
-        del temp_metadata["accessories"]["thumbnail:nbar"]
+    if "nbar_blue" in metadata_doc["measurements"]:
+        del metadata_doc["measurements"]["nbar_blue"]
+    if "nbar_green" in metadata_doc["measurements"]:
+        del metadata_doc["measurements"]["nbar_green"]
+    if "nbar_nir" in metadata_doc["measurements"]:
+        del metadata_doc["measurements"]["nbar_nir"]
+    if "nbar_red" in metadata_doc["measurements"]:
+        del metadata_doc["measurements"]["nbar_red"]
+    if "nbar_swir_1" in metadata_doc["measurements"]:
+        del metadata_doc["measurements"]["nbar_swir_1"]
+    if "nbar_swir_2" in metadata_doc["measurements"]:
+        del metadata_doc["measurements"]["nbar_swir_2"]
+    if "nbar_coastal_aerosol" in metadata_doc["measurements"]:
+        del metadata_doc["measurements"]["nbar_coastal_aerosol"]
+    if "nbar_panchromatic" in metadata_doc["measurements"]:
+        del metadata_doc["measurements"]["nbar_panchromatic"]
+    if "oa_nbar_contiguity" in metadata_doc["measurements"]:
+        del metadata_doc["measurements"]["oa_nbar_contiguity"]
+    if "thumbnail:nbar" in metadata_doc["accessories"]:
+        del metadata_doc["accessories"]["thumbnail:nbar"]
 
     # Format an eo3 dataset dict for human-readable yaml serialisation.
-    temp_metadata = serialise.prepare_formatting(temp_metadata)
-
-    # Dump metadata yaml into buffer
-    with io.BytesIO() as temp_yaml:
-        serialise.dumps_yaml(temp_yaml, temp_metadata)
-        temp_yaml.seek(
-            0
-        )  # Seek back to the beginning of the file before next read/write
-        new_checksum_list[nci_metadata_file_path.name] = verify.calculate_hash(
-            temp_yaml
-        )
+    metadata_doc = serialise.prepare_formatting(metadata_doc)
 
-        # Write odc metadata yaml object into S3
-        s3_metadata_file = f"{s3_path}/{nci_metadata_file_path.name}"
-        try:
-            upload_s3_resource(s3_bucket, s3_metadata_file, temp_yaml.getvalue())
-            LOG.info(f"Finished uploading metadata to {s3_metadata_file}")
-        except S3SyncException as exp:
-            LOG.error(f"Failed uploading metadata to {s3_metadata_file} - {exp}")
-            metadata_error_list.append(
-                f"Failed uploading metadata to {s3_metadata_file} - {exp}"
-            )
+    # Dump metadata yaml into buffer, checksumming it on the way
+    yaml_writer = HashingWriter()
+    serialise.dumps_yaml(yaml_writer, metadata_doc)
+    new_checksum_list[nci_metadata_file_path.name] = yaml_writer.hexdigest()
 
     # Create stac metadata
     name = nci_metadata_file_path.stem.replace(".odc-metadata", "")
     stac_output_file_path = nci_metadata_file_path.with_name(f"{name}.stac-item.json")
-    stac_url_path = f"{s3_base_url if s3_base_url else boto3.client('s3').meta.endpoint_url}/{s3_path}/"
+    stac_url_path = f"{s3_base_url if s3_base_url else get_aws_client('s3').meta.endpoint_url}/{s3_path}/"
     item_doc = dc_to_stac(
-        serialise.from_doc(temp_metadata),
+        serialise.from_doc(metadata_doc),
         nci_metadata_file_path,
         stac_output_file_path,
         stac_url_path,
@@ -295,53 +1404,261 @@ def update_metadata(
     )
     stac_dump = json.dumps(item_doc, indent=4, default=json_fallback)
 
-    # Write stac json to buffer
-    with io.BytesIO() as temp_stac:
-        temp_stac.write(stac_dump.encode())
-        temp_stac.seek(
-            0
-        )  # Seek back to the beginning of the file before next read/write
-        new_checksum_list[stac_output_file_path.name] = verify.calculate_hash(temp_stac)
+    # Write stac json to buffer, checksumming it on the way
+    stac_writer = HashingWriter()
+    stac_writer.write(stac_dump.encode())
+    new_checksum_list[stac_output_file_path.name] = stac_writer.hexdigest()
 
-        # Write stac metadata json object into S3
-        s3_stac_file = f"{s3_path}/{stac_output_file_path.name}"
-        try:
-            upload_s3_resource(s3_bucket, s3_stac_file, temp_stac.getvalue())
+    return MetadataOutputs(
+        nci_metadata_file_path,
+        yaml_writer.data,
+        stac_output_file_path.name,
+        stac_dump,
+        stac_writer.data,
+        new_checksum_list,
+        source.checksum_lines,
+        source.checksum_sha1,
+    )
+
+
+class MetadataPipeline:
+    """
+    Prepares the metadata of granules ahead of the workers uploading them
+
+    A reader stage prefetches metadata documents and checksum files from NCI, and a
+    CPU stage builds and checksums the YAML and STAC documents, so slow reads from
+    /g/data overlap with uploads. The caller bounds how far ahead it submits.
+    """
+
+    def __init__(self, s3_base_url, explorer_base_url, readers=4):
+        """
+        :param s3_base_url: Base URL of the S3 bucket
+        :param explorer_base_url: Base URL of the explorer
+        :param readers: Number of metadata files read from NCI at the same time
+        """
+        self.s3_base_url = s3_base_url
+        self.explorer_base_url = explorer_base_url
+        self._readers = ThreadPoolExecutor(
+            max_workers=readers, thread_name_prefix="metadata-reader"
+        )
+        self._builder = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="metadata-builder"
+        )
+
+    def submit(self, nci_metadata_file, s3_path):
+        """
+        Start preparing the metadata of a granule
+
+        :param nci_metadata_file: Path of metadata file in NCI
+        :param s3_path: Path in S3
+        :return: Future of the MetadataOutputs
+        """
+        prepared = Future()
+        read = self._readers.submit(read_metadata_source, nci_metadata_file)
+
+        def on_built(built):
+            if built.exception() is not None:
+                prepared.set_exception(built.exception())
+            else:
+                prepared.set_result(built.result())
+
+        def on_read(read):
+            if read.exception() is not None:
+                prepared.set_exception(read.exception())
+                return
+            self._builder.submit(
+                build_metadata_outputs,
+                read.result(),
+                self.s3_base_url,
+                self.explorer_base_url,
+                s3_path,
+            ).add_done_callback(on_built)
+
+        read.add_done_callback(on_read)
+        return prepared
+
+    def close(self):
+        """
+        Stop the reader and CPU stages
+        """
+        self._readers.shutdown()
+        self._builder.shutdown()
+
+
+def update_metadata(
+        nci_metadata_file,
+        s3_bucket,
+        s3_base_url,
+        explorer_base_url,
+        sns_topic,
+        s3_path,
+        sns_publisher=None,
+        journal=None,
+        prepared_metadata=None,
+        published_hashes=None,
+        data_synced=True,
+):
+    """
+    Uploads updated metadata with nbar element removed, updated checksum file, STAC doc created
+    and publish SNS message
+
+    :param nci_metadata_file: Path of metadata file in NCI
+    :param s3_bucket: Name of S3 bucket
+    :param s3_base_url: Base URL of the S3 bucket
+    :param explorer_base_url: Base URL of the explorer
+    :param sns_topic: ARN of the SNS topic
+    :param s3_path: Path in S3
+    :param sns_publisher: SnsBatchPublisher to queue the message on, or None to
+    publish it now
+    :param journal: GranuleJournal to skip and record completed stages, or None
+    :param prepared_metadata: Future of the MetadataOutputs from a MetadataPipeline,
+    or None to read and build them now
+    :param published_hashes: Hashes stored on the checksum file by the last upload,
+    documents that hash the same are left as they are in S3
+    :param data_synced: Whether the granule's data is in S3, by this run or an
+    earlier one, else the checksum file isn't uploaded
+    :return: List of errors
+    """
+
+    def is_done(stage):
+        return journal is not None and journal.is_done(
+            nci_metadata_file, "added", stage
+        )
+
+    def record(stage):
+        if journal is not None:
+            journal.record(nci_metadata_file, "added", stage)
+
+    # Initialise error list
+    metadata_error_list = []
+
+    if prepared_metadata is None:
+        outputs = build_metadata_outputs(
+            read_metadata_source(nci_metadata_file),
+            s3_base_url,
+            explorer_base_url,
+            s3_path,
+        )
+    else:
+        outputs = prepared_metadata.result()
+    nci_metadata_file_path = outputs.nci_metadata_file_path
+    stac_sha1 = outputs.new_checksum_list[outputs.stac_file_name]
+    hashes = {
+        "source-sha1": outputs.checksum_sha1,
+        "metadata-sha1": outputs.new_checksum_list[nci_metadata_file_path.name],
+        "stac-sha1": stac_sha1,
+    }
+    hashes = dicttoolz.valfilter(lambda value: value is not None, hashes)
+
+    def unchanged(name):
+        if published_hashes is None or published_hashes.get(name) != hashes.get(name):
+            return False
+        LOG.info(f"{name} of {nci_metadata_file_path.name} unchanged, not uploading")
+        return True
+
+    # Write odc metadata yaml object into S3
+    s3_metadata_file = f"{s3_path}/{nci_metadata_file_path.name}"
+    try:
+        if unchanged("metadata-sha1"):
+            record("metadata")
+        elif not is_done("metadata"):
+            with METRICS.measure("metadata_upload") as moved:
+                moved["nbytes"] = len(outputs.metadata_yaml)
+                upload_s3_resource(
+                    s3_bucket,
+                    s3_metadata_file,
+                    outputs.metadata_yaml,
+                    {"sha1": hashes["metadata-sha1"]},
+                )
+            record("metadata")
+            LOG.info(f"Finished uploading metadata to {s3_metadata_file}")
+    except S3SyncException as exp:
+        LOG.error(f"Failed uploading metadata to {s3_metadata_file} - {exp}")
+        metadata_error_list.append(
+            f"Failed uploading metadata to {s3_metadata_file} - {exp}"
+        )
+
+    # Write stac metadata json object into S3
+    stac_dump = outputs.stac_dump
+    s3_stac_file = f"{s3_path}/{outputs.stac_file_name}"
+    # The SNS message is the STAC document, so it goes unpublished too when the
+    # document is unchanged
+    stac_unchanged = unchanged("stac-sha1")
+    try:
+        if stac_unchanged:
+            record("stac")
+        elif not is_done("stac"):
+            with METRICS.measure("stac_upload") as moved:
+                moved["nbytes"] = len(outputs.stac_json)
+                upload_s3_resource(
+                    s3_bucket, s3_stac_file, outputs.stac_json, {"sha1": stac_sha1}
+                )
+            record("stac")
             LOG.info(f"Finished uploading STAC metadata to {s3_stac_file}")
-        except S3SyncException as exp:
-            LOG.error(f"Failed uploading STAC metadata to {s3_stac_file} - {exp}")
-            metadata_error_list.append(
-                f"Failed uploading STAC metadata to {s3_stac_file} - {exp}"
-            )
+    except S3SyncException as exp:
+        LOG.error(f"Failed uploading STAC metadata to {s3_stac_file} - {exp}")
+        metadata_error_list.append(
+            f"Failed uploading STAC metadata to {s3_stac_file} - {exp}"
+        )
 
     # Publish message containing STAC metadata to SNS Topic
     message_attributes = get_common_message_attributes(json.loads(stac_dump))
     message_attributes.update(
         {"action": {"DataType": "String", "StringValue": "ADDED"}}
     )
-    try:
-        publish_sns(sns_topic, stac_dump, message_attributes)
-        LOG.info(f"Finished publishing SNS Message to SNS Topic {sns_topic}")
-    except S3SyncException as exp:
-        LOG.error(f"Failed publishing SNS Message to SNS Topic {sns_topic} - {exp}")
-        metadata_error_list.append(
-            f"Failed publishing SNS Message to SNS Topic {sns_topic} - {exp}"
+    if stac_unchanged:
+        record("sns")
+    elif is_done("sns"):
+        pass
+    elif sns_publisher:
+        sns_publisher.publish(
+            stac_dump, message_attributes, on_published=lambda: record("sns")
         )
+    else:
+        try:
+            with METRICS.measure("sns_publish") as moved:
+                moved["nbytes"] = _sns_entry_size(stac_dump, message_attributes)
+                publish_sns(sns_topic, stac_dump, message_attributes)
+            record("sns")
+            LOG.info(f"Finished publishing SNS Message to SNS Topic {sns_topic}")
+        except S3SyncException as exp:
+            LOG.error(f"Failed publishing SNS Message to SNS Topic {sns_topic} - {exp}")
+            metadata_error_list.append(
+                f"Failed publishing SNS Message to SNS Topic {sns_topic} - {exp}"
+            )
 
     # Update checksum file
     checksum_filename = nci_metadata_file_path.stem.replace(".odc-metadata", "")
     checksum_file_path = nci_metadata_file_path.with_name(f"{checksum_filename}.sha1")
     try:
-        upload_checksum(
-            nci_metadata_file_path,
-            checksum_file_path,
-            new_checksum_list,
-            s3_bucket,
-            s3_path,
-        )
-        LOG.info(
-            f"Finished uploading checksum file " f"{s3_path}/{checksum_file_path.name}"
-        )
+        if not data_synced:
+            # The source checksum stored on it marks the data as synced, and a
+            # forced update would then never sync the data again
+            LOG.warning(
+                f"Data not synced, not uploading checksum file "
+                f"{s3_path}/{checksum_file_path.name}"
+            )
+        # Built from the source checksum file and the two documents' hashes
+        elif published_hashes and all(
+            published_hashes.get(name) == value for name, value in hashes.items()
+        ):
+            record("checksum")
+        elif not is_done("checksum"):
+            with METRICS.measure("checksum_upload"):
+                upload_checksum(
+                    nci_metadata_file_path,
+                    checksum_file_path,
+                    outputs.new_checksum_list,
+                    s3_bucket,
+                    s3_path,
+                    outputs.checksum_lines,
+                    hashes,
+                )
+            record("checksum")
+            LOG.info(
+                f"Finished uploading checksum file "
+                f"{s3_path}/{checksum_file_path.name}"
+            )
     except S3SyncException as exp:
         LOG.error(
             f"Failed uploading checksum file "
@@ -355,58 +1672,353 @@ def update_metadata(
     return metadata_error_list
 
 
-def archive_granule(granule, s3_root_path, s3_bucket):
+def is_excluded(relative_path, matcher=SYNC_EXCLUDE_MATCHER):
     """
-    Run AWS rm command to delete granules from S3 bucket
+    Check a path against exclude patterns, matched the way the aws cli does
+
+    :param relative_path: Path relative to the granule directory, or S3 prefix
+    :param matcher: Exclude patterns combined by compile_patterns
+    :return: True if excluded else False
+    """
+    return matcher.match(relative_path) is not None
+
+
+def list_s3_objects(s3_bucket, prefix):
+    """
+    List every object under a prefix with ListObjectsV2
+
+    :param s3_bucket: Name of the S3 bucket
+    :param prefix: S3 prefix to list
+    :return: Dict of key and object summary
+    """
+    paginator = get_aws_client("s3").get_paginator("list_objects_v2")
+    try:
+        return {
+            obj["Key"]: obj
+            for page in paginator.paginate(Bucket=s3_bucket, Prefix=prefix)
+            for obj in page.get("Contents", [])
+        }
+    except (ClientError, BotoCoreError) as exception:
+        raise S3SyncException(str(exception))
+
+
+def delete_s3_objects(s3_bucket, keys):
+    """
+    Delete objects with DeleteObjects, up to a thousand keys per request
 
-    :param granule: Name of the granule
-    :param s3_root_path: Root folder of the S3 bucket
     :param s3_bucket: Name of the S3 bucket
-    :return: Returns code zero, if success.
+    :param keys: Keys to delete
+    :return: Dict of key and error, for the keys that failed to delete
+    """
+    s3_client = get_aws_client("s3")
+    delete_errors = {}
+    keys = list(keys)
+    for start in range(0, len(keys), DELETE_BATCH_SIZE):
+        batch = keys[start : start + DELETE_BATCH_SIZE]
+        try:
+            response = s3_client.delete_objects(
+                Bucket=s3_bucket,
+                Delete={"Objects": [{"Key": key} for key in batch], "Quiet": True},
+            )
+        except (ClientError, BotoCoreError) as exception:
+            delete_errors.update(
+                (key, f"Failed deleting {key} - {exception}") for key in batch
+            )
+            continue
+        delete_errors.update(
+            (
+                error["Key"],
+                f"Failed deleting {error['Key']} - {error['Code']} {error['Message']}",
+            )
+            for error in response.get("Errors", [])
+        )
+    return delete_errors
+
+
+def read_checksums(granule_path):
+    """
+    Read the checksums of a granule's files from its .sha1 file
+
+    :param granule_path: Directory of the granule in NCI
+    :return: Dict of filename and sha1 checksum
     """
-    s3_path = f"s3://{s3_bucket}/{s3_root_path}/{granule}"
+    checksums = {}
+    for checksum_file_path in granule_path.glob("*.sha1"):
+        with checksum_file_path.open("r") as f:
+            for line in f:
+                if line.strip():
+                    hash_, filename = line.strip().split("\t")
+                    checksums[filename] = hash_
+    return checksums
 
-    # Remove any data that shouldn't be there and exclude the metadata
-    command = f"aws s3 rm {s3_path} " "--only-show-error " "--recursive "
 
-    return_code = subprocess.call(command, shell=True)
+def needs_upload(local_file, remote_object, checksum):
+    """
+    Decide if a local file differs from its copy in S3
+
+    Like aws s3 sync, a file is uploaded when its size differs or it was modified
+    after the S3 copy. A newer file with the same checksum as the S3 copy is skipped.
 
-    if return_code != 0:
-        raise S3SyncException(f"Failed running S3 rm command")
+    :param local_file: Path of the local file
+    :param remote_object: Object summary from the S3 listing, or None if missing
+    :param checksum: sha1 checksum of the local file, or None if unknown
+    :return: True if the file should be uploaded else False
+    """
+    if remote_object is None:
+        return True
+    stat = local_file.stat()
+    if stat.st_size != remote_object["Size"]:
+        return True
+    # S3 keeps whole seconds
+    modified = datetime.fromtimestamp(int(stat.st_mtime), tz=timezone.utc)
+    if modified <= remote_object["LastModified"]:
+        return False
+    if checksum is None:
+        return True
+    try:
+        response = get_aws_client("s3").head_object(
+            Bucket=remote_object["Bucket"], Key=remote_object["Key"]
+        )
+    except (ClientError, BotoCoreError) as exception:
+        raise S3SyncException(str(exception))
+    return response.get("Metadata", {}).get("sha1") != checksum
 
 
 def sync_granule(granule, nci_dir, s3_root_path, s3_bucket):
     """
-    Run AWS sync command to sync granules to S3 bucket
+    Sync granule files to S3 bucket, uploading only files that differ and
+    removing files that shouldn't be there
+
+    Metadata, checksum and NBAR files are excluded, and left alone in S3.
 
     :param granule: Name of the granule
     :param nci_dir: Source directory for the files in NCI
     :param s3_root_path: Root folder of the S3 bucket
     :param s3_bucket: Name of the S3 bucket
-    :return: Returns code zero, if success.
+    :return: Number of bytes uploaded
     """
     local_path = Path(nci_dir).joinpath(granule)
-    s3_path = f"s3://{s3_bucket}/{s3_root_path}/{granule}"
-
-    # Remove any data that shouldn't be there and exclude the metadata
-    command = (
-        f"aws s3 sync {local_path} {s3_path} "
-        "--only-show-errors "
-        "--delete "
-        "--exclude ga_*_nbar_*.* "
-        "--exclude ga_*_nbar-*.* "
-        "--exclude *.sha1 "
-        "--exclude ga_*.odc-metadata.yaml"
+    s3_path = f"{s3_root_path}/{granule}/"
+
+    remote_objects = {
+        key: dict(obj, Bucket=s3_bucket)
+        for key, obj in list_s3_objects(s3_bucket, s3_path).items()
+        if not is_excluded(key[len(s3_path) :])
+    }
+    checksums = read_checksums(local_path)
+
+    transfer_manager = get_transfer_manager()
+    uploads = {}
+    for local_file in sorted(local_path.rglob("*")):
+        relative_path = local_file.relative_to(local_path).as_posix()
+        if not local_file.is_file() or is_excluded(relative_path):
+            continue
+        key = f"{s3_path}{relative_path}"
+        checksum = checksums.get(relative_path)
+        if needs_upload(local_file, remote_objects.pop(key, None), checksum):
+            # Guess the Content-Type like aws s3 sync, so thumbnails show in browsers
+            extra_args = {}
+            content_type, _ = mimetypes.guess_type(local_file.name)
+            if content_type:
+                extra_args["ContentType"] = content_type
+            if checksum:
+                extra_args["Metadata"] = {"sha1": checksum}
+            uploads[key] = transfer_manager.upload(
+                str(local_file), s3_bucket, key, extra_args=extra_args or None
+            )
+
+    sync_error_list = []
+    uploaded_bytes = 0
+    for key, upload in uploads.items():
+        try:
+            upload.result()
+            uploaded_bytes += upload.meta.size or 0
+        except (ClientError, BotoCoreError, OSError) as exception:
+            sync_error_list.append(f"Failed uploading {key} - {exception}")
+
+    # Remove any data that shouldn't be there
+    sync_error_list.extend(delete_s3_objects(s3_bucket, remote_objects).values())
+    LOG.debug(
+        f"Uploaded {len(uploads)} and deleted {len(remote_objects)} files of {granule}"
     )
+    if sync_error_list:
+        raise S3SyncException("\n".join(sync_error_list))
+    return uploaded_bytes
 
-    return_code = subprocess.call(command, shell=True)
 
-    if return_code != 0:
-        raise S3SyncException(f"Failed running S3 sync command")
+class ArchiveBatch:
+    """
+    Collects the S3 keys of archived granules and deletes them together with
+    DeleteObjects, publishing the ARCHIVED SNS message of each granule once all
+    of its keys are gone
 
+    Safe to share between the granule workers.
+    """
 
-def sync_granules(
-        file_path,
+    def __init__(self, s3_bucket, sns_topic, sns_publisher=None, journal=None):
+        """
+        :param s3_bucket: Name of the S3 bucket
+        :param sns_topic: ARN of the SNS topic
+        :param sns_publisher: SnsBatchPublisher to queue the messages on, or None
+        to publish them straight away
+        :param journal: GranuleJournal to record completed stages, or None
+        """
+        self.s3_bucket = s3_bucket
+        self.sns_topic = sns_topic
+        self.sns_publisher = sns_publisher
+        self.journal = journal
+        self.error_list = []
+        self._pending = []
+        self._pending_keys = 0
+        self._lock = threading.Lock()
+
+    def add(self, metadata_file, granule, keys, stac_doc):
+        """
+        Queue a granule to be archived, deleting the queued keys once there are
+        enough of them to fill a DeleteObjects request
+
+        :param metadata_file: Metadata file of the granule in NCI
+        :param granule: Name of the granule
+        :param keys: S3 keys of the granule's files
+        :param stac_doc: STAC dict of the granule, sent in the SNS message
+        """
+        with self._lock:
+            self._pending.append((metadata_file, granule, list(keys), stac_doc))
+            self._pending_keys += len(keys)
+            if self._pending_keys < DELETE_BATCH_SIZE:
+                return
+            pending = self._take_pending()
+        self._archive(pending)
+
+    def close(self):
+        """
+        Archive the granules still queued
+
+        :return: List of errors from the whole run
+        """
+        with self._lock:
+            pending = self._take_pending()
+        self._archive(pending)
+        return self.error_list
+
+    def _take_pending(self):
+        pending, self._pending, self._pending_keys = self._pending, [], 0
+        return pending
+
+    def _archive(self, pending):
+        if not pending:
+            return
+        with METRICS.measure("archive_delete"):
+            delete_errors = delete_s3_objects(
+                self.s3_bucket, [key for _, _, keys, _ in pending for key in keys]
+            )
+        error_list = []
+        for metadata_file, granule, keys, stac_doc in pending:
+            granule_errors = [
+                delete_errors[key] for key in keys if key in delete_errors
+            ]
+            if granule_errors:
+                LOG.error(
+                    f"Failed to archive {granule} "
+                    f"because of an error in the delete - {granule_errors}"
+                )
+                error_list.append(
+                    f"Failed to archive {granule} "
+                    f"because of an error in the delete - {granule_errors}"
+                )
+                continue
+            # The STAC item is deleted, so its message is kept for a rerun
+            message = json.dumps(stac_doc)
+            self._record(metadata_file, "archived", message)
+            LOG.info(f"Finished S3 archive of granule - {granule}")
+            self.publish(metadata_file, message)
+        with self._lock:
+            self.error_list.extend(error_list)
+
+    def publish(self, metadata_file, message):
+        """
+        Publish the ARCHIVED SNS message of an archived granule
+
+        :param metadata_file: Metadata file of the granule in NCI
+        :param message: STAC document of the granule, as JSON
+        """
+        # Publish message containing STAC metadata to SNS Topic
+        message_attributes = get_common_message_attributes(json.loads(message))
+        message_attributes.update(
+            {
+                "action": {
+                    "DataType": "String",
+                    "StringValue": "ARCHIVED",
+                }
+            }
+        )
+        if self.sns_publisher:
+            self.sns_publisher.publish(
+                message,
+                message_attributes,
+                on_published=lambda: self._record(metadata_file, "sns"),
+            )
+            return
+        try:
+            publish_sns(self.sns_topic, message, message_attributes)
+            self._record(metadata_file, "sns")
+            LOG.info(f"Finished publishing SNS Message to SNS Topic {self.sns_topic}")
+        except S3SyncException as exp:
+            LOG.error(
+                f"Failed publishing SNS Message to SNS Topic {self.sns_topic} - {exp}"
+            )
+            with self._lock:
+                self.error_list.append(
+                    f"Failed publishing SNS Message to SNS Topic {self.sns_topic} - {exp}"
+                )
+
+    def _record(self, metadata_file, stage, message=None):
+        if self.journal is not None:
+            self.journal.record(metadata_file, "archived", stage, message)
+
+
+def granule_s3_path(metadata_file, nci_dir, s3_root_path):
+    """
+    Path in S3 of a granule's directory
+
+    :param metadata_file: Path of metadata file in NCI
+    :param nci_dir: Source directory for the files in NCI
+    :param s3_root_path: Root folder of the S3 bucket
+    :return: Path in S3
+    """
+    return f"{s3_root_path}/{Path(metadata_file).relative_to(nci_dir).parent}"
+
+
+def needs_metadata(granule_row, nci_dir, s3_root_path, update, existing_metadata):
+    """
+    Check cheaply if a granule's metadata will be uploaded, so it is only prepared
+    ahead when it is likely to be used
+
+    :param granule_row: Row from the csv file
+    :param nci_dir: Source directory for the files in NCI
+    :param s3_root_path: Root folder of the S3 bucket
+    :param update: Sets flag for a fresh sync of data and replace the metadata
+    :param existing_metadata: Set of metadata keys in S3, or None if unknown
+    :return: True if the metadata is likely needed else False, including when it
+    is only known once the worker has checked S3
+    """
+    if not granule_row or (len(granule_row) > 1 and granule_row[1]):
+        return False
+    metadata_file_path = Path(granule_row[0])
+    try:
+        s3_path = granule_s3_path(metadata_file_path, nci_dir, s3_root_path)
+    except ValueError:
+        return False
+    if update:
+        return metadata_file_path.exists()
+    if existing_metadata is None:
+        # The worker starts it once the HEAD shows the granule isn't in S3
+        return False
+    return f"{s3_path}/{metadata_file_path.name}" not in existing_metadata
+
+
+def process_granule(
+        granule_row,
         nci_dir,
         s3_root_path,
         s3_bucket,
@@ -414,11 +2026,20 @@ def sync_granules(
         explorer_base_url,
         sns_topic,
         update=False,
+        existing_metadata=None,
+        archive_batch=None,
+        sns_publisher=None,
+        journal=None,
+        prepared_metadata=None,
+        metadata_pipeline=None,
 ):
     """
-    Sync granules to S3 bucket for specified dates
+    Sync or archive a single granule listed in the csv file
+
+    Data is always synced before the metadata is updated, so a granule's metadata
+    never appears in S3 ahead of its data.
 
-    :param file_path: File path for the csv file listing scenes path
+    :param granule_row: Row from the csv file, metadata path and archived date
     :param nci_dir: Source directory for the files in NCI
     :param s3_root_path: Root folder of the S3 bucket
     :param s3_bucket: Name of the S3 bucket
@@ -426,141 +2047,369 @@ def sync_granules(
     :param explorer_base_url: Base URL of the Explorer
     :param sns_topic: ARN of the SNS topic
     :param update: Sets flag for a fresh sync of data and replace the metadata
+    :param existing_metadata: Set of metadata keys in S3, or None to ask S3
+    :param archive_batch: ArchiveBatch shared by the run, or None to archive now
+    :param sns_publisher: SnsBatchPublisher shared by the run, or None to publish
+    messages straight away
+    :param journal: GranuleJournal of a previous run to resume, or None
+    :param prepared_metadata: Future of the MetadataOutputs from a MetadataPipeline,
+    or None to read and build them when needed
+    :param metadata_pipeline: MetadataPipeline to prepare the metadata on while the
+    data syncs, when it wasn't prepared ahead, or None
+    :return: List of errors
     """
     # Initialise error list
     error_list = []
 
-    # Get list of granules
-    list_of_granules = find_granules(file_path)
-    granules_count = len(list_of_granules)
-    LOG.info(f"Found {granules_count} files to process")
-
-    # For each granule, sync it if it needs syncing
-    if granules_count > 0:
-        for granule_row in list_of_granules:
-
-            metadata_file = granule_row[0] if len(granule_row) > 0 else None
-            is_archived = True if (len(granule_row) > 1 and granule_row[1]) else False
-            action = "archived" if is_archived else "added"
-            LOG.info(f"Processing {action} granule - {metadata_file} ")
-
-            metadata_file_path = Path(metadata_file)
-            granule = metadata_file_path.relative_to(nci_dir).parent
-            metadata_file_name = metadata_file_path.name
-            s3_path = f"{s3_root_path}/{granule}"
-            s3_metadata_file = f"{s3_path}/{metadata_file_name}"
-            s3_stac_file = f"{s3_path}/{metadata_file_path.stem.replace('.odc-metadata', '')}.stac-item.json"
-
-            if is_archived:
-                # Checks if metadata file exists in S3
-                exists_in_s3 = check_granule_exists(s3_bucket, s3_metadata_file)
-                if exists_in_s3:
-                    try:
-                        stac_dump = json.load(load_s3_resource(s3_bucket, s3_stac_file))
+    metadata_file = granule_row[0] if len(granule_row) > 0 else None
+    is_archived = True if (len(granule_row) > 1 and granule_row[1]) else False
+    action = "archived" if is_archived else "added"
+    LOG.info(f"Processing {action} granule - {metadata_file} ")
+
+    metadata_file_path = Path(metadata_file)
+    granule = metadata_file_path.relative_to(nci_dir).parent
+    metadata_file_name = metadata_file_path.name
+    s3_path = granule_s3_path(metadata_file, nci_dir, s3_root_path)
+    s3_metadata_file = f"{s3_path}/{metadata_file_name}"
+    s3_stac_file = f"{s3_path}/{metadata_file_path.stem.replace('.odc-metadata', '')}.stac-item.json"
+    checksum_file_path = metadata_file_path.with_name(
+        f"{metadata_file_path.stem.replace('.odc-metadata', '')}.sha1"
+    )
 
-                        # Delete all files from the S3 path
-                        archive_granule(granule, s3_root_path, s3_bucket)
-                        LOG.info(f"Finished S3 archive of granule - {granule}")
+    # Carry on with the stages a previous run didn't finish
+    resumed = journal is not None and journal.started(metadata_file, action)
+    if resumed and journal.all_done(
+        metadata_file, action, ARCHIVED_STAGES if is_archived else ADDED_STAGES
+    ):
+        LOG.info(f"Skipping {action} granule {granule}, completed by a previous run")
+        return error_list
+
+    if is_archived:
+        if resumed and journal.is_done(metadata_file, action, "archived"):
+            # The files and STAC document are already gone, publish the message
+            # the previous run recorded with them
+            message = journal.message(metadata_file, action)
+            if message is None:
+                LOG.warning(
+                    f"Granule {granule} was archived by a previous run "
+                    f"that didn't record its SNS message, not publishing it"
+                )
+            else:
+                batch = archive_batch or ArchiveBatch(
+                    s3_bucket, sns_topic, sns_publisher, journal
+                )
+                batch.publish(metadata_file, message)
+                if archive_batch is None:
+                    error_list.extend(batch.close())
+        # Checks if metadata file exists in S3
+        elif granule_exists(s3_bucket, s3_metadata_file, existing_metadata):
+            try:
+                with METRICS.measure("stac_download"):
+                    stac_dump = json.load(load_s3_resource(s3_bucket, s3_stac_file))
+
+                # Queue all files from the S3 path for deletion, the SNS message
+                # is published once they are deleted
+                batch = archive_batch or ArchiveBatch(
+                    s3_bucket, sns_topic, sns_publisher, journal
+                )
+                batch.add(
+                    metadata_file,
+                    granule,
+                    list_s3_objects(s3_bucket, f"{s3_path}/"),
+                    stac_dump,
+                )
+                if archive_batch is None:
+                    error_list.extend(batch.close())
+
+            except S3SyncException as exp:
+                LOG.error(
+                    f"Failed to archive {granule} "
+                    f"because of an error in the delete - {exp}"
+                )
+                error_list.append(
+                    f"Failed to archive {granule} "
+                    f"because of an error in the delete - {exp}"
+                )
+        else:
+            LOG.warning(
+                f"Metadata doesn't exists in S3, "
+                f"not deleting anything from S3 for {granule}"
+            )
+    else:
 
-                        # Publish message containing STAC metadata to SNS Topic
-                        message_attributes = get_common_message_attributes(stac_dump)
-                        message_attributes.update(
-                            {
-                                "action": {
-                                    "DataType": "String",
-                                    "StringValue": "ARCHIVED",
-                                }
-                            }
-                        )
-                        try:
-                            publish_sns(
-                                sns_topic, json.dumps(stac_dump), message_attributes
-                            )
-                            LOG.info(
-                                f"Finished publishing SNS Message to SNS Topic {sns_topic}"
-                            )
-                        except S3SyncException as exp:
-                            LOG.error(
-                                f"Failed publishing SNS Message to SNS Topic {sns_topic} - {exp}"
-                            )
-                            error_list.append(
-                                f"Failed publishing SNS Message to SNS Topic {sns_topic} - {exp}"
-                            )
+        # Checking if metadata file exists
+        if metadata_file_path.exists():
+            # s3://dea-public-data
+            # /analysis-ready-data/ga_ls5t_ard_3/088/080/1990/11/15
+            # /ga_ls5t_ard_3-0-0_088080_1990-11-15_final.odc-metadata.yaml
 
-                    except S3SyncException as exp:
-                        LOG.error(
-                            f"Failed to archive {granule} "
-                            f"because of an error in the rm command - {exp}"
-                        )
-                        error_list.append(
-                            f"Failed to archive {granule} "
-                            f"because of an error in the rm command - {exp}"
+            already_processed = granule_exists(
+                s3_bucket, s3_metadata_file, existing_metadata
+            )
+
+            # Check if already processed and update flag set to force replace
+            if not already_processed or update or resumed:
+                if prepared_metadata is None and metadata_pipeline is not None:
+                    # Read and build the metadata while the data syncs
+                    prepared_metadata = metadata_pipeline.submit(metadata_file, s3_path)
+                # A forced update leaves alone whatever hashes the same as the
+                # last upload, which stored its hashes on the checksum file
+                published_hashes = None
+                if already_processed and update and not resumed:
+                    try:
+                        published_hashes = read_published_hashes(
+                            s3_bucket, f"{s3_path}/{checksum_file_path.name}"
                         )
-                else:
-                    LOG.warning(
-                        f"Metadata doesn't exists in S3, "
-                        f"not deleting anything from S3 for {granule}"
+                    except S3SyncException as exp:
+                        LOG.warning(f"Failed reading hashes of {granule} - {exp}")
+                source_sha1 = file_sha1(checksum_file_path) if published_hashes else None
+                data_unchanged = (
+                    source_sha1 is not None
+                    and published_hashes.get("source-sha1") == source_sha1
+                )
+                data_synced = True
+                try:
+                    if data_unchanged:
+                        LOG.info(f"Data of granule {granule} unchanged, not syncing")
+                        if journal is not None:
+                            journal.record(metadata_file, action, "data")
+                    elif not (resumed and journal.is_done(metadata_file, action, "data")):
+                        data_synced = False
+                        with METRICS.measure("data_sync") as moved:
+                            moved["nbytes"] = sync_granule(
+                                granule, nci_dir, s3_root_path, s3_bucket
+                            )
+                        data_synced = True
+                        if journal is not None:
+                            journal.record(metadata_file, action, "data")
+                        LOG.info(f"Finished S3 sync of granule - {granule}")
+                except S3SyncException as exp:
+                    LOG.error(
+                        f"Failed to sync of {granule} "
+                        f"because of an error in the sync - {exp}"
                     )
+                    error_list.append(
+                        f"Failed to sync of {granule} "
+                        f"because of an error in the sync - {exp}"
+                    )
+
+                metadata_update_error_list = update_metadata(
+                    metadata_file,
+                    s3_bucket,
+                    s3_base_url,
+                    explorer_base_url,
+                    sns_topic,
+                    s3_path,
+                    sns_publisher,
+                    journal,
+                    prepared_metadata,
+                    published_hashes,
+                    data_synced,
+                )
+                error_list.extend(metadata_update_error_list)
+
             else:
+                LOG.warning(
+                    f"Metadata exists in S3 and update is not set to True, "
+                    f"not syncing {granule}"
+                )
+
+        else:
+            LOG.error(
+                f"Failed to sync {metadata_file} "
+                f"because of missing metadata file in NCI"
+            )
+            error_list.append(
+                f"Failed to sync {metadata_file} "
+                f"because of missing metadata file in NCI"
+            )
 
-                # Checking if metadata file exists
-                if metadata_file_path.exists():
-                    # s3://dea-public-data
-                    # /analysis-ready-data/ga_ls5t_ard_3/088/080/1990/11/15
-                    # /ga_ls5t_ard_3-0-0_088080_1990-11-15_final.odc-metadata.yaml
+    return error_list
 
-                    already_processed = check_granule_exists(
-                        s3_bucket, s3_metadata_file
-                    )
 
-                    # Check if already processed and update flag set to force replace
-                    if not already_processed or update:
-                        try:
-                            sync_granule(granule, nci_dir, s3_root_path, s3_bucket)
-                            LOG.info(f"Finished S3 sync of granule - {granule}")
-                        except S3SyncException as exp:
-                            LOG.error(
-                                f"Failed to sync of {granule} "
-                                f"because of an error in the sync command - {exp}"
-                            )
-                            error_list.append(
-                                f"Failed to sync of {granule} "
-                                f"because of an error in the sync command - {exp}"
-                            )
+def sync_granules(
+        file_paths,
+        nci_dir,
+        s3_root_path,
+        s3_bucket,
+        s3_base_url,
+        explorer_base_url,
+        sns_topic,
+        update=False,
+        workers=1,
+        existence_index="head",
+        inventory_manifest=None,
+        journal_path=None,
+        shard_index=0,
+        shard_count=1,
+        metadata_readers=4,
+        metrics_json=None,
+        prometheus_textfile=None,
+):
+    """
+    Sync granules to S3 bucket for specified dates
 
-                        metadata_update_error_list = update_metadata(
-                            metadata_file,
-                            s3_bucket,
-                            s3_base_url,
-                            explorer_base_url,
-                            sns_topic,
-                            s3_path,
-                        )
-                        error_list.extend(metadata_update_error_list)
+    :param file_paths: List of csv files listing scenes path, usually one per
+    product, whose granules share the same workers
+    :param nci_dir: Source directory for the files in NCI
+    :param s3_root_path: Root folder of the S3 bucket
+    :param s3_bucket: Name of the S3 bucket
+    :param s3_base_url: Base URL of the S3 bucket
+    :param explorer_base_url: Base URL of the Explorer
+    :param sns_topic: ARN of the SNS topic
+    :param update: Sets flag for a fresh sync of data and replace the metadata
+    :param workers: Number of granules to process concurrently
+    :param existence_index: How to check if granules are already in S3, a head
+    request per granule, a listing of the affected prefixes or an S3 Inventory
+    :param inventory_manifest: Path or s3:// URL of the S3 Inventory manifest.json
+    :param journal_path: Path of the journal recording completed stages, a rerun
+    with the same journal skips them
+    :param shard_index: Shard of the granules to process, from 0 to shard_count - 1
+    :param shard_count: Number of shards the granules are split into
+    :param metadata_readers: Number of metadata files read ahead from NCI at the
+    same time
+    :param metrics_json: Path to write the stage metrics to as JSON, or None
+    :param prometheus_textfile: Path to write the stage metrics to as a Prometheus
+    textfile, or None
+    """
+    # Initialise error list
+    error_list = []
+    METRICS.reset()
 
-                    else:
-                        LOG.warning(
-                            f"Metadata exists in S3 and update is not set to True, "
-                            f"not syncing {granule}"
-                        )
+    if isinstance(file_paths, (str, Path)):
+        file_paths = [file_paths]
 
-                else:
-                    LOG.error(
-                        f"Failed to sync {metadata_file} "
-                        f"because of missing metadata file in NCI"
-                    )
-                    error_list.append(
-                        f"Failed to sync {metadata_file} "
-                        f"because of missing metadata file in NCI"
-                    )
-    else:
+    # Stream the granules, so memory doesn't grow with the length of the csv files
+    granules = find_product_granules(file_paths, shard_index, shard_count)
+    first_granule = next(granules, None)
+    if first_granule is None:
         LOG.warning("Didn't find any granules to process...")
+        return
+    granules = itertools.chain([first_granule], granules)
+
+    configure_aws_clients(workers)
+
+    # Find what is already in S3 up front, instead of asking per granule
+    existing_metadata = None
+    if existence_index == "list":
+        with METRICS.measure("existence_index"):
+            existing_metadata = list_existing_metadata(
+                s3_bucket,
+                index_prefixes(
+                    find_product_granules(file_paths, shard_index, shard_count),
+                    nci_dir,
+                    s3_root_path,
+                ),
+            )
+    elif existence_index == "inventory":
+        with METRICS.measure("existence_index"):
+            existing_metadata = read_inventory_metadata(
+                inventory_manifest, s3_bucket, s3_root_path, workers
+            )
+
+    # SNS messages are published in batches from a background thread, and
+    # archived granules are deleted in batches across the whole run
+    journal = GranuleJournal(journal_path) if journal_path else None
+    sns_publisher = SnsBatchPublisher(sns_topic)
+    archive_batch = ArchiveBatch(s3_bucket, sns_topic, sns_publisher, journal)
+
+    # Metadata is read from NCI and built ahead of the workers uploading it
+    metadata_pipeline = MetadataPipeline(
+        s3_base_url, explorer_base_url, metadata_readers
+    )
+
+    process_args = (
+        nci_dir,
+        s3_root_path,
+        s3_bucket,
+        s3_base_url,
+        explorer_base_url,
+        sns_topic,
+        update,
+        existing_metadata,
+        archive_batch,
+        sns_publisher,
+        journal,
+    )
+    granules_count = 0
+    try:
+        LOG.info(f"Processing granules with {workers} workers")
+        # Threads are enough here, the work is waiting on S3 and SNS. Only a few
+        # granules per worker are read ahead of the ones being processed.
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            in_flight = {}
+            for granule_row in granules:
+                granules_count += 1
+                if len(in_flight) >= 2 * workers:
+                    done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        error_list.extend(
+                            _granule_result(in_flight.pop(future), future.result)
+                        )
+                prepared_metadata = None
+                if needs_metadata(
+                    granule_row, nci_dir, s3_root_path, update, existing_metadata
+                ):
+                    prepared_metadata = metadata_pipeline.submit(
+                        granule_row[0],
+                        granule_s3_path(granule_row[0], nci_dir, s3_root_path),
+                    )
+                future = executor.submit(
+                    _measured_process_granule,
+                    granule_row,
+                    *process_args,
+                    prepared_metadata=prepared_metadata,
+                    metadata_pipeline=metadata_pipeline,
+                )
+                in_flight[future] = granule_row
+            for future in in_flight:
+                error_list.extend(_granule_result(in_flight[future], future.result))
+        error_list.extend(archive_batch.close())
+    finally:
+        metadata_pipeline.close()
+        error_list.extend(sns_publisher.close())
+        close_transfer_manager()
+        LOG.info(
+            f"Processed {granules_count} granules from {len(file_paths)} csv files"
+        )
+        if journal is not None:
+            journal.close()
+            LOG.info(f"Skipped {journal.skipped} stages completed by a previous run")
+        METRICS.log_table()
+        if metrics_json:
+            METRICS.write_json(metrics_json)
+        if prometheus_textfile:
+            METRICS.write_prometheus(prometheus_textfile, {"shard": f"{shard_index}"})
 
     # Raise exception if there was any error during sync process
     if error_list:
         raise S3SyncException("\n".join(error_list))
 
 
+def _measured_process_granule(*args, **kwargs):
+    """
+    Process a granule, timing it as a whole
+    """
+    with METRICS.measure("granule"):
+        return process_granule(*args, **kwargs)
+
+
+def _granule_result(granule_row, get_result):
+    """
+    Collect the errors of a processed granule, so one bad granule
+    doesn't stop the rest of the run
+
+    :param granule_row: Row from the csv file the result belongs to
+    :param get_result: Callable returning the granule's list of errors
+    :return: List of errors
+    """
+    try:
+        return get_result()
+    except Exception as exp:  # pylint: disable=broad-except
+        LOG.exception(f"Failed to process granule {granule_row} - {exp}")
+        return [f"Failed to process granule {granule_row} - {exp}"]
+
+
 class S3SyncException(Exception):
     """
     Exception to raise for failure to sync with AWS S3
@@ -570,7 +2419,14 @@ class S3SyncException(Exception):
 
 
 @click.command()
-@click.option("--filepath", "-f", type=str, required=True)
+@click.option(
+    "--filepath",
+    "-f",
+    type=str,
+    required=True,
+    multiple=True,
+    help="csv file of scenes to sync, repeat to sync several products at once.",
+)
 @click.option("--ncidir", "-n", type=str, required=True)
 @click.option("--s3path", "-p", type=str, required=True)
 @click.option("--s3bucket", "-b", type=str, required=True)
@@ -578,6 +2434,52 @@ class S3SyncException(Exception):
 @click.option("--explorerbaseurl", "-e", type=str, default="")
 @click.option("--snstopic", "-t", type=str, required=True)
 @click.option("--force-update", is_flag=True)
+@click.option("--workers", "-w", type=click.IntRange(min=1), default=1)
+@click.option(
+    "--existence-index",
+    type=click.Choice(["head", "list", "inventory"]),
+    default="head",
+    help="Check granules in S3 with a head request each, by listing the "
+    "affected path/rows up front, or from an S3 Inventory report.",
+)
+@click.option("--inventory-manifest", type=str, default=None)
+@click.option(
+    "--journal",
+    type=str,
+    default=None,
+    help="Journal file of completed stages, rerunning with the same journal "
+    "resumes where the previous run stopped.",
+)
+@click.option(
+    "--shard-index",
+    type=click.IntRange(min=0),
+    default=0,
+    help="Shard of the csv files to process, from 0 to --shard-count - 1.",
+)
+@click.option(
+    "--shard-count",
+    type=click.IntRange(min=1),
+    default=1,
+    help="Number of processes sharing the csv files.",
+)
+@click.option(
+    "--metadata-readers",
+    type=click.IntRange(min=1),
+    default=4,
+    help="Number of metadata files read ahead from NCI at the same time.",
+)
+@click.option(
+    "--metrics-json",
+    type=str,
+    default=None,
+    help="Write the per-stage timing and throughput summary to this JSON file.",
+)
+@click.option(
+    "--prometheus-textfile",
+    type=str,
+    default=None,
+    help="Write the per-stage summary to this Prometheus textfile.",
+)
 def main(
         filepath,
         ncidir,
@@ -587,11 +2489,21 @@ def main(
         explorerbaseurl,
         snstopic,
         force_update,
+        workers,
+        existence_index,
+        inventory_manifest,
+        journal,
+        shard_index,
+        shard_count,
+        metadata_readers,
+        metrics_json,
+        prometheus_textfile,
 ):
     """
     Script to sync Collection 3 data from NCI to AWS S3 bucket
 
-    :param filepath: Path of the file containing list of scenes path extracted from Database
+    :param filepath: Paths of the files containing list of scenes path extracted from
+    Database, one per product
     :param ncidir: Source directory for the files in NCI
     :param s3path: Root folder of the S3 bucket
     :param s3bucket: Name of the S3 bucket
@@ -600,15 +2512,33 @@ def main(
     :param snstopic: ARN of the SNS topic
     :param force_update: If this flag is set then do a fresh sync of data and
     replace the metadata
+    :param workers: Number of granules to process concurrently
+    :param existence_index: How to check if granules are already in S3
+    :param inventory_manifest: Path or s3:// URL of the S3 Inventory manifest.json
+    :param journal: Path of the journal file of completed stages
+    :param shard_index: Shard of the granules to process
+    :param shard_count: Number of shards the granules are split into
+    :param metadata_readers: Number of metadata files read ahead from NCI
+    :param metrics_json: Path of the JSON file for the stage metrics
+    :param prometheus_textfile: Path of the Prometheus textfile for the stage metrics
     """
+    if existence_index == "inventory" and not inventory_manifest:
+        raise click.BadParameter(
+            "--inventory-manifest is required with --existence-index inventory"
+        )
+    if shard_index >= shard_count:
+        raise click.BadParameter("--shard-index must be less than --shard-count")
     LOG.info(
-        f"Syncing granules listed in file {filepath} "
+        f"Syncing granules listed in files {', '.join(filepath)} "
         f"from NCI dir {ncidir} "
         f"into the {s3bucket}/{s3path} and "
         f"S3 base URL is {s3baseurl} and "
         f"explorerbaseurl is {explorerbaseurl} and "
         f"snstopic is {snstopic} and "
-        f"update is {force_update}"
+        f"update is {force_update} and "
+        f"workers is {workers} and "
+        f"existence index is {existence_index} and "
+        f"shard is {shard_index + 1} of {shard_count}"
     )
     sync_granules(
         filepath,
@@ -619,6 +2549,15 @@ def main(
         explorerbaseurl,
         snstopic,
         force_update,
+        workers,
+        existence_index,
+        inventory_manifest,
+        journal,
+        shard_index,
+        shard_count,
+        metadata_readers,
+        metrics_json,
+        prometheus_textfile,
     )
 
 
@@ -1,29 +1,742 @@
 #!/usr/bin/env python
+"""
+Compare two lists of lines, e.g. S3 keys or URLs, printing the lines of the first
+list missing from the second
 
+    compare-lists.py A B > missing.txt
+
+With --output-dir, A - B, B - A and A ∩ B are all written there instead. The
+default mode holds both lists in memory. --mode external sorts each list into
+temporary files no bigger than --memory-limit and merge joins them, so lists of
+hundreds of millions of lines can be compared on the data mover. --mode hashed
+(needs numpy) compares fingerprints of the lines instead, 8 or 16 bytes a line,
+then re-reads the lists for the lines to write, in the order they're listed.
+--mode partitioned splits both lists into --partitions files by a hash of each
+line, compares each pair of partitions in memory in one of --processes
+processes, and merges their sorted results.
+
+Either list can be an S3 Inventory report instead, given as the local or s3://
+path of its manifest.json. The s3:// URLs of the objects it lists are read
+straight from the CSV, ORC or Parquet inventory files (ORC and Parquet need
+pyarrow), filtered by --prefix and --suffix.
+"""
+import csv
+import gzip
+import hashlib
+import heapq
+import io
+import itertools
+import json
 import os
+import resource
 import sys
+import tempfile
+import zlib
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from urllib.parse import unquote_plus, urlparse
 
+import boto3
+import click
 import humanize
 import psutil
 
 process = psutil.Process(os.getpid())
-file1 = sys.argv[1]
-file2 = sys.argv[2]
 
-print(f"Computing {file1} - {file2}", file=sys.stderr)
+# Filters and concurrency of S3 Inventory inputs, set from the command line
+INVENTORY_PREFIX = ""
+INVENTORY_SUFFIX = ""
+INVENTORY_WORKERS = 8
+
+S3 = None
+
+# Sorted runs merged at the same time, kept below the limit of open files
+MAX_MERGE_FAN_IN = 256
+
+# Open files left for the interpreter, the inputs and the outputs when the
+# partitions or sorted runs are opened together
+OPEN_FILES_MARGIN = 32
+
+# Lines fingerprinted at once when re-reading the lists in --mode hashed
+HASH_CHUNK_SIZE = 100_000
+
+# Files written in --output-dir
+OUTPUT_FILES = {
+    "a_only": "a_minus_b.txt",
+    "b_only": "b_minus_a.txt",
+    "both": "a_and_b.txt",
+}
+
+SIDE_LABELS = {
+    "a_only": "A - B",
+    "b_only": "B - A",
+    "both": "A ∩ B",
+}
+
+
+def report_ram(message=""):
+    print(
+        f"Current RAM: {humanize.naturalsize(process.memory_info().rss)}"
+        f"{' ' + message if message else ''}",
+        file=sys.stderr,
+    )
+
+
+def report_peak_ram(workers=False):
+    # ru_maxrss is in KiB on Linux
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    print(f"Peak RAM: {humanize.naturalsize(peak)}", file=sys.stderr)
+    if workers:
+        children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * 1024
+        print(
+            f"Peak RAM of a worker process: {humanize.naturalsize(children)}",
+            file=sys.stderr,
+        )
+
+
+def open_files_limit():
+    """
+    Number of partitions or sorted runs that can be open at once, under the soft
+    limit of open files of the process
+    """
+    soft_limit, _ = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft_limit == resource.RLIM_INFINITY:
+        return sys.maxsize
+    return max(soft_limit - OPEN_FILES_MARGIN, 2)
+
+
+def read_lines(path):
+    """
+    Stream the stripped lines of a file, or the URLs listed in an S3 Inventory
+    """
+    if is_inventory(path):
+        yield from read_inventory(path)
+        return
+    with open(path) as fin:
+        for line in fin:
+            yield line.strip()
+
+
+def is_inventory(path):
+    return path.endswith("manifest.json")
+
+
+def get_s3_client():
+    global S3
+    if S3 is None:
+        S3 = boto3.client("s3")
+    return S3
+
+
+def read_inventory(manifest_path):
+    """
+    Stream the s3:// URLs of the objects listed in an S3 Inventory report,
+    downloading and parsing its inventory files in worker processes, as parsing
+    them is CPU bound
+
+    A local manifest.json is expected in a copy of the inventory destination,
+    with the inventory files in the data folder next to its date folder.
+
+    :param manifest_path: Local path or s3:// URL of the inventory manifest.json
+    :return: Iterator of s3:// URLs
+    """
+    url = urlparse(manifest_path)
+    if url.scheme == "s3":
+        manifest = json.load(
+            get_s3_client().get_object(Bucket=url.netloc, Key=url.path.lstrip("/"))[
+                "Body"
+            ]
+        )
+    else:
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+
+    if manifest["fileFormat"] not in INVENTORY_READERS:
+        raise click.ClickException(
+            f"Unsupported S3 Inventory format {manifest['fileFormat']}"
+        )
+    # Without the list of files, which go to the workers one at a time
+    file_manifest = {key: value for key, value in manifest.items() if key != "files"}
+
+    # Only a few inventory files are held in memory ahead of the diff
+    with ProcessPoolExecutor(
+        max_workers=INVENTORY_WORKERS,
+        initializer=init_inventory_worker,
+        initargs=(INVENTORY_PREFIX, INVENTORY_SUFFIX),
+    ) as executor:
+        pending = deque()
+        for inventory_file in manifest["files"]:
+            pending.append(
+                executor.submit(
+                    read_inventory_file, manifest_path, file_manifest, inventory_file
+                )
+            )
+            if len(pending) > INVENTORY_WORKERS:
+                yield from pending.popleft().result()
+        while pending:
+            yield from pending.popleft().result()
+    print(
+        f"Read {len(manifest['files'])} S3 Inventory files of {manifest_path}",
+        file=sys.stderr,
+    )
+
+
+def init_inventory_worker(prefix, suffix):
+    global INVENTORY_PREFIX, INVENTORY_SUFFIX, S3
+    INVENTORY_PREFIX, INVENTORY_SUFFIX = prefix, suffix
+    # A client inherited from the parent process can't share its connections
+    S3 = None
+
+
+def read_inventory_file(manifest_path, manifest, inventory_file):
+    """
+    Download and parse one inventory file, in a worker process
+
+    :param manifest_path: Local path or s3:// URL of the inventory manifest.json
+    :param manifest: The manifest, without its list of files
+    :param inventory_file: Entry of the inventory file in the manifest
+    :return: List of the s3:// URLs of the objects it lists, filtered by prefix
+    and suffix
+    """
+    if urlparse(manifest_path).scheme == "s3":
+        inventory_bucket = manifest["destinationBucket"].split(":::")[-1]
+        body = (
+            get_s3_client()
+            .get_object(Bucket=inventory_bucket, Key=inventory_file["key"])["Body"]
+            .read()
+        )
+    else:
+        data_path = "/".join(inventory_file["key"].split("/")[-2:])
+        body = (Path(manifest_path).parent.parent / data_path).read_bytes()
+    read_rows = INVENTORY_READERS[manifest["fileFormat"]]
+    return [
+        f"s3://{bucket}/{key}"
+        for bucket, key in read_rows(body, manifest)
+        if key.startswith(INVENTORY_PREFIX) and key.endswith(INVENTORY_SUFFIX)
+    ]
+
+
+def read_csv_inventory(body, manifest):
+    columns = [column.strip() for column in manifest["fileSchema"].split(",")]
+    bucket_column, key_column = columns.index("Bucket"), columns.index("Key")
+    with gzip.open(io.BytesIO(body), "rt", newline="") as f:
+        for row in csv.reader(f):
+            yield row[bucket_column], unquote_plus(row[key_column])
+
+
+def read_orc_inventory(body, manifest):
+    from pyarrow import orc
+
+    return read_arrow_inventory(
+        orc.read_table(io.BytesIO(body), columns=["bucket", "key"])
+    )
+
+
+def read_parquet_inventory(body, manifest):
+    from pyarrow import parquet
+
+    return read_arrow_inventory(
+        parquet.read_table(io.BytesIO(body), columns=["bucket", "key"])
+    )
+
+
+def read_arrow_inventory(table):
+    return zip(table.column("bucket").to_pylist(), table.column("key").to_pylist())
+
+
+INVENTORY_READERS = {
+    "CSV": read_csv_inventory,
+    "ORC": read_orc_inventory,
+    "Parquet": read_parquet_inventory,
+}
+
+
+def diff_in_memory(file1, file2, sides):
+    """
+    Compare two lists by loading them into sets
+
+    :param sides: Which of a_only, b_only and both to produce
+    :return: Iterator of (side, line), sorted within each side
+    """
+    set1 = set(read_lines(file1))
+    set2 = set(read_lines(file2))
+
+    print(f"len(set1) = {len(set1)}, len(set2) = {len(set2)}", file=sys.stderr)
+    report_ram()
+
+    for side in sides:
+        for line in sorted(compare_sets(set1, set2, side)):
+            yield side, line
+
+
+def compare_sets(set1, set2, side):
+    if side == "a_only":
+        return set1 - set2
+    if side == "b_only":
+        return set2 - set1
+    return set1 & set2
+
+
+def sorted_runs(lines, memory_limit, temp_dir):
+    """
+    Split lines into sorted, de-duplicated temporary files, each sorted in memory
+    under the memory limit
+
+    :param lines: Iterable of lines
+    :param memory_limit: Bytes of lines held in memory at once
+    :param temp_dir: Directory for the temporary files
+    :return: List of paths of the sorted runs
+    """
+    runs = []
+    run, run_size = set(), 0
+    for line in lines:
+        if line not in run:
+            run.add(line)
+            # The string, plus its slot in the set
+            run_size += sys.getsizeof(line) + 32
+        if run_size >= memory_limit:
+            runs.append(write_run(sorted(run), temp_dir))
+            report_ram(f"after sorting run {len(runs)}")
+            run, run_size = set(), 0
+    if run or not runs:
+        runs.append(write_run(sorted(run), temp_dir))
+    return runs
+
+
+def write_run(lines, temp_dir):
+    fd, path = tempfile.mkstemp(suffix=".run", dir=temp_dir)
+    with os.fdopen(fd, "w") as fout:
+        fout.writelines(f"{line}\n" for line in lines)
+    return path
+
+
+def read_run(path):
+    with open(path) as fin:
+        for line in fin:
+            yield line[:-1]
+
+
+def merge_runs(runs, temp_dir):
+    """
+    Merge sorted runs into a single sorted, de-duplicated stream, merging them
+    in rounds when there are too many to open at once
+
+    :param runs: List of paths of sorted runs, removed once merged
+    :param temp_dir: Directory for the intermediate runs
+    :return: Iterator of lines
+    """
+    # --mode external merges the runs of both lists at the same time
+    fan_in = max(min(MAX_MERGE_FAN_IN, open_files_limit() // 2), 2)
+    while len(runs) > fan_in:
+        merged = []
+        for start in range(0, len(runs), fan_in):
+            group = runs[start : start + fan_in]
+            merged.append(write_run(_merge(group), temp_dir))
+            for path in group:
+                os.remove(path)
+        runs = merged
+    return _merge(runs, remove=True)
+
+
+def _merge(runs, remove=False):
+    try:
+        merged = heapq.merge(*(read_run(path) for path in runs))
+        for line, _ in itertools.groupby(merged):
+            yield line
+    finally:
+        if remove:
+            for path in runs:
+                os.remove(path)
+
+
+def merge_join(lines1, lines2):
+    """
+    Walk two sorted, de-duplicated streams together
+
+    :return: Iterator of (side, line), side is a_only, b_only or both
+    """
+    missing = object()
+    line1, line2 = next(lines1, missing), next(lines2, missing)
+    while line1 is not missing and line2 is not missing:
+        if line1 == line2:
+            yield "both", line1
+            line1, line2 = next(lines1, missing), next(lines2, missing)
+        elif line1 < line2:
+            yield "a_only", line1
+            line1 = next(lines1, missing)
+        else:
+            yield "b_only", line2
+            line2 = next(lines2, missing)
+    while line1 is not missing:
+        yield "a_only", line1
+        line1 = next(lines1, missing)
+    while line2 is not missing:
+        yield "b_only", line2
+        line2 = next(lines2, missing)
+
+
+def diff_external(file1, file2, sides, memory_limit, temp_dir=None):
+    """
+    Compare two lists by sorting them into temporary files and merge joining them
+
+    :param sides: Which of a_only, b_only and both to produce
+    :return: Iterator of (side, line) in sorted order
+    """
+    with tempfile.TemporaryDirectory(prefix="compare-lists-", dir=temp_dir) as run_dir:
+        runs1 = sorted_runs(read_lines(file1), memory_limit, run_dir)
+        runs2 = sorted_runs(read_lines(file2), memory_limit, run_dir)
+        print(
+            f"Sorted {file1} into {len(runs1)} runs and {file2} into {len(runs2)} runs",
+            file=sys.stderr,
+        )
+        for side, line in merge_join(
+            merge_runs(runs1, run_dir), merge_runs(runs2, run_dir)
+        ):
+            if side in sides:
+                yield side, line
+
+
+def fingerprint(line, bits):
+    return hashlib.blake2b(line.encode(), digest_size=bits // 8).digest()
+
+
+def fingerprint_dtype(bits):
+    """
+    numpy dtype of the fingerprints, 64 bit ones are compared as integers, which
+    is faster than as bytes
+    """
+    import numpy as np
+
+    return np.dtype(np.uint64) if bits == 64 else np.dtype(f"S{bits // 8}")
+
+
+def read_fingerprints(path, bits):
+    """
+    Fingerprint every line of a file
+
+    :return: Sorted numpy array of the unique fingerprints
+    """
+    import numpy as np
+
+    digests = bytearray()
+    for line in read_lines(path):
+        digests += fingerprint(line, bits)
+    # Sorted in place, np.unique would sort a copy
+    fingerprints = np.frombuffer(digests, dtype=fingerprint_dtype(bits))
+    fingerprints.sort()
+    first = np.ones(len(fingerprints), dtype=bool)
+    np.not_equal(fingerprints[1:], fingerprints[:-1], out=first[1:])
+    return fingerprints[first]
+
+
+def find_sorted(values, sorted_values):
+    """
+    Binary search a sorted, non-empty array of unique fingerprints
+
+    :return: Index of each value in sorted_values, and whether it is there
+    """
+    import numpy as np
+
+    index = np.minimum(np.searchsorted(sorted_values, values), len(sorted_values) - 1)
+    return index, sorted_values[index] == values
+
+
+def in_sorted(values, sorted_values):
+    """
+    Check which fingerprints are in a sorted array of unique fingerprints, a chunk
+    at a time, instead of np.isin concatenating and sorting both arrays
+
+    :return: numpy array of bool
+    """
+    import numpy as np
+
+    found = np.zeros(len(values), dtype=bool)
+    if len(sorted_values):
+        for start in range(0, len(values), HASH_CHUNK_SIZE):
+            chunk = slice(start, start + HASH_CHUNK_SIZE)
+            _, found[chunk] = find_sorted(values[chunk], sorted_values)
+    return found
+
+
+def lines_with_fingerprints(path, fingerprints, bits):
+    """
+    Re-read a file for the first line with each of the fingerprints
+
+    :param fingerprints: Sorted numpy array of fingerprints
+    :return: Iterator of lines, in the order of the file
+    """
+    import numpy as np
+
+    if not len(fingerprints):
+        return
+    written = np.zeros(len(fingerprints), dtype=bool)
+    lines = read_lines(path)
+    while chunk := list(itertools.islice(lines, HASH_CHUNK_SIZE)):
+        digests = np.frombuffer(
+            b"".join(fingerprint(line, bits) for line in chunk),
+            dtype=fingerprints.dtype,
+        )
+        index, found = find_sorted(digests, fingerprints)
+        for i in np.flatnonzero(found):
+            if not written[index[i]]:
+                written[index[i]] = True
+                yield chunk[i]
+
+
+def diff_hashed(file1, file2, sides, bits):
+    """
+    Compare two lists by fingerprints of their lines, held in numpy arrays
+
+    Two different lines with the same fingerprint are taken to be the same line,
+    about a 1 in 10^22 chance for 100M lines of 128 bit fingerprints, or 1 in
+    3000 with 64 bits.
+
+    :param sides: Which of a_only, b_only and both to produce
+    :param bits: Size of the fingerprints, 64 or 128
+    :return: Iterator of (side, line), in file order within each side
+    """
+    fingerprints1 = read_fingerprints(file1, bits)
+    fingerprints2 = read_fingerprints(file2, bits)
+
+    print(
+        f"len(fingerprints1) = {len(fingerprints1)}, "
+        f"len(fingerprints2) = {len(fingerprints2)}",
+        file=sys.stderr,
+    )
+    report_ram()
+
+    for side in sides:
+        if side == "a_only":
+            path = file1
+            wanted = fingerprints1[~in_sorted(fingerprints1, fingerprints2)]
+        elif side == "b_only":
+            path = file2
+            wanted = fingerprints2[~in_sorted(fingerprints2, fingerprints1)]
+        else:
+            path = file1
+            wanted = fingerprints1[in_sorted(fingerprints1, fingerprints2)]
+        print(f"{SIDE_LABELS[side]}: {len(wanted)} fingerprints", file=sys.stderr)
+        for line in lines_with_fingerprints(path, wanted, bits):
+            yield side, line
+
+
+def partition_lines(path, name, partitions, partition_dir):
+    """
+    Split the lines of a file into partitions by a hash of each line, so equal
+    lines of both lists land in partitions with the same number
+
+    :return: List of paths of the partitions
+    """
+    paths = [
+        os.path.join(partition_dir, f"{name}-{number}.txt")
+        for number in range(partitions)
+    ]
+    outputs = [open(path, "w") for path in paths]
+    try:
+        for line in read_lines(path):
+            outputs[zlib.crc32(line.encode()) % partitions].write(f"{line}\n")
+    finally:
+        for output in outputs:
+            output.close()
+    return paths
+
+
+def diff_partition(path1, path2, sides, partition_dir):
+    """
+    Compare a pair of partitions in memory, in a worker process
+
+    :return: Dict of side to the path of its sorted lines
+    """
+    set1 = set(read_run(path1))
+    set2 = set(read_run(path2))
+    os.remove(path1)
+    os.remove(path2)
+    return {
+        side: write_run(sorted(compare_sets(set1, set2, side)), partition_dir)
+        for side in sides
+    }
+
+
+def diff_partitioned(file1, file2, sides, partitions, processes, temp_dir=None):
+    """
+    Compare two lists by splitting them into partitions compared in parallel
+
+    :param sides: Which of a_only, b_only and both to produce
+    :param partitions: Number of partitions to split each list into, no more than
+    can be open at once
+    :param processes: Number of partitions compared at once
+    :return: Iterator of (side, line) in sorted order
+    """
+    if partitions > open_files_limit():
+        partitions = open_files_limit()
+        print(
+            f"Only splitting into {partitions} partitions, the limit of open files",
+            file=sys.stderr,
+        )
+    with tempfile.TemporaryDirectory(
+        prefix="compare-lists-", dir=temp_dir
+    ) as partition_dir:
+        partitions1 = partition_lines(file1, "a", partitions, partition_dir)
+        partitions2 = partition_lines(file2, "b", partitions, partition_dir)
+        print(
+            f"Split {file1} and {file2} into {partitions} partitions", file=sys.stderr
+        )
+        report_ram()
+
+        with ProcessPoolExecutor(max_workers=processes) as executor:
+            results = list(
+                executor.map(
+                    diff_partition,
+                    partitions1,
+                    partitions2,
+                    [sides] * partitions,
+                    [partition_dir] * partitions,
+                )
+            )
+
+        # Equal lines share a partition, so the merged lines are still unique
+        for side in sides:
+            for line in merge_runs([result[side] for result in results], partition_dir):
+                yield side, line
+
+
+@click.command()
+@click.argument("file1")
+@click.argument("file2")
+@click.option(
+    "--mode",
+    type=click.Choice(["memory", "external", "hashed", "partitioned"]),
+    default="memory",
+    help="Hold both lists in memory, sort them through temporary files, "
+    "hold fingerprints of their lines in memory, or compare partitions of them "
+    "in parallel.",
+)
+@click.option(
+    "--memory-limit",
+    type=click.IntRange(min=1),
+    default=512,
+    help="MiB of lines sorted in memory at once by --mode external.",
+)
+@click.option(
+    "--temp-dir",
+    type=click.Path(file_okay=False),
+    default=None,
+    help="Directory for the sorted runs of --mode external and the partitions "
+    "of --mode partitioned.",
+)
+@click.option(
+    "--fingerprint-bits",
+    type=click.Choice(["64", "128"]),
+    default="128",
+    help="Size of the line fingerprints of --mode hashed.",
+)
+@click.option(
+    "--partitions",
+    type=click.IntRange(min=1),
+    default=256,
+    help="Number of partitions of --mode partitioned.",
+)
+@click.option(
+    "--processes",
+    type=click.IntRange(min=1),
+    default=os.cpu_count(),
+    help="Number of partitions compared at once by --mode partitioned.",
+)
+@click.option(
+    "--prefix",
+    default="",
+    help="Only read the keys of S3 Inventory inputs starting with this.",
+)
+@click.option(
+    "--suffix",
+    default="",
+    help="Only read the keys of S3 Inventory inputs ending with this, "
+    "e.g. .odc-metadata.yaml.",
+)
+@click.option(
+    "--inventory-workers",
+    type=click.IntRange(min=1),
+    default=INVENTORY_WORKERS,
+    help="Number of S3 Inventory files downloaded and parsed at once, each in a "
+    "process of its own.",
+)
+@click.option(
+    "--output-dir",
+    type=click.Path(file_okay=False),
+    default=None,
+    help=f"Write {', '.join(OUTPUT_FILES.values())} here instead of printing "
+    "the lines of FILE1 missing from FILE2. Each is sorted, except with --mode "
+    "hashed, which writes the lines in the order of the list they are read from.",
+)
+def main(
+    file1,
+    file2,
+    mode,
+    memory_limit,
+    temp_dir,
+    fingerprint_bits,
+    partitions,
+    processes,
+    prefix,
+    suffix,
+    inventory_workers,
+    output_dir,
+):
+    """
+    Print the lines of FILE1 that aren't in FILE2, sorted, or in the order of
+    FILE1 with --mode hashed
+
+    FILE1 and FILE2 are text files, or S3 Inventory manifest.json files
+    """
+    global INVENTORY_PREFIX, INVENTORY_SUFFIX, INVENTORY_WORKERS
+    INVENTORY_PREFIX, INVENTORY_SUFFIX = prefix, suffix
+    INVENTORY_WORKERS = inventory_workers
+
+    for path in (file1, file2):
+        if is_inventory(path) and urlparse(path).scheme == "s3":
+            continue
+        if not os.path.isfile(path):
+            raise click.BadParameter(f"File {path} does not exist")
+
+    print(f"Computing {file1} - {file2}", file=sys.stderr)
 
-with open(sys.argv[1]) as fin:
-    set1 = set(l.strip() for l in fin.readlines())
+    sides = list(OUTPUT_FILES) if output_dir else ["a_only"]
+    if mode == "memory":
+        lines = diff_in_memory(file1, file2, sides)
+    elif mode == "external":
+        lines = diff_external(file1, file2, sides, memory_limit * 2 ** 20, temp_dir)
+    elif mode == "hashed":
+        lines = diff_hashed(file1, file2, sides, int(fingerprint_bits))
+    else:
+        lines = diff_partitioned(file1, file2, sides, partitions, processes, temp_dir)
 
-with open(sys.argv[2]) as fin:
-    set2 = set(l.strip() for l in fin.readlines())
+    counts = dict.fromkeys(sides, 0)
+    if output_dir:
+        Path(output_dir).mkdir(parents=True, exist_ok=True)
+        outputs = {
+            side: open(Path(output_dir) / name, "w")
+            for side, name in OUTPUT_FILES.items()
+        }
+        try:
+            for side, line in lines:
+                counts[side] += 1
+                outputs[side].write(f"{line}\n")
+        finally:
+            for output in outputs.values():
+                output.close()
+    else:
+        for side, line in lines:
+            counts[side] += 1
+            print(line)
 
-print(f"len(set1) = {len(set1)}, len(set2) = {len(set2)}", file=sys.stderr)
+    print(
+        ", ".join(f"{SIDE_LABELS[side]}: {count}" for side, count in counts.items()),
+        file=sys.stderr,
+    )
+    report_ram()
+    report_peak_ram(workers=mode == "partitioned")
 
-# or
-# import resource
-# resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
-print(f"Current RAM: {humanize.naturalsize(process.memory_info().rss)}", file=sys.stderr)
 
-for l in sorted(set1 - set2):
-    print(l)
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,23 @@
 #!/usr/bin/env python
+"""
+Print the S3 URLs of the Sentinel-2 ARD metadata of the indexed datasets, to
+compare with a listing of the bucket using compare-lists.py
 
-from datetime import date
+By default the URLs are built from a single streaming query per product, only
+reading the fields they need. --find-datasets loads every dataset through the
+datacube API a month at a time instead.
 
-from datacube import Datacube
+With --watermark, only the URLs of the datasets added since the last successful
+run are printed, and those archived since then are written to --archived-output.
+The first run prints every URL and records the watermark. A dataset added and
+archived between two runs is only written to --archived-output.
+"""
+import json
+import os
+from datetime import date, datetime
 
-dc = Datacube()
+import click
+from datacube import Datacube
 
 
 # s3://dea-public-data/L2/sentinel-2-nbar/S2MSIARD_NBAR/2020-10-19/S2B_OPER_MSI_ARD_TL_VGS1_20201019T060322_A018905_T50LNP_N02.09/ARD-METADATA.yaml
@@ -12,16 +25,222 @@ dc = Datacube()
 #  's2a_ard_granule',
 #  's2b_ard_granule',
 #
+PRODUCTS = ('s2a_ard_granule', 's2b_ard_granule')
+
+# Rows fetched from the server-side cursor at a time
+ITERSIZE = 100_000
+
+# Default seconds the watermark stays behind the database clock. Datasets are
+# stamped with the start time of the transaction adding or archiving them, so
+# those in transactions still running when it is read are only picked up by the
+# next run if no transaction runs longer than this.
+WATERMARK_LAG = 15 * 60
+
+DATASET_FIELDS_QUERY = """
+SELECT dataset.metadata #>> '{{extent,center_dt}}' AS center_dt,
+       dataset.metadata ->> 'tile_id' AS tile_id
+FROM agdc.dataset
+JOIN agdc.dataset_type ON dataset.dataset_type_ref = dataset_type.id
+WHERE dataset_type.name = %(product)s
+  AND {condition}
+"""
+
+ACTIVE_CONDITION = "dataset.archived IS NULL"
+
+
+def s3_url(center_dt, tile_id):
+    # Don't trust the datetimes that are exposed!
+    return f"s3://dea-public-data/L2/sentinel-2-nbar/S2MSIARD_NBAR/{center_dt[:10]}/{tile_id.replace('L1C', 'ARD')}/ARD-METADATA.yaml"
+
 
 def ds_to_s3_url(ds):
     # return f"s3://dea-public-data/L2/sentinel-2-nbar/S2MSIARD_NBAR/{ds.key_time.strftime('%Y-%m-%d')}/{ds.metadata_doc['tile_id'].replace('L1C', 'ARD')}/ARD-METADATA.yaml"
-    # Don't trust the datetimes that are exposed!
-    return f"s3://dea-public-data/L2/sentinel-2-nbar/S2MSIARD_NBAR/{ds.metadata_doc['extent']['center_dt'][:10]}/{ds.metadata_doc['tile_id'].replace('L1C', 'ARD')}/ARD-METADATA.yaml"
+    return s3_url(ds.metadata_doc['extent']['center_dt'], ds.metadata_doc['tile_id'])
 
 
-for product in ('s2a_ard_granule', 's2b_ard_granule'):
+def find_dataset_urls(dc, product):
     for year in range(2017, date.today().year + 1):
         for month in range(1, 13):
 
             for ds in dc.find_datasets(product=product, time=f'{year}-{month:02}'):
-                print(ds_to_s3_url(ds))
+                yield ds_to_s3_url(ds)
+
+
+def raw_connection(dc):
+    """
+    Borrow a psycopg2 connection from the pool of the datacube index
+    """
+    # The index API has no server-side cursors and loads whole metadata
+    # documents, so its private engine is used to stream only the fields in the
+    # URLs. It is only there with the postgres index driver.
+    return dc.index._db._engine.raw_connection()
+
+
+def query_dataset_urls(dc, product, condition=ACTIVE_CONDITION, **params):
+    """
+    Stream the URLs of the datasets of a product from a server-side cursor,
+    projecting only the metadata fields in the URL
+
+    :param condition: SQL condition on the datasets, active ones by default
+    :param params: Parameters of the condition
+    """
+    connection = raw_connection(dc)
+    # The index connects in autocommit mode, but named cursors need a transaction
+    connection.connection.autocommit = False
+    try:
+        with connection.cursor(name=f'{product}_s3_urls') as cursor:
+            cursor.itersize = ITERSIZE
+            cursor.execute(
+                DATASET_FIELDS_QUERY.format(condition=condition),
+                {'product': product, **params},
+            )
+            for center_dt, tile_id in cursor:
+                yield s3_url(center_dt, tile_id)
+    finally:
+        # Also when the generator is closed early or the query fails, as
+        # autocommit can't be turned back on inside the transaction
+        try:
+            connection.rollback()
+            connection.connection.autocommit = True
+        finally:
+            connection.close()
+
+
+def window_condition(column, since):
+    """
+    SQL condition on a timestamp column being after the previous watermark, if
+    any, and up to the new one
+    """
+    condition = f"{column} <= %(until)s"
+    if since is not None:
+        condition = f"{column} > %(since)s AND {condition}"
+    return condition
+
+
+def new_watermark(dc, lag=WATERMARK_LAG):
+    """
+    Database time the datasets are listed up to
+
+    :param lag: Seconds behind the database clock
+    """
+    connection = raw_connection(dc)
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT now() - %s * interval '1 second'", (lag,))
+            return cursor.fetchone()[0]
+    finally:
+        connection.close()
+
+
+def read_watermarks(path):
+    """
+    Read the watermark of each product, the time its datasets were last listed up
+    to, by both added and archived time
+    """
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return {
+            product: datetime.fromisoformat(watermark)
+            for product, watermark in json.load(f).items()
+        }
+
+
+def write_watermarks(path, watermarks):
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(
+            {
+                product: watermark.isoformat()
+                for product, watermark in watermarks.items()
+            },
+            f,
+            indent=2,
+        )
+    os.replace(tmp_path, path)
+
+
+@click.command()
+@click.option(
+    '--product',
+    'products',
+    multiple=True,
+    default=PRODUCTS,
+    show_default=True,
+    help='Products to list, can be repeated.',
+)
+@click.option(
+    '--find-datasets',
+    is_flag=True,
+    default=False,
+    help='Load the datasets through the datacube API instead of one query per product.',
+)
+@click.option(
+    '--watermark',
+    type=click.Path(dir_okay=False),
+    default=None,
+    help='JSON file of the time each product was last listed up to. Only the '
+    'datasets added or archived since then are listed, and it is updated once '
+    'they have been.',
+)
+@click.option(
+    '--archived-output',
+    type=click.Path(dir_okay=False),
+    default=None,
+    help='File to write the URLs of the datasets archived since the watermark to. '
+    'A dataset both added and archived since then is only written here, not '
+    'printed as added.',
+)
+@click.option(
+    '--watermark-lag',
+    type=click.IntRange(min=0),
+    default=WATERMARK_LAG,
+    show_default=True,
+    help='Seconds the new watermark is behind the database clock. Datasets are '
+    'stamped when the transaction indexing or archiving them starts, so this must '
+    'be longer than any such transaction, or datasets committed after the '
+    'watermark is read are missed.',
+)
+def main(products, find_datasets, watermark, archived_output, watermark_lag):
+    if watermark and find_datasets:
+        raise click.UsageError('--watermark does not work with --find-datasets')
+    if bool(watermark) != bool(archived_output):
+        raise click.UsageError('--watermark and --archived-output go together')
+
+    dc = Datacube()
+
+    if not watermark:
+        dataset_urls = find_dataset_urls if find_datasets else query_dataset_urls
+        for product in products:
+            for url in dataset_urls(dc, product):
+                print(url)
+        return
+
+    watermarks = read_watermarks(watermark)
+    until = new_watermark(dc, watermark_lag)
+    with open(archived_output, 'w') as archived:
+        for product in products:
+            since = watermarks.get(product)
+            added_condition = (
+                f"{ACTIVE_CONDITION} AND {window_condition('dataset.added', since)}"
+            )
+            for url in query_dataset_urls(
+                dc, product, added_condition, since=since, until=until
+            ):
+                print(url)
+            # Datasets archived before the first run were never listed
+            if since is not None:
+                for url in query_dataset_urls(
+                    dc,
+                    product,
+                    window_condition('dataset.archived', since),
+                    since=since,
+                    until=until,
+                ):
+                    archived.write(f'{url}\n')
+            watermarks[product] = until
+    write_watermarks(watermark, watermarks)
+
+
+if __name__ == '__main__':
+    main()
@@ -3,16 +3,26 @@
 Script to sync Sentinel-2 data from NCI to AWS S3 bucket
 """
 
+import bisect
+import fnmatch
+import itertools
+import json
 import logging
+import mimetypes
+import multiprocessing
+import os
 import re
-import subprocess
 import sys
-from concurrent.futures import ThreadPoolExecutor
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from concurrent.futures._base import as_completed
+from datetime import datetime, timezone
 from pathlib import Path
+from threading import Event, Lock, Thread
 
 import click
 import yaml
+from boto3.s3.transfer import TransferConfig, create_transfer_manager
 from odc.aws import s3_dump, s3_client
 from odc.index import odc_uuid
 from tqdm import tqdm
@@ -21,7 +31,38 @@ NCI_DIR = '/g/data/if87/datacube/002/S2_MSI_ARD/packaged'
 S3_PATH = 'L2/sentinel-2-nbar/S2MSIARD_NBAR'
 S3_BUCKET = 'dea-public-data'
 
+# Left out of the data sync, like `aws s3 sync --exclude`. The metadata is uploaded
+# separately and NBART isn't published.
+SYNC_EXCLUDES = ['NBART/*', 'ARD-METADATA.yaml']
+
+# Most keys a single DeleteObjects request accepts
+DELETE_BATCH_SIZE = 1000
+
+# libyaml is an order of magnitude faster than the pure Python parser and emitter
+YAML_LOADER = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+YAML_DUMPER = getattr(yaml, 'CSafeDumper', yaml.SafeDumper)
+
+NBART_BANDS = ['blue', 'coastal_aerosol', 'contiguity', 'green', 'nir_1', 'nir_2', 'red',
+               'red_edge_1', 'red_edge_2', 'red_edge_3', 'swir_2', 'swir_3']
+
+# Keys removed from the NCI metadata, NBART isn't published
+METADATA_REMOVALS = [('image', 'bands', f'nbart_{band}') for band in NBART_BANDS] + [('lineage',)]
+
+# Keys set in the published metadata, in order, from the NCI metadata
+METADATA_OVERRIDES = [
+    (('creation_dt',), lambda doc: doc['extent']['center_dt']),  # FIXME: WTF
+    (('product_type',), lambda doc: 'S2MSIARD_NBAR'),
+    (('original_id',), lambda doc: doc['id']),
+    (('software_versions', 's2_to_s3_rolling'), lambda doc: {  # FIXME: Update
+        'repo': 'https://github.com/GeoscienceAustralia/dea-airflow/',
+        'version': '1.0.0'}),
+    # Create a deterministic dataset ID based on these inputs
+    (('id',), lambda doc: str(odc_uuid("s2_to_s3_rolling", "1.0.0", [doc['id']]))),
+]
+
 S3 = None
+TRANSFER_MANAGER = None
+MUNGE_POOL = None
 
 _LOG = logging.getLogger()
 
@@ -51,7 +92,22 @@ def setup_logging():
 @click.command()
 @click.argument('s3_urls', type=click.File('r'))
 @click.option('--workers', type=int, default=10)
-def main(s3_urls, workers):
+@click.option('--max-connections', type=int, default=20,
+              help='Files uploaded at the same time, across all the datasets.')
+@click.option('--max-bandwidth', type=int, default=None,
+              help='Bytes per second uploaded, across all the datasets.')
+@click.option('--ledger', type=click.Path(dir_okay=False), default='s3_uploads.ledger.jsonl',
+              help='Ledger of completed and failed uploads, datasets completed by a previous run are skipped.')
+@click.option('--only-failed', is_flag=True,
+              help='Only retry the datasets the ledger records as failed.')
+@click.option('--munge-processes', type=int, default=min(4, os.cpu_count() or 1),
+              help='Processes rewriting the metadata, 0 to do it in the upload threads.')
+@click.option('--metrics-interval', type=int, default=60,
+              help='Seconds between the throughput summaries in the log.')
+@click.option('--prometheus-textfile', type=click.Path(dir_okay=False), default=None,
+              help='Also write the throughput to this Prometheus textfile.')
+def main(s3_urls, workers, max_connections, max_bandwidth, ledger, only_failed, munge_processes,
+         metrics_interval, prometheus_textfile):
     """
     Script to sync Sentinel-2 data from NCI to AWS S3 bucket
 
@@ -59,26 +115,281 @@ def main(s3_urls, workers):
 
     """
     setup_logging()
+    ledger = UploadLedger(ledger)
+
+    global S3, TRANSFER_MANAGER, MUNGE_POOL
+    # Every worker and transfer thread may hold a connection at the same time
+    S3 = s3_client(max_pool_connections=workers + max_connections)
+    TRANSFER_MANAGER = create_transfer_manager(
+        S3, TransferConfig(max_concurrency=max_connections, max_bandwidth=max_bandwidth)
+    )
+    urls_to_upload = [url.strip() for url in s3_urls.readlines() if url.strip()]
+    total = len(urls_to_upload)
+    if only_failed:
+        urls_to_upload = [url for url in urls_to_upload if ledger.status(url) == UploadLedger.FAILED]
+    else:
+        urls_to_upload = [url for url in urls_to_upload if ledger.status(url) != UploadLedger.DONE]
+
+    _LOG.info(f"{len(urls_to_upload)} datasets to upload, "
+              f"skipping {total - len(urls_to_upload)} according to {ledger.path}.")
+    failed = 0
+    # Parsing and emitting yaml holds the GIL, so it gets processes of its own. They
+    # are spawned, forking while the upload threads hold locks can deadlock them.
+    MUNGE_POOL = ProcessPoolExecutor(
+        max_workers=munge_processes, mp_context=multiprocessing.get_context('spawn')
+    ) if munge_processes else None
+    METRICS.submitted(len(urls_to_upload))
+    reporter = MetricsReporter(METRICS, metrics_interval, prometheus_textfile)
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = {executor.submit(upload_dataset, s3_url): s3_url for s3_url in urls_to_upload}
+
+            for future in tqdm(as_completed(futures), total=len(urls_to_upload), unit='datasets', disable=None):
+                s3_url = futures[future]
+                try:
+                    future.result()
+                except Exception as e:  # pylint: disable=broad-except
+                    failed += 1
+                    _LOG.error(f"Failed uploading: {s3_url} - {e}")
+                    ledger.record(s3_url, UploadLedger.FAILED, str(e))
+                else:
+                    _LOG.info(f"Completed uploaded: {s3_url}")
+                    ledger.record(s3_url, UploadLedger.DONE)
+    finally:
+        reporter.close()
+        TRANSFER_MANAGER.shutdown()
+        if MUNGE_POOL is not None:
+            MUNGE_POOL.shutdown()
+        ledger.close()
+
+    if failed:
+        raise click.ClickException(f"{failed} of {len(urls_to_upload)} datasets failed, "
+                                   f"rerun with --only-failed to retry them.")
+
+
+class UploadLedger:
+    """
+    Append-only JSON lines record of each dataset's upload, the latest line for
+    an S3 url wins
+    """
+    DONE = 'done'
+    FAILED = 'failed'
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self._statuses = {}
+        self._lock = Lock()
+        if self.path.exists():
+            with self.path.open() as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # Last line of a run that was killed while writing it
+                        continue
+                    self._statuses[entry['url']] = entry['status']
+        self._file = self.path.open('a')
+        if self._file.tell() and not self.path.read_text().endswith('\n'):
+            self._file.write('\n')
+
+    def status(self, s3_url):
+        """
+        :return: DONE, FAILED or None if the dataset was never attempted
+        """
+        return self._statuses.get(s3_url)
+
+    def record(self, s3_url, status, error=None):
+        line = json.dumps({'url': s3_url, 'status': status, 'error': error,
+                           'time': datetime.now(timezone.utc).isoformat()})
+        with self._lock:
+            self._statuses[s3_url] = status
+            self._file.write(f"{line}\n")
+            self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+
+class UploadMetrics:
+    """
+    Throughput, latency and errors of the dataset uploads, safe to share between
+    the upload threads
+
+    Latencies are only kept in fixed histograms, so memory doesn't grow with the
+    number of datasets.
+    """
+    # Upper bounds in seconds of the histogram the percentiles are read from, ten
+    # buckets a decade from 10ms to about 3 hours, as in c3_to_s3_rolling.py
+    PERCENTILE_BUCKETS = tuple(10 ** (exponent / 10) for exponent in range(-20, 41))
+
+    # Upper bounds in seconds of the exported dataset latency histogram
+    LATENCY_BUCKETS = (1, 2, 5, 10, 30, 60, 120, 300, 600, float('inf'))
+
+    def __init__(self):
+        self._lock = Lock()
+        self._started_at = time.monotonic()
+        self._submitted = 0
+        self._in_flight = 0
+        self._completed = 0
+        self._failed = 0
+        self._bytes = 0
+        self._latency_sum = 0.0
+        self._latency_max = 0.0
+        # One more bucket for anything slower than the last bound
+        self._percentile_buckets = [0] * (len(self.PERCENTILE_BUCKETS) + 1)
+        self._latency_buckets = [0] * len(self.LATENCY_BUCKETS)
+
+    def submitted(self, count):
+        with self._lock:
+            if not self._submitted:
+                # Rates are over the upload, not the time spent getting ready for it
+                self._started_at = time.monotonic()
+            self._submitted += count
+
+    def started(self):
+        with self._lock:
+            self._in_flight += 1
+
+    def finished(self, seconds, nbytes, failed=False):
+        with self._lock:
+            self._in_flight -= 1
+            self._bytes += nbytes
+            self._latency_sum += seconds
+            self._latency_max = max(self._latency_max, seconds)
+            self._percentile_buckets[bisect.bisect_left(self.PERCENTILE_BUCKETS, seconds)] += 1
+            self._latency_buckets[bisect.bisect_left(self.LATENCY_BUCKETS, seconds)] += 1
+            if failed:
+                self._failed += 1
+            else:
+                self._completed += 1
+
+    def summary(self):
+        """
+        :return: Dict of the totals, rates and latency percentiles so far
+        """
+        with self._lock:
+            elapsed = max(time.monotonic() - self._started_at, 1e-9)
+            finished = self._completed + self._failed
+            return {
+                'elapsed': elapsed,
+                'submitted': self._submitted,
+                'completed': self._completed,
+                'failed': self._failed,
+                'in_flight': self._in_flight,
+                'queued': self._submitted - finished - self._in_flight,
+                'bytes': self._bytes,
+                'datasets_per_second': finished / elapsed,
+                'bytes_per_second': self._bytes / elapsed,
+                'latency_p50': self._percentile(finished, 50),
+                'latency_p95': self._percentile(finished, 95),
+                'latency_sum': self._latency_sum,
+                'latency_buckets': list(zip(self.LATENCY_BUCKETS,
+                                            itertools.accumulate(self._latency_buckets))),
+            }
+
+    def _percentile(self, count, percent):
+        """
+        Nearest-rank percentile, as the upper bound of the bucket it falls in, capped
+        at the slowest dataset
+        """
+        rank = max(1, -(-count * percent // 100))
+        seen = 0
+        for bound, bucket_count in zip(self.PERCENTILE_BUCKETS, self._percentile_buckets):
+            seen += bucket_count
+            if seen >= rank:
+                return min(bound, self._latency_max)
+        return self._latency_max
+
+    def log_line(self):
+        summary = self.summary()
+        return (f"{summary['completed'] + summary['failed']}/{summary['submitted']} datasets, "
+                f"{summary['failed']} failed, "
+                f"{summary['datasets_per_second']:.2f} datasets/s, "
+                f"{summary['bytes_per_second'] / 2 ** 20:.1f} MiB/s, "
+                f"{summary['in_flight']} in flight, {summary['queued']} queued, "
+                f"latency p50 {summary['latency_p50']:.1f}s p95 {summary['latency_p95']:.1f}s")
+
+    def write_prometheus(self, textfile_path):
+        """
+        Write the metrics in the Prometheus text format, replacing the file atomically
+        so the node exporter or a pushgateway never reads half of it
+        """
+        summary = self.summary()
+        lines = [
+            '# TYPE s2_upload_datasets_total counter',
+            f's2_upload_datasets_total{{status="completed"}} {summary["completed"]}',
+            f's2_upload_datasets_total{{status="failed"}} {summary["failed"]}',
+            '# TYPE s2_upload_bytes_total counter',
+            f's2_upload_bytes_total {summary["bytes"]}',
+            '# TYPE s2_upload_in_flight gauge',
+            f's2_upload_in_flight {summary["in_flight"]}',
+            '# TYPE s2_upload_queued gauge',
+            f's2_upload_queued {summary["queued"]}',
+            '# TYPE s2_upload_datasets_per_second gauge',
+            f's2_upload_datasets_per_second {summary["datasets_per_second"]}',
+            '# TYPE s2_upload_bytes_per_second gauge',
+            f's2_upload_bytes_per_second {summary["bytes_per_second"]}',
+            '# TYPE s2_upload_dataset_seconds histogram',
+        ]
+        for bound, count in summary['latency_buckets']:
+            le = '+Inf' if bound == float('inf') else bound
+            lines.append(f's2_upload_dataset_seconds_bucket{{le="{le}"}} {count}')
+        lines.append(f's2_upload_dataset_seconds_sum {summary["latency_sum"]}')
+        lines.append(f's2_upload_dataset_seconds_count {summary["completed"] + summary["failed"]}')
+
+        temp_path = f"{textfile_path}.{os.getpid()}.tmp"
+        with open(temp_path, 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+        os.replace(temp_path, textfile_path)
+
+
+class MetricsReporter:
+    """
+    Logs a summary of the metrics every interval from a background thread, and once
+    more when closed
+    """
 
-    global S3
-    S3 = s3_client()
-    urls_to_upload = [url.strip() for url in s3_urls.readlines()]
+    def __init__(self, metrics, interval, prometheus_textfile=None):
+        self.metrics = metrics
+        self.interval = interval
+        self.prometheus_textfile = prometheus_textfile
+        self._closed = Event()
+        self._thread = Thread(target=self._run, name='metrics-reporter', daemon=True)
+        self._thread.start()
 
-    _LOG.info(f"{len(urls_to_upload)} datasets to upload.")
-    with ThreadPoolExecutor(max_workers=workers) as executor:
-        futures = [executor.submit(upload_dataset, s3_url) for s3_url in urls_to_upload]
+    def report(self):
+        _LOG.info(f"Progress: {self.metrics.log_line()}")
+        if self.prometheus_textfile:
+            self.metrics.write_prometheus(self.prometheus_textfile)
 
-        for future in tqdm(as_completed(futures), total=len(urls_to_upload), unit='datasets', disable=None):
-            _LOG.info(f"Completed uploaded: {future.result()}")
+    def close(self):
+        self._closed.set()
+        self._thread.join()
+        self.report()
+
+    def _run(self):
+        while not self._closed.wait(self.interval):
+            self.report()
+
+
+METRICS = UploadMetrics()
 
 
 def upload_dataset(s3_url):
-    granule_id = s3_url_to_granule_id(s3_url)
+    METRICS.started()
+    start = time.monotonic()
+    nbytes = 0
+    try:
+        granule_id = s3_url_to_granule_id(s3_url)
 
-    upload_dataset_without_yaml(granule_id, S3_BUCKET)
+        nbytes += upload_dataset_without_yaml(granule_id, S3_BUCKET)
 
-    local_path = Path(NCI_DIR) / granule_id
-    upload_dataset_doc(local_path / 'ARD-METADATA.yaml', s3_url)
+        local_path = Path(NCI_DIR) / granule_id
+        nbytes += upload_dataset_doc(local_path / 'ARD-METADATA.yaml', s3_url)
+    except Exception:
+        METRICS.finished(time.monotonic() - start, nbytes, failed=True)
+        raise
+    METRICS.finished(time.monotonic() - start, nbytes)
     return s3_url
 
 
@@ -92,25 +403,86 @@ def s3_url_to_granule_id(s3_url):
 
 def upload_dataset_without_yaml(granule_id, _s3_bucket):
     """
-    Run AWS sync command to sync granules to S3 bucket
+    Sync granule files to S3 bucket, like `aws s3 sync --delete` but in process,
+    with the files uploaded in parallel by the shared transfer manager
     :param granule_id: name of the granule
     :param _s3_bucket: name of the s3 bucket
+    :return: number of bytes uploaded
     """
     local_path = Path(NCI_DIR) / granule_id
-    s3_path = f"s3://{_s3_bucket}/{S3_PATH}/{granule_id}"
+    s3_prefix = f"{S3_PATH}/{granule_id}/"
+    # A missing granule would otherwise be synced as empty, deleting it from S3
+    if not local_path.is_dir():
+        raise RuntimeError(f"Failed syncing {granule_id}: {local_path} is not a directory")
 
     # Remove any data that shouldn't be there and exclude the metadata and NBART
-    command = f"aws s3 sync {local_path} {s3_path} " \
-              "--only-show-errors " \
-              "--delete " \
-              "--exclude NBART/* " \
-              "--exclude ARD-METADATA.yaml"
+    remote_objects = {
+        obj['Key']: obj
+        for page in S3.get_paginator('list_objects_v2').paginate(Bucket=_s3_bucket, Prefix=s3_prefix)
+        for obj in page.get('Contents', [])
+        if not is_excluded(obj['Key'][len(s3_prefix):])
+    }
+
+    uploads = {}
+    local_files = 0
+    for local_file in sorted(local_path.rglob('*')):
+        relative_path = local_file.relative_to(local_path).as_posix()
+        if not local_file.is_file() or is_excluded(relative_path):
+            continue
+        local_files += 1
+        key = s3_prefix + relative_path
+        if needs_upload(local_file, remote_objects.pop(key, None)):
+            # Guess the Content-Type like aws s3 sync, so previews show in browsers
+            content_type, _ = mimetypes.guess_type(local_file.name)
+            uploads[key] = TRANSFER_MANAGER.upload(
+                str(local_file),
+                _s3_bucket,
+                key,
+                extra_args={'ContentType': content_type} if content_type else None,
+            )
+
+    errors = []
+    uploaded_bytes = 0
+    for key, upload in uploads.items():
+        try:
+            upload.result()
+            uploaded_bytes += upload.meta.size or 0
+        except Exception as e:  # pylint: disable=broad-except
+            errors.append(f"{key}: {e}")
 
-    try:
-        subprocess.run(command, shell=True, check=True, stdin=subprocess.PIPE, stderr=subprocess.PIPE)
-    except subprocess.CalledProcessError as e:
-        _LOG.info(f"Upload failed, stdout: {e.stdout}, stderr: {e.stderr}")
-        raise e
+    # rglob skips directories it can't read, so an unreadable granule lists as empty
+    if not local_files and remote_objects:
+        raise RuntimeError(f"Failed syncing {granule_id}: no files found in {local_path}, "
+                           f"not deleting its {len(remote_objects)} files from S3")
+
+    keys_to_delete = sorted(remote_objects)
+    for start in range(0, len(keys_to_delete), DELETE_BATCH_SIZE):
+        response = S3.delete_objects(Bucket=_s3_bucket, Delete={
+            'Objects': [{'Key': key} for key in keys_to_delete[start:start + DELETE_BATCH_SIZE]],
+            'Quiet': True,
+        })
+        errors.extend(f"{error['Key']}: {error['Message']}" for error in response.get('Errors', []))
+
+    if errors:
+        _LOG.info(f"Upload failed: {errors}")
+        raise RuntimeError(f"Failed syncing {granule_id}: " + "; ".join(errors))
+    return uploaded_bytes
+
+
+def is_excluded(relative_path):
+    return any(fnmatch.fnmatchcase(relative_path, pattern) for pattern in SYNC_EXCLUDES)
+
+
+def needs_upload(local_file, remote_object):
+    """
+    Upload when the size differs or the local file is newer, as `aws s3 sync` does
+    """
+    if remote_object is None:
+        return True
+    stat = local_file.stat()
+    return (stat.st_size != remote_object['Size']
+            # S3 keeps whole seconds
+            or datetime.fromtimestamp(int(stat.st_mtime), tz=timezone.utc) > remote_object['LastModified'])
 
 
 def upload_dataset_doc(src_yaml, s3_url):
@@ -118,43 +490,43 @@ def upload_dataset_doc(src_yaml, s3_url):
     Replace metadata with additional info
     :param src_yaml: metadata file in NCI
     :param s3_url: path to upload metadata to in s3
+    :return: number of bytes uploaded
     """
-    with open(src_yaml) as fin:
-        nci_dataset = yaml.safe_load(fin)
+    if MUNGE_POOL is not None:
+        metadata_yaml = MUNGE_POOL.submit(munge_metadata_file, str(src_yaml)).result()
+    else:
+        metadata_yaml = munge_metadata_file(src_yaml)
 
-    metadata_to_upload = munge_metadata(nci_dataset)
+    s3_dump(metadata_yaml, s3_url, S3)
+    return len(metadata_yaml.encode('utf-8'))
 
-    s3_dump(yaml.safe_dump(metadata_to_upload, default_flow_style=False), s3_url, S3)
 
+def munge_metadata_file(src_yaml):
+    """
+    Read, munge and re-emit a metadata file
+    :param src_yaml: metadata file in NCI
+    :return: yaml to upload
+    """
+    with open(src_yaml, 'rb') as fin:
+        nci_dataset = yaml.load(fin, Loader=YAML_LOADER)
 
-def munge_metadata(nci_dataset):
-    del nci_dataset['image']['bands']['nbart_blue']
-    del nci_dataset['image']['bands']['nbart_coastal_aerosol']
-    del nci_dataset['image']['bands']['nbart_contiguity']
-    del nci_dataset['image']['bands']['nbart_green']
-    del nci_dataset['image']['bands']['nbart_nir_1']
-    del nci_dataset['image']['bands']['nbart_nir_2']
-    del nci_dataset['image']['bands']['nbart_red']
-    del nci_dataset['image']['bands']['nbart_red_edge_1']
-    del nci_dataset['image']['bands']['nbart_red_edge_2']
-    del nci_dataset['image']['bands']['nbart_red_edge_3']
-    del nci_dataset['image']['bands']['nbart_swir_2']
-    del nci_dataset['image']['bands']['nbart_swir_3']
-    del nci_dataset['lineage']
-    nci_dataset['creation_dt'] = nci_dataset['extent']['center_dt']  # FIXME: WTF
-    nci_dataset['product_type'] = 'S2MSIARD_NBAR'
-    nci_dataset['original_id'] = nci_dataset['id']
-    nci_dataset['software_versions'].update({
-        's2_to_s3_rolling': {  # FIXME: Update
-            'repo': 'https://github.com/GeoscienceAustralia/dea-airflow/',
-            'version': '1.0.0'}
-    })
+    return yaml.dump(munge_metadata(nci_dataset), Dumper=YAML_DUMPER, default_flow_style=False)
 
-    # Create a deterministic dataset ID based on these inputs
-    nci_dataset['id'] = str(odc_uuid("s2_to_s3_rolling", "1.0.0", [nci_dataset['id']]))
+
+def munge_metadata(nci_dataset):
+    for *parents, key in METADATA_REMOVALS:
+        del _get_path(nci_dataset, parents)[key]
+    for (*parents, key), value in METADATA_OVERRIDES:
+        _get_path(nci_dataset, parents)[key] = value(nci_dataset)
     return nci_dataset
 
 
+def _get_path(doc, keys):
+    for key in keys:
+        doc = doc[key]
+    return doc
+
+
 class TqdmLoggingHandler(logging.Handler):
     def __init__(self, level=logging.NOTSET):
         super().__init__(level)
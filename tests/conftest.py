@@ -0,0 +1,91 @@
+"""
+Fixtures for testing the scripts against moto's in-process S3 and SNS
+
+Needs pytest and moto on top of the scripts' own dependencies:
+
+    python -m pytest tests
+"""
+import importlib.util
+import sys
+from pathlib import Path
+
+import boto3
+import pytest
+
+SCRIPTS_DIR = Path(__file__).parent.parent / "scripts"
+AWS_REGION = "ap-southeast-2"
+BUCKET = "dea-public-data"
+
+
+def load_script(name):
+    """
+    Import one of the scripts, whose file names aren't always valid module names
+
+    :param name: File name of the script without .py
+    :return: Module
+    """
+    module_name = name.replace("-", "_")
+    if module_name in sys.modules:
+        return sys.modules[module_name]
+    spec = importlib.util.spec_from_file_location(
+        module_name, SCRIPTS_DIR / f"{name}.py"
+    )
+    module = importlib.util.module_from_spec(spec)
+    # So its functions can be sent to process pools
+    sys.modules[module_name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+@pytest.fixture
+def aws(monkeypatch):
+    """
+    moto's S3 and SNS, with the bucket and a topic whose messages land in an
+    SQS queue
+
+    :return: Dict of the s3 and sqs clients, topic ARN and queue URL
+    """
+    moto = pytest.importorskip("moto")
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "testing")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "testing")
+    monkeypatch.setenv("AWS_DEFAULT_REGION", AWS_REGION)
+    monkeypatch.delenv("AWS_PROFILE", raising=False)
+    monkeypatch.delenv("AWS_ENDPOINT_URL", raising=False)
+    with moto.mock_aws():
+        s3 = boto3.client("s3")
+        s3.create_bucket(
+            Bucket=BUCKET, CreateBucketConfiguration={"LocationConstraint": AWS_REGION}
+        )
+        sns = boto3.client("sns")
+        sqs = boto3.client("sqs")
+        topic = sns.create_topic(Name="test")["TopicArn"]
+        queue_url = sqs.create_queue(QueueName="test")["QueueUrl"]
+        queue_arn = sqs.get_queue_attributes(
+            QueueUrl=queue_url, AttributeNames=["QueueArn"]
+        )["Attributes"]["QueueArn"]
+        sns.subscribe(TopicArn=topic, Protocol="sqs", Endpoint=queue_arn)
+        yield {"s3": s3, "sqs": sqs, "topic": topic, "queue_url": queue_url}
+
+
+@pytest.fixture
+def c3(aws, monkeypatch):
+    """
+    c3_to_s3_rolling, with fresh AWS clients for the mocked account and STAC
+    validation off, as it fetches the schemas
+    """
+    module = load_script("c3_to_s3_rolling")
+    module.close_transfer_manager()
+    monkeypatch.setattr(module, "_AWS_SESSION", None)
+    monkeypatch.setattr(module, "_AWS_CLIENTS", {})
+    monkeypatch.setattr(module, "RATE_CONTROLLER", module.RateController())
+    dc_to_stac = module.dc_to_stac
+    monkeypatch.setattr(
+        module, "dc_to_stac", lambda *args: dc_to_stac(*args[:-1], False)
+    )
+    yield module
+    module.close_transfer_manager()
+
+
+@pytest.fixture
+def benchmark():
+    return load_script("benchmark_uploaders")
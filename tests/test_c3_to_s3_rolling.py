@@ -0,0 +1,296 @@
+import json
+import os
+from datetime import date, datetime, timezone
+
+import pytest
+
+from conftest import BUCKET
+
+S3_ROOT = "baseline"
+FILE_SIZE = 1024
+
+
+@pytest.fixture
+def granules(tmp_path, benchmark):
+    """
+    Two synthetic granules and the csv file listing them
+
+    :return: Dict of the NCI dir, metadata files and csv file
+    """
+    nci_dir = tmp_path / "nci"
+    metadata_files = benchmark.make_c3_granules(nci_dir, 2, FILE_SIZE)
+    csv_file = tmp_path / "granules.csv"
+    write_csv(csv_file, metadata_files)
+    return {"nci_dir": nci_dir, "metadata_files": metadata_files, "csv": csv_file}
+
+
+def write_csv(csv_file, metadata_files, archived=False):
+    archived_date = f"{date.today()}" if archived else ""
+    csv_file.write_text(
+        "".join(
+            f"{metadata_file},{archived_date},{date.today()}\n"
+            for metadata_file in metadata_files
+        )
+    )
+
+
+def run_sync(c3, aws, granules, **kwargs):
+    """
+    Sync the granules, returning the stage counts of the run
+    """
+    c3.sync_granules(
+        [str(granules["csv"])],
+        str(granules["nci_dir"]),
+        S3_ROOT,
+        BUCKET,
+        "https://data.dea.ga.gov.au",
+        "https://explorer.dea.ga.gov.au",
+        kwargs.pop("sns_topic", aws["topic"]),
+        **kwargs,
+    )
+    return stage_counts(c3)
+
+
+def stage_counts(c3):
+    return {
+        stage: stats["count"] for stage, stats in c3.METRICS.summary()["stages"].items()
+    }
+
+
+def s3_keys(aws):
+    paginator = aws["s3"].get_paginator("list_objects_v2")
+    return {
+        obj["Key"]
+        for page in paginator.paginate(Bucket=BUCKET)
+        for obj in page.get("Contents", [])
+    }
+
+
+def granule_prefix(granules, metadata_file):
+    return f"{S3_ROOT}/{metadata_file.relative_to(granules['nci_dir']).parent}/"
+
+
+def sns_actions(aws):
+    """
+    Drain the queue subscribed to the topic
+
+    :return: List of the action attribute of each message
+    """
+    actions = []
+    while True:
+        messages = (
+            aws["sqs"]
+            .receive_message(QueueUrl=aws["queue_url"], MaxNumberOfMessages=10)
+            .get("Messages", [])
+        )
+        if not messages:
+            return actions
+        for message in messages:
+            body = json.loads(message["Body"])
+            actions.append(body["MessageAttributes"]["action"]["Value"])
+            aws["sqs"].delete_message(
+                QueueUrl=aws["queue_url"], ReceiptHandle=message["ReceiptHandle"]
+            )
+
+
+def test_sync_uploads_granules(c3, aws, granules):
+    stages = run_sync(c3, aws, granules, workers=2)
+
+    assert stages["data_sync"] == 2
+    keys = s3_keys(aws)
+    for metadata_file in granules["metadata_files"]:
+        prefix = granule_prefix(granules, metadata_file)
+        label = metadata_file.name.replace(".odc-metadata.yaml", "")
+        uploaded = {key[len(prefix) :] for key in keys if key.startswith(prefix)}
+        assert {
+            metadata_file.name,
+            f"{label}.stac-item.json",
+            f"{label}.sha1",
+        } <= uploaded
+        # NBAR bands are excluded, NBART and OA bands are synced
+        assert not any("_nbar_" in name or "nbar-" in name for name in uploaded)
+        assert (
+            sum("_nbart_" in name and name.endswith(".tif") for name in uploaded) == 6
+        )
+        assert any(name.endswith("_fmask.tif") for name in uploaded)
+    tif_key = next(key for key in keys if key.endswith("_fmask.tif"))
+    head = aws["s3"].head_object(Bucket=BUCKET, Key=tif_key)
+    assert head["ContentType"] == "image/tiff"
+    assert sns_actions(aws) == ["ADDED", "ADDED"]
+
+
+def test_rerun_skips_granules_in_s3(c3, aws, granules):
+    run_sync(c3, aws, granules)
+    sns_actions(aws)
+
+    stages = run_sync(c3, aws, granules)
+
+    assert "data_sync" not in stages
+    assert "metadata_upload" not in stages
+    assert sns_actions(aws) == []
+
+
+def test_force_update_skips_unchanged_granules(c3, aws, granules):
+    run_sync(c3, aws, granules)
+    sns_actions(aws)
+
+    stages = run_sync(c3, aws, granules, update=True)
+
+    assert "data_sync" not in stages
+    assert "metadata_upload" not in stages
+    assert "stac_upload" not in stages
+    assert sns_actions(aws) == []
+
+
+def test_force_update_resyncs_changed_granule(c3, aws, granules, benchmark):
+    run_sync(c3, aws, granules)
+    sns_actions(aws)
+
+    # Reprocess one band of the first granule
+    metadata_file = granules["metadata_files"][0]
+    band_file = next(metadata_file.parent.glob("*_nbart_*band02.tif"))
+    checksum = benchmark.write_fake_file(band_file, FILE_SIZE)
+    # Reprocessed after the upload, S3 keeps whole seconds
+    modified = band_file.stat().st_mtime + 2
+    os.utime(band_file, (modified, modified))
+    checksum_file = metadata_file.with_name(
+        metadata_file.name.replace(".odc-metadata.yaml", ".sha1")
+    )
+    checksum_file.write_text(
+        "".join(
+            (
+                f"{checksum}\t{band_file.name}\n"
+                if line.endswith(f"\t{band_file.name}")
+                else f"{line}\n"
+            )
+            for line in checksum_file.read_text().splitlines()
+        )
+    )
+
+    stages = run_sync(c3, aws, granules, update=True)
+
+    assert stages["data_sync"] == 1
+    key = f"{granule_prefix(granules, metadata_file)}{band_file.name}"
+    body = aws["s3"].get_object(Bucket=BUCKET, Key=key)["Body"].read()
+    assert body == band_file.read_bytes()
+
+
+def test_sync_granule_deletes_stale_files(c3, aws, granules):
+    run_sync(c3, aws, granules)
+    metadata_file = granules["metadata_files"][0]
+    prefix = granule_prefix(granules, metadata_file)
+    aws["s3"].put_object(Bucket=BUCKET, Key=f"{prefix}stale.tif", Body=b"stale")
+    aws["s3"].put_object(
+        Bucket=BUCKET, Key=f"{prefix}ga_ls8c_nbar_3-1-0_band01.tif", Body=b"nbar"
+    )
+
+    c3.sync_granule(
+        metadata_file.relative_to(granules["nci_dir"]).parent,
+        granules["nci_dir"],
+        S3_ROOT,
+        BUCKET,
+    )
+
+    keys = s3_keys(aws)
+    assert f"{prefix}stale.tif" not in keys
+    # Excluded files are left alone
+    assert f"{prefix}ga_ls8c_nbar_3-1-0_band01.tif" in keys
+    assert f"{prefix}{metadata_file.name}" in keys
+
+
+def test_archive_deletes_granules(c3, aws, granules):
+    run_sync(c3, aws, granules)
+    sns_actions(aws)
+
+    write_csv(granules["csv"], granules["metadata_files"][:1], archived=True)
+    run_sync(c3, aws, granules)
+
+    keys = s3_keys(aws)
+    assert not any(
+        key.startswith(granule_prefix(granules, granules["metadata_files"][0]))
+        for key in keys
+    )
+    assert any(
+        key.startswith(granule_prefix(granules, granules["metadata_files"][1]))
+        for key in keys
+    )
+    assert sns_actions(aws) == ["ARCHIVED"]
+
+
+def test_journal_resumes_failed_stages(c3, aws, granules, tmp_path):
+    journal = tmp_path / "journal.jsonl"
+    missing_topic = aws["topic"].replace(":test", ":missing")
+    with pytest.raises(c3.S3SyncException):
+        run_sync(c3, aws, granules, sns_topic=missing_topic, journal_path=str(journal))
+    assert sns_actions(aws) == []
+
+    stages = run_sync(c3, aws, granules, journal_path=str(journal))
+
+    # Only the SNS messages were left to do
+    assert "data_sync" not in stages
+    assert "metadata_upload" not in stages
+    assert "checksum_upload" not in stages
+    assert sns_actions(aws) == ["ADDED", "ADDED"]
+
+    stages = run_sync(c3, aws, granules, journal_path=str(journal))
+
+    assert "sns_publish" not in stages
+    assert sns_actions(aws) == []
+
+
+def test_transfer_concurrency_scales_with_workers(c3, monkeypatch):
+    monkeypatch.setattr(c3, "_AWS_CLIENT_CONFIG", c3._AWS_CLIENT_CONFIG)
+    monkeypatch.setattr(c3, "_TRANSFER_CONFIG", c3._TRANSFER_CONFIG)
+
+    c3.configure_aws_clients(16)
+
+    transfer_concurrency = 16 * c3.TRANSFER_CONCURRENCY_PER_WORKER
+    assert c3.get_transfer_manager().config.max_request_concurrency == (
+        transfer_concurrency
+    )
+    assert c3.get_aws_client("s3").meta.config.max_pool_connections == (
+        16 + transfer_concurrency
+    )
+
+
+def test_needs_upload_ignores_fractions_of_a_second(c3, tmp_path):
+    local_file = tmp_path / "band.tif"
+    local_file.write_bytes(b"band")
+    os.utime(local_file, (1600000000.7, 1600000000.7))
+    remote_object = {
+        "Bucket": BUCKET,
+        "Key": "band.tif",
+        "Size": 4,
+        "LastModified": datetime.fromtimestamp(1600000000, tz=timezone.utc),
+    }
+
+    assert not c3.needs_upload(local_file, remote_object, None)
+    os.utime(local_file, (1600000001, 1600000001))
+    assert c3.needs_upload(local_file, remote_object, None)
+
+
+def test_force_update_repairs_failed_sync(c3, aws, granules, monkeypatch):
+    metadata_file = granules["metadata_files"][0]
+    prefix = granule_prefix(granules, metadata_file)
+    sync_granule = c3.sync_granule
+
+    def failing_sync_granule(granule, *args):
+        if f"{S3_ROOT}/{granule}/" == prefix:
+            raise c3.S3SyncException("Failed uploading a band")
+        return sync_granule(granule, *args)
+
+    monkeypatch.setattr(c3, "sync_granule", failing_sync_granule)
+    with pytest.raises(c3.S3SyncException):
+        run_sync(c3, aws, granules)
+    checksum_key = (
+        f"{prefix}{metadata_file.name.replace('.odc-metadata.yaml', '.sha1')}"
+    )
+    assert checksum_key not in s3_keys(aws)
+
+    monkeypatch.setattr(c3, "sync_granule", sync_granule)
+    stages = run_sync(c3, aws, granules, update=True)
+
+    assert stages["data_sync"] == 1
+    keys = s3_keys(aws)
+    assert checksum_key in keys
+    assert any(key.startswith(prefix) and key.endswith("_fmask.tif") for key in keys)
@@ -0,0 +1,209 @@
+import csv
+import gzip
+import json
+import resource
+import subprocess
+import sys
+
+import pytest
+
+from conftest import SCRIPTS_DIR, load_script
+
+MODES = ["memory", "external", "hashed", "partitioned"]
+
+
+@pytest.fixture
+def lists(tmp_path):
+    """
+    Two lists of S3 URLs, overlapping and with repeated lines
+
+    :return: Dict of the paths of both lists and the expected differences
+    """
+    lines1 = [f"s3://bucket/a/{number:05}.yaml" for number in range(0, 3000)]
+    lines2 = [f"s3://bucket/a/{number:05}.yaml" for number in range(2000, 4000)]
+    file1, file2 = tmp_path / "a.txt", tmp_path / "b.txt"
+    # Reversed, so the lists aren't already sorted
+    file1.write_text("".join(f"{line}\n" for line in reversed(lines1 + lines1[:10])))
+    file2.write_text("".join(f"{line}\n" for line in reversed(lines2 + lines2[-10:])))
+    return {
+        "file1": file1,
+        "file2": file2,
+        "a_only": set(lines1) - set(lines2),
+        "b_only": set(lines2) - set(lines1),
+        "both": set(lines1) & set(lines2),
+    }
+
+
+def in_file_order(path, lines):
+    """
+    The lines in the order they are first listed in a file
+    """
+    return [
+        line for line in dict.fromkeys(path.read_text().splitlines()) if line in lines
+    ]
+
+
+def compare_lists(*args, open_files=None):
+    """
+    Run compare-lists.py, under a soft limit of open files if given
+
+    :return: Lines printed
+    """
+
+    def limit_open_files():
+        _, hard_limit = resource.getrlimit(resource.RLIMIT_NOFILE)
+        resource.setrlimit(resource.RLIMIT_NOFILE, (open_files, hard_limit))
+
+    result = subprocess.run(
+        [sys.executable, str(SCRIPTS_DIR / "compare-lists.py"), *map(str, args)],
+        check=True,
+        capture_output=True,
+        text=True,
+        preexec_fn=limit_open_files if open_files else None,
+    )
+    return result.stdout.splitlines()
+
+
+@pytest.mark.parametrize("mode", MODES)
+def test_prints_lines_missing_from_second_list(lists, mode):
+    lines = compare_lists(
+        lists["file1"], lists["file2"], "--mode", mode, "--partitions", 8
+    )
+
+    if mode == "hashed":
+        assert lines == in_file_order(lists["file1"], lists["a_only"])
+    else:
+        assert lines == sorted(lists["a_only"])
+
+
+@pytest.mark.parametrize("bits", ["64", "128"])
+def test_hashed_output_dir(lists, bits, tmp_path):
+    output_dir = tmp_path / "diff"
+    compare_lists(
+        lists["file1"],
+        lists["file2"],
+        "--mode",
+        "hashed",
+        "--fingerprint-bits",
+        bits,
+        "--output-dir",
+        output_dir,
+    )
+
+    for side, name, path in [
+        ("a_only", "a_minus_b.txt", lists["file1"]),
+        ("b_only", "b_minus_a.txt", lists["file2"]),
+        ("both", "a_and_b.txt", lists["file1"]),
+    ]:
+        lines = (output_dir / name).read_text().splitlines()
+        assert lines == in_file_order(path, lists[side])
+
+
+@pytest.mark.parametrize("mode", MODES)
+def test_output_dir(lists, mode, tmp_path):
+    output_dir = tmp_path / "diff"
+    compare_lists(
+        lists["file1"],
+        lists["file2"],
+        "--mode",
+        mode,
+        "--partitions",
+        8,
+        "--output-dir",
+        output_dir,
+    )
+
+    for side, name in [
+        ("a_only", "a_minus_b.txt"),
+        ("b_only", "b_minus_a.txt"),
+        ("both", "a_and_b.txt"),
+    ]:
+        lines = (output_dir / name).read_text().splitlines()
+        assert len(lines) == len(set(lines))
+        assert set(lines) == lists[side]
+
+
+def test_partitions_fit_limit_of_open_files(lists, tmp_path):
+    output_dir = tmp_path / "diff"
+    compare_lists(
+        lists["file1"],
+        lists["file2"],
+        "--mode",
+        "partitioned",
+        "--partitions",
+        1000,
+        "--output-dir",
+        output_dir,
+        open_files=128,
+    )
+
+    for side, name in [
+        ("a_only", "a_minus_b.txt"),
+        ("b_only", "b_minus_a.txt"),
+        ("both", "a_and_b.txt"),
+    ]:
+        assert (output_dir / name).read_text().splitlines() == sorted(lists[side])
+
+
+def test_external_merges_many_runs(lists, tmp_path, monkeypatch):
+    compare_lists_module = load_script("compare-lists")
+    monkeypatch.setattr(compare_lists_module, "MAX_MERGE_FAN_IN", 4)
+
+    # About 50 lines a run
+    lines = list(
+        compare_lists_module.diff_external(
+            str(lists["file1"]), str(lists["file2"]), ["a_only", "both"], 5000, tmp_path
+        )
+    )
+
+    assert [line for side, line in lines if side == "a_only"] == sorted(lists["a_only"])
+    assert [line for side, line in lines if side == "both"] == sorted(lists["both"])
+
+
+@pytest.mark.parametrize("mode", MODES)
+def test_inventory_input(lists, mode, tmp_path):
+    # A local copy of an inventory destination, <date>/manifest.json and data/
+    inventory_dir = tmp_path / "inventory"
+    (inventory_dir / "data").mkdir(parents=True)
+    (inventory_dir / "2020-01-01T00-00Z").mkdir()
+    files = []
+    keys = sorted(
+        line[len("s3://bucket/") :] for line in lists["b_only"] | lists["both"]
+    )
+    for part, start in enumerate(range(0, len(keys), 700)):
+        inventory_file = inventory_dir / "data" / f"part-{part}.csv.gz"
+        with gzip.open(inventory_file, "wt", newline="") as f:
+            writer = csv.writer(f)
+            for key in keys[start : start + 700]:
+                writer.writerow(["bucket", key, "1024"])
+            writer.writerow(["bucket", "b/other.tif", "1024"])
+        files.append({"key": f"inventory/bucket/data/{inventory_file.name}"})
+    manifest = inventory_dir / "2020-01-01T00-00Z" / "manifest.json"
+    manifest.write_text(
+        json.dumps(
+            {
+                "sourceBucket": "bucket",
+                "destinationBucket": "arn:aws:s3:::inventory",
+                "fileFormat": "CSV",
+                "fileSchema": "Bucket, Key, Size",
+                "files": files,
+            }
+        )
+    )
+
+    lines = compare_lists(
+        lists["file1"],
+        manifest,
+        "--mode",
+        mode,
+        "--partitions",
+        8,
+        "--prefix",
+        "a/",
+        "--suffix",
+        ".yaml",
+        "--inventory-workers",
+        2,
+    )
+
+    assert set(lines) == lists["a_only"]
@@ -0,0 +1,103 @@
+import pytest
+from boto3.s3.transfer import TransferConfig, create_transfer_manager
+
+from conftest import BUCKET, load_script
+
+pytest.importorskip("odc.aws")
+pytest.importorskip("odc.index")
+
+GRANULE_ID = "2020-01-01/S2A_OPER_MSI_ARD_TL_EPAE_20200101T000000_A000000_T55HFA_N02.09"
+
+
+@pytest.fixture
+def upload_s2(aws, tmp_path, monkeypatch):
+    module = load_script("upload_s2")
+    transfer_manager = create_transfer_manager(aws["s3"], TransferConfig())
+    monkeypatch.setattr(module, "S3", aws["s3"])
+    monkeypatch.setattr(module, "TRANSFER_MANAGER", transfer_manager)
+    monkeypatch.setattr(module, "NCI_DIR", str(tmp_path / "nci"))
+    yield module
+    transfer_manager.shutdown()
+
+
+@pytest.fixture
+def granule(upload_s2, benchmark):
+    """
+    A synthetic granule synced to S3
+
+    :return: S3 prefix of the granule
+    """
+    benchmark.make_s2_granules(upload_s2.NCI_DIR, 1, 1024)
+    upload_s2.upload_dataset_without_yaml(GRANULE_ID, BUCKET)
+    return f"{upload_s2.S3_PATH}/{GRANULE_ID}/"
+
+
+def s3_keys(aws, prefix):
+    response = aws["s3"].list_objects_v2(Bucket=BUCKET, Prefix=prefix)
+    return {obj["Key"] for obj in response.get("Contents", [])}
+
+
+def test_sync_uploads_granule(upload_s2, aws, granule):
+    keys = s3_keys(aws, granule)
+
+    assert f"{granule}QA/FMASK.TIF" in keys
+    assert sum(key.startswith(f"{granule}NBAR/") for key in keys) == 12
+    assert not any(key.startswith(f"{granule}NBART/") for key in keys)
+
+
+def test_sync_deletes_stale_files(upload_s2, aws, granule):
+    aws["s3"].put_object(Bucket=BUCKET, Key=f"{granule}NBAR/STALE.TIF", Body=b"")
+
+    upload_s2.upload_dataset_without_yaml(GRANULE_ID, BUCKET)
+
+    assert f"{granule}NBAR/STALE.TIF" not in s3_keys(aws, granule)
+
+
+def test_missing_granule_deletes_nothing(upload_s2, aws, granule, tmp_path):
+    keys = s3_keys(aws, granule)
+    (tmp_path / "nci").rename(tmp_path / "unmounted")
+
+    with pytest.raises(RuntimeError, match="not a directory"):
+        upload_s2.upload_dataset_without_yaml(GRANULE_ID, BUCKET)
+
+    assert s3_keys(aws, granule) == keys
+
+
+def test_empty_granule_deletes_nothing(upload_s2, aws, granule, tmp_path):
+    keys = s3_keys(aws, granule)
+    for local_file in sorted((tmp_path / "nci").rglob("*"), reverse=True):
+        if local_file.is_file():
+            local_file.unlink()
+
+    with pytest.raises(RuntimeError, match="no files found"):
+        upload_s2.upload_dataset_without_yaml(GRANULE_ID, BUCKET)
+
+    assert s3_keys(aws, granule) == keys
+
+
+def test_upload_metrics_histogram(upload_s2):
+    metrics = upload_s2.UploadMetrics()
+    metrics.submitted(1000)
+    for number in range(1, 1001):
+        metrics.started()
+        metrics.finished(number / 10, 1024, failed=number % 100 == 0)
+
+    summary = metrics.summary()
+
+    assert summary["completed"] == 990
+    assert summary["failed"] == 10
+    assert summary["latency_p50"] == pytest.approx(50, rel=0.26)
+    assert summary["latency_p95"] == pytest.approx(95, rel=0.26)
+    assert summary["latency_sum"] == pytest.approx(50050)
+    assert dict(summary["latency_buckets"]) == {
+        1: 10,
+        2: 20,
+        5: 50,
+        10: 100,
+        30: 300,
+        60: 600,
+        120: 1000,
+        300: 1000,
+        600: 1000,
+        float("inf"): 1000,
+    }